@@ -5,11 +5,14 @@ from config import (
     IMG_DIR, MAX_IMG_W, MAX_IMG_H, MD_IMG
 )
 
-from kg import Neo4jKG, _ask_user_for_topic, _infer_topic_from_question
+from kg import Neo4jKG, open_kg, _ask_user_for_topic, _infer_topic_from_question
+from kg_snapshot import SnapshotKG, export_snapshot
+from kg_async import AsyncNeo4jKG, open_async_kg
 from ocr_pdf import load_arabic_pdf
 from retrieval import build_retriever, ChapterRetrieverInput, ChapterRetrieverTool
+from corpus import Book, CorpusManager, CorpusRetrieverTool
 from agents import build_llm, define_agents
-from pdf_report import SessionMemory, render_pdf
+from pdf_report import SessionMemory, render_pdf, render_pdf_bytes
 from cli import run_cli
 from images import fetch_lesson_images
 from utils_text import (
@@ -22,9 +25,11 @@ __all__ = [
     "URI","USER","PASSWORD","ARABIC_FONT_PATH","ARABIC_FONT_NAME",
     "IMG_DIR","MAX_IMG_W","MAX_IMG_H","MD_IMG",
     # core classes & functions
-    "Neo4jKG","_ask_user_for_topic","_infer_topic_from_question",
+    "Neo4jKG","open_kg","SnapshotKG","export_snapshot","AsyncNeo4jKG","open_async_kg",
+    "_ask_user_for_topic","_infer_topic_from_question",
     "load_arabic_pdf","build_retriever","ChapterRetrieverInput","ChapterRetrieverTool",
-    "build_llm","define_agents","SessionMemory","render_pdf","run_cli",
+    "Book","CorpusManager","CorpusRetrieverTool",
+    "build_llm","define_agents","SessionMemory","render_pdf","render_pdf_bytes","run_cli",
     "fetch_lesson_images",
     # utils
     "rtl","cosine_similarity","wrap_arabic","strip_unsupported",
@@ -0,0 +1,233 @@
+"""
+Nearest-neighbour indexes for lesson / chunk embeddings (cosine similarity).
+
+* ExactIndex – brute-force matrix product; exact, best for small corpora.
+* IVFIndex   – inverted-file index: spherical k-means centroids, each
+               vector filed under its nearest centroid; a query only scans
+               the `nprobe` closest lists. Incremental `add`, retrains when
+               the corpus has grown `retrain_growth`× since the last training.
+
+`build_index(kind="auto")` picks ExactIndex below `exact_below` vectors.
+Both indexes persist to a single .npz (vectors + payloads, plus centroids
+for IVF) and are restored with `load_index`. The lesson index is built
+over the memory-mapped vectors of lesson_vectors.py, without copying them.
+"""
+from __future__ import annotations
+import json
+import math
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, dim: int | None = None):
+        self.dim = dim
+        self._vecs = np.zeros((0, dim or 0), dtype=np.float32)
+        self._n = 0
+        self.payloads: list[dict] = []
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vecs[:self._n]
+
+    def add(self, vectors: Sequence[Sequence[float]] | np.ndarray, payloads: Sequence[dict]) -> None:
+        x = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(payloads), -1))
+        if self.dim is None or self._vecs.shape[1] == 0:
+            self.dim = x.shape[1]
+            self._vecs = np.zeros((0, self.dim), dtype=np.float32)
+        if x.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-d vectors, got {x.shape[1]}-d")
+        need = self._n + len(x)
+        if need > len(self._vecs):                         # amortized growth
+            grown = np.zeros((max(need, 2 * len(self._vecs), 64), self.dim), dtype=np.float32)
+            grown[:self._n] = self._vecs[:self._n]
+            self._vecs = grown
+        self._vecs[self._n:need] = x
+        self._n = need
+        self.payloads.extend(payloads)
+        self._added(self._n - len(x), x)
+
+    def _added(self, first_row: int, x: np.ndarray) -> None:
+        pass
+
+    def _wrap(self, vectors: np.ndarray, payloads: Sequence[dict]) -> None:
+        """Use already-normalized `vectors` (e.g. a read-only memmap) in place; a later `add` copies."""
+        self._vecs, self._n, self.dim = vectors, len(vectors), vectors.shape[1]
+        self.payloads = list(payloads)
+
+    def _candidates(self, q: np.ndarray) -> np.ndarray | None:
+        return None                                        # None → scan everything
+
+    def search(self, query: Sequence[float], k: int = 1) -> list[tuple[float, dict]]:
+        """Top-k (cosine score, payload), best first."""
+        if not self._n:
+            return []
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        rows = self._candidates(q)
+        scores = self.vectors @ q if rows is None else self._vecs[rows] @ q
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        ids = top if rows is None else rows[top]
+        return [(float(scores[t]), self.payloads[i]) for t, i in zip(top, ids)]
+
+    # ─ persistence ─────────────────────────────────────────────────
+    def _extra_arrays(self) -> dict:
+        return {}
+
+    def _meta(self) -> dict:
+        return {"kind": self.kind, "dim": self.dim}
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {**self._meta(), "payloads": self.payloads}
+        with open(path, "wb") as f:
+            np.savez(f, vectors=self.vectors, meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                     **self._extra_arrays())
+
+
+class IVFIndex(ExactIndex):
+    kind = "ivf"
+
+    def __init__(self, dim: int | None = None, nlist: int = 0, nprobe: int = 8,
+                 n_iter: int = 12, retrain_growth: float = 4.0, min_train: int = 256, seed: int = 0):
+        """
+        nlist  : number of inverted lists (0 → ≈ 4·√n at training time)
+        nprobe : lists scanned per query — the recall / latency knob
+        """
+        super().__init__(dim)
+        self.nlist, self.nprobe, self.n_iter = nlist, nprobe, n_iter
+        self.retrain_growth, self.min_train, self.seed = retrain_growth, min_train, seed
+        self.centroids: np.ndarray | None = None
+        self._lists: list[list[int]] = []
+        self._trained_at = 0
+
+    def train(self) -> None:
+        x = self.vectors
+        n = len(x)
+        nlist = min(n, self.nlist or max(1, int(4 * math.sqrt(n))))
+        rng = np.random.default_rng(self.seed)
+        c = x[rng.choice(n, nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = np.argmax(x @ c.T, axis=1)
+            for j in range(nlist):
+                members = x[assign == j]
+                c[j] = members.mean(axis=0) if len(members) else x[rng.integers(n)]
+            c = _normalize(c)
+        self.centroids = c
+        assign = np.argmax(x @ c.T, axis=1)
+        self._lists = [[] for _ in range(nlist)]
+        for row, j in enumerate(assign):
+            self._lists[j].append(row)
+        self._trained_at = n
+
+    def _added(self, first_row: int, x: np.ndarray) -> None:
+        if self.centroids is None:
+            if self._n >= self.min_train:
+                self.train()
+            return
+        if self._n >= self.retrain_growth * self._trained_at:
+            self.train()
+            return
+        for row, j in enumerate(np.argmax(x @ self.centroids.T, axis=1), start=first_row):
+            self._lists[j].append(row)
+
+    def _candidates(self, q: np.ndarray) -> np.ndarray | None:
+        if self.centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        rows = [r for j in probe for r in self._lists[j]]
+        return np.asarray(rows, dtype=np.int64) if rows else None
+
+    def _extra_arrays(self) -> dict:
+        if self.centroids is None:
+            return {}
+        assign = np.empty(self._n, dtype=np.int32)
+        for j, rows in enumerate(self._lists):
+            assign[rows] = j
+        return {"centroids": self.centroids, "assign": assign}
+
+    def _meta(self) -> dict:
+        return {**super()._meta(), "nlist": self.nlist, "nprobe": self.nprobe,
+                "n_iter": self.n_iter, "retrain_growth": self.retrain_growth,
+                "min_train": self.min_train, "seed": self.seed, "trained_at": self._trained_at}
+
+
+def build_index(vectors, payloads: Sequence[dict], kind: str = "auto", exact_below: int = 5000,
+                nlist: int = 0, nprobe: int = 8, normalized: bool = False) -> ExactIndex:
+    """
+    kind       : 'exact' | 'ivf' | 'auto' (exact below `exact_below` vectors)
+    normalized : `vectors` is an L2-normalized 2-d array, used as is (no copy)
+    """
+    if kind == "auto":
+        kind = "exact" if len(payloads) < exact_below else "ivf"
+    if kind == "exact":
+        index = ExactIndex()
+    elif kind == "ivf":
+        index = IVFIndex(nlist=nlist, nprobe=nprobe, min_train=1)
+    else:
+        raise ValueError(f"unknown index kind {kind!r}")
+    if normalized:
+        index._wrap(vectors, payloads)
+        if kind == "ivf" and len(payloads):
+            index.train()
+    elif len(payloads):
+        index.add(vectors, payloads)
+    return index
+
+
+def load_index(path: str | Path) -> ExactIndex:
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(str(z["meta"]))
+        if meta["kind"] == "ivf":
+            index = IVFIndex(meta["dim"], meta["nlist"], meta["nprobe"], meta["n_iter"],
+                             meta["retrain_growth"], meta["min_train"], meta["seed"])
+        else:
+            index = ExactIndex(meta["dim"])
+        vectors = z["vectors"]
+        index._vecs = vectors.astype(np.float32).reshape(len(vectors), -1)
+        index._n = len(vectors)
+        index.dim = index._vecs.shape[1]
+        index.payloads = meta["payloads"]
+        if "centroids" in z.files:
+            index.centroids = z["centroids"]
+            index._lists = [[] for _ in range(len(index.centroids))]
+            for row, j in enumerate(z["assign"]):
+                index._lists[j].append(row)
+            index._trained_at = meta["trained_at"]
+    return index
+
+
+# ─────────────────────────── lesson index ────────────────────────────
+def build_lesson_index(kg, kind: str | None = None) -> ExactIndex:
+    """Index every lesson embedding in `kg`; payloads are {'topic', 'lesson'}."""
+    from config import LESSON_INDEX_KIND, ANN_EXACT_BELOW, ANN_NLIST, ANN_NPROBE
+    rows = kg.fetch_all_lesson_embeddings()
+    return build_index([r["embedding"] for r in rows],
+                       [{"topic": r["topic"], "lesson": r["lesson"]} for r in rows],
+                       kind=kind or LESSON_INDEX_KIND, exact_below=ANN_EXACT_BELOW,
+                       nlist=ANN_NLIST, nprobe=ANN_NPROBE)
+
+
+def load_or_build_lesson_index(kg, path: str | Path | None = None) -> ExactIndex:
+    """Lesson index over the memory-mapped lesson vectors (re-exported from `kg` when missing or stale)."""
+    from config import LESSON_INDEX_KIND, ANN_EXACT_BELOW, ANN_NLIST, ANN_NPROBE
+    from lesson_vectors import open_lesson_vectors
+    vecs = open_lesson_vectors(kg, path)
+    return build_index(vecs.vectors, vecs.payloads(), kind=LESSON_INDEX_KIND, exact_below=ANN_EXACT_BELOW,
+                       nlist=ANN_NLIST, nprobe=ANN_NPROBE, normalized=True)
@@ -1,8 +1,11 @@
 from __future__ import annotations
+import asyncio
 import os
+import time
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 
 # Make sure OCR env is good on Windows BEFORE importing config
@@ -17,12 +20,26 @@ try:
 except Exception:
     pass
 
-from config import URI, USER, PASSWORD
-from kg import Neo4jKG
-from pdf_report import render_pdf
+from config import (
+    DEBUG_TIMINGS, SUMMARY_FLIGHT_TIMEOUT, QUIZ_FLIGHT_TIMEOUT, TOPIC_LIST_TTL,
+    BATCH_WORKERS, BATCH_RATE_PER_MIN, BATCH_MAX_ITEMS, BATCH_JOBS_KEPT,
+)
+from kg import open_kg
+from kg_async import open_async_kg
+from pdf_report import render_pdf_bytes
+from session_digest import feedback_parts
+from utils_text import normalize_arabic
+import metrics
 
-from runtime import GLOBAL_MEM
+from runtime import SESSION_COMPACT
 from handlers import generate_summary_json, handle_qa, generate_quiz_json
+from quiz_bank import open_quiz_bank
+from singleflight import FLIGHTS, flight_key
+from report_store import open_report_store
+from llm_call import FallbackOutput
+from batch import BatchRunner, KINDS
+from profiling import open_profiler
+from shared_state import open_shared_state, SessionStore
 
 app = FastAPI()
 app.add_middleware(
@@ -38,7 +55,99 @@ os.makedirs(REPORTS_DIR, exist_ok=True)
 app.mount("/lessons", StaticFiles(directory=LESSONS_DIR), name="lesson_files")
 app.mount("/reports", StaticFiles(directory=REPORTS_DIR), name="reports")
 
-neo_kg = Neo4jKG(URI, USER, PASSWORD)
+neo_kg = open_kg()   # Neo4j or local snapshot, per config.KG_BACKEND
+async_kg = open_async_kg()   # pooled async driver for topic prefetch (None → use neo_kg)
+
+async def topic_bundle(topic: str) -> dict:
+    """Branch, lessons and images of a topic without blocking the event loop."""
+    if async_kg is not None:
+        return await async_kg.fetch_topic_bundle(topic)
+    return await run_in_threadpool(neo_kg.fetch_topic_bundle, topic)
+
+_TOPICS = {"at": float("-inf"), "by_norm": {}}
+
+async def kg_topic(module: str) -> str:
+    """
+    The KG's spelling of `module` (matched Arabic-normalized), else `module`.
+    Flights are keyed on normalized names, so the leader must look up the
+    same topic every follower would have found.
+    """
+    norm = normalize_arabic(module)
+    if norm not in _TOPICS["by_norm"] or time.monotonic() - _TOPICS["at"] > TOPIC_LIST_TTL:
+        if time.monotonic() - _TOPICS["at"] > 1.0:      # unknown names refresh the list at most once a second
+            if async_kg is not None:
+                topics = await async_kg.list_all_topics()
+            else:
+                topics = await run_in_threadpool(neo_kg.list_all_topics)
+            _TOPICS.update(at=time.monotonic(), by_norm={normalize_arabic(t): t for t in topics})
+    return _TOPICS["by_norm"].get(norm, module)
+
+SHARED = open_shared_state()         # what any serve.py worker may read back (None → this process)
+SESSIONS = SessionStore(SHARED, compact=SESSION_COMPACT)   # session memory, by session_id
+QUIZ_BANK = open_quiz_bank(neo_kg, SHARED)   # pre-generated questions per topic, topped up in the background
+REPORTS = open_report_store(SHARED)  # rendered session reports, by id
+BATCHES = BatchRunner(neo_kg, QUIZ_BANK, workers=BATCH_WORKERS, per_minute=BATCH_RATE_PER_MIN,
+                      keep=BATCH_JOBS_KEPT, shared=SHARED)
+PROFILER = open_profiler(SHARED)     # X-Profile: 1 + X-Admin-Token, or PROFILE_SAMPLE_RATE of all requests
+
+@app.on_event("shutdown")
+async def close_kg():
+    from runtime import LLM_INVOKER
+    BATCHES.close()
+    QUIZ_BANK.close()
+    REPORTS.close()
+    LLM_INVOKER.close()
+    if async_kg is not None:
+        await async_kg.close()
+    neo_kg.close()
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    token = metrics.start_request()
+    kind = PROFILER.wants(request.headers, request.query_params)
+    prof = PROFILER.start(kind, request.url.path) if kind else None
+    prof_token = metrics.start_profile(prof) if prof else None
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - t0
+        timings = metrics.end_request(token)
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        metrics.REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=status)
+        metrics.REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+        if prof is not None:
+            metrics.end_profile(prof_token)
+            await run_in_threadpool(PROFILER.finish, prof, elapsed)
+    if prof is not None and prof.kind == "admin":
+        response.headers["X-Profile-Id"] = prof.id
+    if DEBUG_TIMINGS:
+        timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/profiles")
+async def list_profiles(request: Request):
+    if not PROFILER.is_admin(request.headers.get("x-admin-token")):
+        return JSONResponse({"error": "admin token required"}, status_code=403)
+    return {"profiles": await run_in_threadpool(PROFILER.list)}
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """Folded stacks: flamegraph.pl / speedscope / inferno-flamegraph read them as is."""
+    if not PROFILER.is_admin(request.headers.get("x-admin-token")):
+        return JSONResponse({"error": "admin token required"}, status_code=403)
+    prof = await run_in_threadpool(PROFILER.get, profile_id)
+    if prof is None:
+        return JSONResponse({"error": "profile not found"}, status_code=404)
+    return PlainTextResponse(prof.folded(), headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
 
 @app.get("/health")
 async def health():
@@ -48,15 +157,25 @@ async def health():
 async def summary_endpoint(req: Request):
     body = await req.json()
     mod = body.get("module", "").strip()
+    session_id = str(body.get("session_id", "default"))
     if not mod:
         return JSONResponse({"error": "module is required"}, status_code=400)
     try:
+        mod = await kg_topic(mod)
         user_in = f"ملخص محور {mod}"
-        result  = generate_summary_json(user_in, neo_kg)
-        GLOBAL_MEM.log("chapter_summary", result["data"])
+
+        async def work():
+            bundle = await topic_bundle(mod)
+            return await run_in_threadpool(generate_summary_json, user_in, neo_kg, bundle)
+
+        # identical concurrent requests (a whole class opening the chapter) share one generation
+        result, _ = await FLIGHTS.do(flight_key("summary", mod), work, timeout=SUMMARY_FLIGHT_TIMEOUT)
+        await run_in_threadpool(SESSIONS.update, session_id, lambda mem: mem.log("chapter_summary", result["data"]))
         return JSONResponse(result)
     except LookupError as e:
         return JSONResponse({"error": str(e)}, status_code=404)
+    except (asyncio.TimeoutError, TimeoutError):
+        return JSONResponse({"error": "summary generation timed out"}, status_code=504)
     except Exception as e:
         return JSONResponse({"error": "internal failure", "details": str(e)}, status_code=500)
 
@@ -64,16 +183,19 @@ async def summary_endpoint(req: Request):
 async def qa_endpoint(req: Request):
     body     = await req.json()
     question = body.get("question", "").strip()
+    session_id = str(body.get("session_id", "default"))
     if not question:
         return JSONResponse({"error": "question is required"}, status_code=400)
     try:
-        # reuse the same embedding instance as your retriever (imported inside handler)
-        from runtime import RETRIEVER
-        answer = handle_qa(question, neo_kg, RETRIEVER.base_retriever.vectorstore._embedding_function)
-        GLOBAL_MEM.log("qa_history", (question, answer))
+        # reuse the embedding instance shared by the book indexes
+        from runtime import EMB
+        answer = await run_in_threadpool(handle_qa, question, neo_kg, EMB)
+        await run_in_threadpool(SESSIONS.update, session_id, lambda mem: mem.add_qa(question, answer))
         return JSONResponse(answer)
     except LookupError as e:
         return JSONResponse({"error": str(e)}, status_code=404)
+    except TimeoutError:
+        return JSONResponse({"error": "answer generation timed out"}, status_code=504)
     except Exception as e:
         return JSONResponse({"error": "internal failure", "details": str(e)}, status_code=500)
 
@@ -81,47 +203,121 @@ async def qa_endpoint(req: Request):
 async def quiz_endpoint(req: Request):
     body   = await req.json()
     module = body.get("module", "").strip()
-    num_mc = int(body.get("num_mc", 6))
-    num_tf = int(body.get("num_tf", 4))
+    try:
+        num_mc = int(body.get("num_mc", 6))
+        num_tf = int(body.get("num_tf", 4))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "num_mc and num_tf must be integers"}, status_code=400)
+    session_id = str(body.get("session_id", "default"))
     if not module:
         return JSONResponse({"error": "module is required"}, status_code=400)
+    if num_mc < 0 or num_tf < 0:
+        return JSONResponse({"error": "num_mc and num_tf must not be negative"}, status_code=400)
     try:
-        result = generate_quiz_json(module, neo_kg, num_mc=num_mc, num_tf=num_tf)
-        GLOBAL_MEM["quiz_log"] = result["data"]["questions"]
-        GLOBAL_MEM["quiz_results"] = {"correct": 0, "incorrect": len(result["data"]["questions"])}
+        module = await kg_topic(module)
+        data = await run_in_threadpool(QUIZ_BANK.sample, module, num_mc, num_tf, session_id)
+        if data is not None:
+            result = {"module": module, "data": data, "source": "bank"}
+        else:
+            # pool too small (a background top-up is now queued): generate live and keep the questions
+            async def work():
+                bundle = await topic_bundle(module)
+                return await run_in_threadpool(
+                    generate_quiz_json, module, neo_kg, num_mc=num_mc, num_tf=num_tf, bundle=bundle
+                )
+
+            result, _ = await FLIGHTS.do(flight_key("quiz", module, num_mc, num_tf), work,
+                                         timeout=QUIZ_FLIGHT_TIMEOUT)
+            if result["data"]:
+                await run_in_threadpool(QUIZ_BANK.add, module, result["data"].get("questions", []), session_id)
+        questions = result["data"]["questions"]
+
+        def log_quiz(mem):
+            mem["quiz_log"] = questions
+            mem["quiz_results"] = {"correct": 0, "incorrect": len(questions)}
+        await run_in_threadpool(SESSIONS.update, session_id, log_quiz)
         return JSONResponse(result)
     except LookupError as e:
         return JSONResponse({"error": str(e)}, status_code=404)
+    except (asyncio.TimeoutError, TimeoutError):
+        return JSONResponse({"error": "quiz generation timed out"}, status_code=504)
     except Exception as e:
         return JSONResponse({"error": "internal failure", "details": str(e)}, status_code=500)
 
+@app.post("/batch")
+async def batch_endpoint(req: Request):
+    body    = await req.json()
+    modules = [str(m) for m in body.get("modules", []) if str(m).strip()]
+    kinds   = body.get("kinds", list(KINDS))
+    if not modules:
+        return JSONResponse({"error": "modules is required"}, status_code=400)
+    if len(modules) * len(kinds) > BATCH_MAX_ITEMS:
+        return JSONResponse({"error": f"at most {BATCH_MAX_ITEMS} items per batch"}, status_code=400)
+    try:
+        job = BATCHES.submit(modules, kinds, num_mc=int(body.get("num_mc", 6)), num_tf=int(body.get("num_tf", 4)))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"job_id": job.id, "status_url": f"/batch/{job.id}", "total": len(job.items)},
+                        status_code=202)
+
+@app.get("/batch/{job_id}")
+async def batch_status(job_id: str):
+    progress = await run_in_threadpool(BATCHES.progress, job_id)
+    if progress is None:
+        return JSONResponse({"error": "batch job not found"}, status_code=404)
+    return JSONResponse(progress)
+
+def _pdf_response(pdf: bytes, filename: str) -> Response:
+    return Response(pdf, media_type="application/pdf", headers={
+        "Content-Disposition": f'inline; filename="{filename}"',
+        "Cache-Control": "private, no-store",
+    })
+
 @app.post("/finish")
-async def finish():
-    # assemble a light feedback prompt and render the PDF report
-    parts = []
-    if "chapter_summary" in GLOBAL_MEM:
-        parts.append("ملخّص الدرس:\n" + str(GLOBAL_MEM["chapter_summary"]))
-    if "qa_history" in GLOBAL_MEM:
-        qa_lines = [f"❓ {q}\n📥 {a}" for q, a in GLOBAL_MEM["qa_history"]]
-        parts.append("الأسئلة و الأجوبة:\n" + "\n".join(qa_lines))
-    if "quiz_log" in GLOBAL_MEM:
-        quiz_lines = [f"{i+1}) {q.get('q')} – الصحيح: {q.get('a')}" for i, q in enumerate(GLOBAL_MEM["quiz_log"])]
-        parts.append("تفاصيل الاختبار:\n" + "\n".join(quiz_lines))
+async def finish(req: Request):
+    try:
+        body = await req.json()
+    except ValueError:
+        body = {}                       # the body is optional
+    session_id = str(body.get("session_id", "default"))
+    stream = req.query_params.get("stream") == "1" or bool(body.get("stream"))
+
+    # bounded feedback prompt (summary head, Q&A digest, quiz) and the PDF report
+    mem = await run_in_threadpool(SESSIONS.get, session_id)
+    parts = feedback_parts(mem)
 
     fb_prompt = (
         "أنت أخصّائي متابعة تعلم.\n"
         + "\n---\n".join(parts)
         + "\nاكتب رسالة تشجيعية قصيرة باللهجة التونسية."
     )
-    from crewai import Crew, Task
-    from runtime import FEEDBACK_AGENT
-    fb_task = Task(description=fb_prompt, expected_output="رسالة تشجيعية", agent=FEEDBACK_AGENT)
-    fb_note = Crew(agents=[FEEDBACK_AGENT], tasks=[fb_task], verbose=False).kickoff().raw
-    GLOBAL_MEM["feedback_note"] = fb_note
-
-    # render PDF into ./reports
-    from pathlib import Path
-    pdf_path = Path(REPORTS_DIR) / "session_report.pdf"
-    render_pdf(GLOBAL_MEM, pdf_path)
-
-    return JSONResponse({"pdf_url": "/reports/session_report.pdf"})
+    from runtime import FEEDBACK_AGENT, LLM_INVOKER
+    with metrics.span("llm.feedback"):
+        try:
+            fb_out = await run_in_threadpool(LLM_INVOKER.invoke, FEEDBACK_AGENT, fb_prompt, "رسالة تشجيعية",
+                                             use="feedback")
+        except Exception as e:
+            # timeout, busy or upstream error with no last good reply: the report is produced anyway
+            print(f"⚠️  feedback generation failed ({e!r}), using the default message")
+            fb_out = FallbackOutput("برافو عليك على المجهود! واصل هكا و راجع الدروس اللي صعبت عليك. 💪")
+    metrics.record_llm_usage("feedback", fb_out)
+    fb_note = fb_out.raw
+    mem["feedback_note"] = fb_note
+    await run_in_threadpool(SESSIONS.update, session_id, lambda m: m.log("feedback_note", fb_note))
+
+    # render the PDF in memory; it is served by id (and archived behind, if configured)
+    pdf = await run_in_threadpool(render_pdf_bytes, mem)
+    report_id = await run_in_threadpool(REPORTS.put, pdf, session_id)
+    # the next session may see every banked question again
+    await run_in_threadpool(QUIZ_BANK.end_session, session_id)
+
+    if stream:
+        return _pdf_response(pdf, f"session_report_{report_id[:8]}.pdf")
+    return JSONResponse({"pdf_url": f"/report/{report_id}", "report_id": report_id})
+
+@app.get("/report/{report_id}")
+async def report(report_id: str):
+    pdf = await run_in_threadpool(REPORTS.get, report_id)
+    if pdf is None:
+        return JSONResponse({"error": "report not found or expired"}, status_code=404)
+    return _pdf_response(pdf, f"session_report_{report_id[:8]}.pdf")
@@ -0,0 +1,242 @@
+"""
+Batch generation of summaries and quizzes for many modules (a whole term).
+
+One job takes modules × kinds ("summary", "quiz") and
+
+1. fetches each distinct module's KG bundle once (shared by its summary
+   and its quiz; unknown modules fail their items without an LLM call);
+2. runs the generations on `workers` threads, starting at most
+   `per_minute` of them per minute, inside one `shared_search()` block so
+   a lesson retrieved for a summary is not searched again for the quiz;
+3. persists results where the API already keeps them: summaries in
+   lessons/{branch}_{topic}.json (generate_summary_json), quiz questions in
+   the quiz bank;
+4. reports per-item progress (`BatchJob.progress()`, GET /batch/{id};
+   BatchRunner also keeps it in the SharedState, for polls reaching
+   another serve.py worker).
+
+    python -m batch --kinds summary quiz                 # every KG topic
+    python -m batch --modules "الماء" "الهواء" --kinds quiz --workers 2 --rate 10
+"""
+from __future__ import annotations
+import contextvars
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+
+from utils_text import normalize_arabic
+from metrics import REGISTRY
+
+BATCH_ITEMS = REGISTRY.counter("etude_batch_items_total", "Batch generation items by kind and result.",
+                               ("kind", "result"))
+KINDS = ("summary", "quiz")
+
+
+@dataclass
+class BatchItem:
+    module: str
+    kind: str
+    status: str = "pending"          # pending | running | done | failed
+    seconds: Optional[float] = None
+    path: Optional[str] = None       # summary JSON
+    questions: Optional[int] = None  # quiz questions added to the bank
+    error: Optional[str] = None
+
+
+class BatchJob:
+    def __init__(self, modules: list[str], kinds: list[str]):
+        bad = [k for k in kinds if k not in KINDS]
+        if bad:
+            raise ValueError(f"unknown kinds {bad}, expected {list(KINDS)}")
+        # one entry per normalized module name, first spelling wins
+        unique = list({normalize_arabic(m): m.strip() for m in reversed(modules) if m.strip()}.values())[::-1]
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.items = [BatchItem(m, k) for m in unique for k in kinds]
+
+    @property
+    def modules(self) -> list[str]:
+        return list(dict.fromkeys(it.module for it in self.items))
+
+    def progress(self) -> dict:
+        counts = {s: 0 for s in ("pending", "running", "done", "failed")}
+        for it in self.items:
+            counts[it.status] += 1
+        return {
+            "job_id": self.id,
+            "status": "finished" if self.finished else ("running" if counts["pending"] < len(self.items) else "queued"),
+            "total": len(self.items),
+            **counts,
+            "elapsed": round((self.finished or time.time()) - self.created, 1),
+            "items": [asdict(it) for it in self.items],
+        }
+
+
+class RateLimiter:
+    """Spaces call starts at least 60/per_minute seconds apart (0 = unlimited)."""
+
+    def __init__(self, per_minute: float = 0):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def run_batch(job: BatchJob, kg, quiz_bank=None, workers: int = 3, per_minute: float = 0,
+              num_mc: int = 6, num_tf: int = 4, on_item: Callable[[BatchJob, BatchItem], None] | None = None) -> BatchJob:
+    """Run `job` to completion (blocking); `on_item` is called after each item finishes."""
+    from handlers import generate_summary_json, generate_quiz_json
+    from retrieval import shared_search
+
+    # 1) one KG round trip per module
+    bundles: dict[str, dict] = {}
+    for module in job.modules:
+        try:
+            bundle = kg.fetch_topic_bundle(module)
+            if not bundle["branch"] or not bundle["lessons"]:
+                raise LookupError(f"⚠️ ما لقيتش المحور «{module}» في الـ KG.")
+            bundles[module] = bundle
+        except Exception as e:
+            for it in job.items:
+                if it.module == module:
+                    it.status, it.error = "failed", str(e)
+                    BATCH_ITEMS.inc(kind=it.kind, result="failed")
+                    if on_item:
+                        on_item(job, it)
+
+    limiter = RateLimiter(per_minute)
+
+    def run_item(it: BatchItem) -> None:
+        limiter.wait()
+        it.status = "running"
+        t0 = time.perf_counter()
+        bundle = bundles[it.module]
+        if it.kind == "summary":
+            it.path = generate_summary_json(f"ملخص محور {it.module}", kg, bundle)["path"]
+        else:
+            data = generate_quiz_json(it.module, kg, num_mc=num_mc, num_tf=num_tf, bundle=bundle)["data"]
+            questions = (data or {}).get("questions", [])
+            it.questions = quiz_bank.add(it.module, questions) if quiz_bank is not None else len(questions)
+        it.seconds = round(time.perf_counter() - t0, 2)
+
+    # 2) generations in parallel, sharing retrieval results
+    todo = [it for it in job.items if it.status == "pending"]
+    with shared_search(), ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(contextvars.copy_context().run, run_item, it): it for it in todo}
+        for fut in as_completed(futures):
+            it = futures[fut]
+            try:
+                fut.result()
+                it.status = "done"
+            except Exception as e:
+                it.status, it.error = "failed", str(e)
+            BATCH_ITEMS.inc(kind=it.kind, result=it.status)
+            if on_item:
+                on_item(job, it)
+    job.finished = time.time()
+    return job
+
+
+class BatchRunner:
+    """Background batch jobs for the API: one job runs at a time, the last `keep` are kept for polling."""
+
+    def __init__(self, kg, quiz_bank=None, workers: int = 3, per_minute: float = 0, keep: int = 20,
+                 shared=None):
+        """shared : shared_state.SharedState receiving each job's progress (None → this process only)."""
+        self.kg, self.quiz_bank, self.shared = kg, quiz_bank, shared
+        self.workers, self.per_minute, self.keep = workers, per_minute, keep
+        self._jobs: OrderedDict[str, BatchJob] = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-jobs")
+
+    def submit(self, modules: list[str], kinds: list[str], num_mc: int = 6, num_tf: int = 4) -> BatchJob:
+        job = BatchJob(modules, kinds)
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.keep:
+            self._jobs.popitem(last=False)
+        self._publish(job)
+        self._executor.submit(self._run, job, num_mc, num_tf)
+        return job
+
+    def _publish(self, job: BatchJob, item: BatchItem | None = None) -> None:
+        if self.shared is not None:
+            self.shared.put_json("batch", job.id, job.progress())
+
+    def _run(self, job: BatchJob, num_mc: int, num_tf: int) -> None:
+        try:
+            run_batch(job, self.kg, self.quiz_bank, self.workers, self.per_minute, num_mc, num_tf,
+                      on_item=self._publish)
+        except Exception as e:
+            print(f"⚠️  batch {job.id} aborted ({e})")
+            for it in job.items:
+                if it.status in ("pending", "running"):
+                    it.status, it.error = "failed", str(e)
+            job.finished = time.time()
+        self._publish(job)
+
+    def get(self, job_id: str) -> BatchJob | None:
+        return self._jobs.get(job_id)
+
+    def progress(self, job_id: str) -> dict | None:
+        """Progress of a job submitted to this runner or, with `shared`, to another worker's."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.progress()
+        return self.shared.get_json("batch", job_id) if self.shared is not None else None
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    from config import BATCH_WORKERS, BATCH_RATE_PER_MIN
+    from kg import open_kg
+    from quiz_bank import open_quiz_bank
+
+    ap = argparse.ArgumentParser(description="Generate summaries / quizzes for many modules.")
+    ap.add_argument("--modules", nargs="*", help="default: every topic in the KG")
+    ap.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    ap.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    ap.add_argument("--rate", type=float, default=BATCH_RATE_PER_MIN, help="generations started per minute (0 = no limit)")
+    ap.add_argument("--num-mc", type=int, default=6)
+    ap.add_argument("--num-tf", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    kg = open_kg()
+    bank = open_quiz_bank(kg) if "quiz" in args.kinds else None
+    try:
+        job = BatchJob(args.modules or kg.list_all_topics(), args.kinds)
+
+        def report(job: BatchJob, it: BatchItem) -> None:
+            p = job.progress()
+            detail = it.error if it.status == "failed" else (it.path or f"{it.questions} questions")
+            print(f"[{p['done'] + p['failed']}/{p['total']}] {'✅' if it.status == 'done' else '❌'} "
+                  f"{it.kind} «{it.module}» {detail}")
+
+        run_batch(job, kg, bank, args.workers, args.rate, args.num_mc, args.num_tf, on_item=report)
+        p = job.progress()
+        print(f"✅ {p['done']} done, ❌ {p['failed']} failed in {p['elapsed']} s")
+    finally:
+        if bank is not None:
+            bank.close()
+        kg.close()
+    return 0 if not job.progress()["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
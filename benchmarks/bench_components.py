@@ -0,0 +1,182 @@
+"""
+Component micro-benchmarks, fully offline.
+
+Runs against the bundled OCR cache (config_files/ktebjson/Book.json) and
+config_files/book_images, with HashEmbeddings / StubCrossEncoder / StubCrew /
+FixtureKG standing in for the HF models, Gemini and Neo4j.
+
+    python -m benchmarks.bench_components --out bench.json
+    python -m benchmarks.bench_components --compare bench_main.json --fail-above 1.25
+
+Each benchmark reports p50/p95/mean (ms) over `--repeat` timed calls and the
+tracemalloc peak (KiB) of one extra traced call, as JSON.
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted sample list."""
+    s = sorted(samples)
+    k = max(0, min(len(s) - 1, math.ceil(pct / 100 * len(s)) - 1))
+    return s[k]
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "n": repeat,
+        "p50_ms": round(percentile(times, 50), 3),
+        "p95_ms": round(percentile(times, 95), 3),
+        "mean_ms": round(sum(times) / len(times), 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+RAW_QUIZ_OUTPUTS = [
+    '```json\n{"questions": [{"type": "mc", "q": "شنوة الحواس؟", "options": ["1","2","3","5"], "a": "5"}]}\n```',
+    "```\n{'questions': [{'type': 'tf', 'q': 'الهواء عندو وزن', 'a': 'صح'}]}\n```",
+    "{'questions': [{'type': 'mc', 'q': 'x', 'options': ['a', 'b'], 'a': 'a'}, {'type': 'tf', 'q': 'y', 'a': 'خطأ'}]}",
+]
+
+
+def run(repeat: int, only: set[str] | None) -> dict:
+    from config import PDF_PATH, IMG_DIR
+    from ocr_pdf import load_arabic_pdf
+    from retrieval import build_retriever, ChapterRetrieverTool
+    from pdf_report import SessionMemory, render_pdf, render_pdf_bytes
+    from utils_text import parse_quiz_json
+    from benchmarks.stubs import HashEmbeddings, StubCrossEncoder, FixtureKG, install_stub_runtime
+
+    emb = HashEmbeddings()
+    cross = StubCrossEncoder()
+    kg = FixtureKG(emb)
+    retriever = build_retriever(PDF_PATH, emb=emb, cross=cross, collection_name="bench_tool")
+    tool = ChapterRetrieverTool(retriever)
+    handlers = install_stub_runtime(tool)
+
+    topics = kg.list_all_topics()
+    titles = [l["title"] for t in topics for l in kg.get_lessons_for_topic(t)]
+    questions = ["شنوة دور الجلد؟", "علاش الهواء يتلوث؟", "كيفاش نحمي سناني؟", "شنوة الساعة؟"]
+    q_embs = [emb.embed_query(q) for q in questions]
+    images = sorted(p.name for p in Path(IMG_DIR).iterdir())[:6]
+
+    mem = SessionMemory()
+    mem["chapter_summary"] = "\n".join(
+        f"• فكرة رقم {i}: الماء ضروري للحياة والنبات.\n![صورة {i}]({img})" for i, img in enumerate(images)
+    )
+    mem["qa_history"] = [(q, "جواب قصير بالدارجة " * 10) for q in questions]
+    mem["quiz_log"] = [
+        {"q": "سؤال", "type": "mc", "options": ["أ", "ب"], "child": "أ", "correct": "أ", "is_correct": True}
+    ] * 10
+    mem["quiz_results"] = {"correct": 10, "incorrect": 0}
+    mem["feedback_note"] = "برافو عليك!"
+    out_pdf = Path(tempfile.mkdtemp(prefix="etude-bench-")) / "report.pdf"
+
+    it = {"title": 0, "topic": 0, "q": 0, "build": 0}
+
+    def fresh_build() -> None:
+        # own collection per build, dropped afterwards: the one `tool` searches stays unchanged
+        it["build"] += 1
+        built = build_retriever(PDF_PATH, emb=emb, cross=cross, collection_name=f"bench_build_{it['build']}")
+        built.base_retriever.vectorstore.delete_collection()
+
+    def cycle(key: str, seq: list):
+        v = seq[it[key] % len(seq)]
+        it[key] += 1
+        return v
+
+    cases: dict[str, tuple[Callable[[], object], int]] = {
+        "load_arabic_pdf[cache]": (lambda: load_arabic_pdf(PDF_PATH), repeat),
+        "build_retriever": (fresh_build, max(1, repeat // 10)),
+        "ChapterRetrieverTool._run": (lambda: tool._run(cycle("title", titles)), repeat),
+        "retrieve_context": (lambda: handlers.retrieve_context(cycle("topic", topics), kg), repeat),
+        "handle_qa[topic_inference]": (lambda: handlers._infer_lesson(cycle("q", q_embs), kg), repeat),
+        "parse_quiz_json": (lambda: [parse_quiz_json(r) for r in RAW_QUIZ_OUTPUTS], repeat),
+        "render_pdf": (lambda: render_pdf(mem, out_pdf), max(1, repeat // 4)),
+        "render_pdf_bytes": (lambda: render_pdf_bytes(mem), max(1, repeat // 4)),
+    }
+    results = {}
+    for name, (fn, n) in cases.items():
+        if only and name not in only:
+            continue
+        results[name] = measure(fn, n)
+        print(f"{name:32s} p50 {results[name]['p50_ms']:10.2f} ms   p95 {results[name]['p95_ms']:10.2f} ms"
+              f"   peak {results[name]['peak_kib']:10.1f} KiB", file=sys.stderr)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, fail_above: float | None) -> int:
+    """Print p50/p95 ratios current/baseline; non-zero exit if any ratio exceeds `fail_above`."""
+    worst = 0.0
+    print(f"{'benchmark':32s} {'p50 x':>8s} {'p95 x':>8s} {'peak x':>8s}  ({baseline.get('commit')} → {current.get('commit')})",
+          file=sys.stderr)
+    for name, cur in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        r = {k: cur[k] / base[k] if base[k] else float("inf") for k in ("p50_ms", "p95_ms", "peak_kib")}
+        worst = max(worst, r["p50_ms"])
+        print(f"{name:32s} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['peak_kib']:8.2f}", file=sys.stderr)
+    return 1 if fail_above and worst > fail_above else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--only", nargs="*", help="benchmark names to run")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    ap.add_argument("--compare", help="baseline JSON from a previous run")
+    ap.add_argument("--fail-above", type=float, help="exit 1 if any p50 ratio exceeds this")
+    args = ap.parse_args(argv)
+
+    report = run(args.repeat, set(args.only) if args.only else None)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        return compare(report, baseline, args.fail_above)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
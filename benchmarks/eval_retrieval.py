@@ -0,0 +1,274 @@
+"""
+Retrieval quality vs latency for build_retriever settings.
+
+Labeled queries come from the KG: every lesson title is a query whose
+relevant chunks are the ones from the lesson's page range. For every
+combination of
+
+* chunker settings (--chunkers: SemanticChunker kwargs, or
+  {"chunker": "structural", ...} for the page-aware chunker of chunking.py),
+* k_fetch (vector candidates) and k_rerank (chunks kept),
+* reranking on (cross-encoder), off (vector order) or adaptive
+  (retrieval.rerank_plan with the RERANK_* settings),
+
+the harness reports hit@k (a relevant chunk among the kept ones), MRR,
+page recall (share of the lesson's pages covered), p50/p95 latency of
+one search and the index size and build cost (chunking / indexing
+seconds, texts embedded), then marks the best configuration within an
+optional p95 budget.
+
+    python -m benchmarks.eval_retrieval --models stub --out eval.json
+    python -m benchmarks.eval_retrieval --models real --kg live --max-p95-ms 150
+
+Page numbers: chunks carry the OCR page index (0-based); KG lessons use
+book page numbers, `--page-offset` maps one to the other
+(KG page = index + 1 + offset).
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.bench_components import percentile, git_commit
+
+DEFAULT_CHUNKERS = [
+    {},
+    {"breakpoint_threshold_type": "percentile", "breakpoint_threshold_amount": 80},
+    {"breakpoint_threshold_type": "standard_deviation", "breakpoint_threshold_amount": 2},
+    {"breakpoint_threshold_type": "interquartile"},
+    {"chunker": "structural"},
+    {"chunker": "structural", "max_tokens": 120, "overlap_tokens": 20},
+    {"chunker": "structural", "max_tokens": 300, "overlap_tokens": 40},
+]
+
+
+class CountingEmbeddings:
+    """Wraps an embeddings object and counts the texts it embeds."""
+
+    def __init__(self, emb):
+        self.emb, self.texts = emb, 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return self.emb.embed_documents(texts)
+
+    def embed_query(self, text):
+        self.texts += 1
+        return self.emb.embed_query(text)
+
+
+def labeled_queries(kg, variants: bool = False) -> list[dict]:
+    """[{"query", "lesson", "pages": set of KG page numbers}, ...] from every lesson with a page range."""
+    out = []
+    for topic in kg.list_all_topics():
+        for ld in kg.get_lessons_for_topic(topic):
+            if ld.get("start_page") is None:
+                continue
+            pages = set(range(int(ld["start_page"]), int(ld.get("end_page") or ld["start_page"]) + 1))
+            out.append({"query": ld["title"], "lesson": ld["title"], "pages": pages})
+            if variants:
+                out.append({"query": f"شنوة نتعلمو في درس {ld['title']}؟", "lesson": ld["title"], "pages": pages})
+    return out
+
+
+def _page(doc, offset: int) -> int | None:
+    page = doc.metadata.get("page")
+    return None if page is None else int(page) + 1 + offset
+
+
+def score_ranking(pages_ranked: list[int | None], expected: set[int]) -> dict:
+    first = next((i for i, p in enumerate(pages_ranked, 1) if p in expected), None)
+    return {
+        "hit": 1.0 if first else 0.0,
+        "rr": 1.0 / first if first else 0.0,
+        "page_recall": len(expected & set(pages_ranked)) / len(expected),
+    }
+
+
+def index_size(retriever) -> dict:
+    got = retriever.base_retriever.vectorstore.get(include=["documents", "embeddings"])
+    docs, embs = got.get("documents") or [], got.get("embeddings")
+    dim = len(embs[0]) if embs is not None and len(embs) else 0
+    chars = sum(len(d) for d in docs)
+    return {
+        "chunks": len(docs),
+        "mean_chunk_chars": round(chars / len(docs), 1) if docs else 0,
+        "text_kib": round(sum(len(d.encode("utf-8")) for d in docs) / 1024, 1),
+        "vectors_kib": round(len(docs) * dim * 4 / 1024, 1),
+    }
+
+
+def _adaptive(retriever, query: str, k_fetch: int, k_rerank: int) -> tuple[list, str]:
+    from retrieval import rerank_plan
+    from config import RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN, RERANK_SHRINK_TO, RERANK_TITLE_MAX_WORDS
+    pairs = retriever.base_retriever.vectorstore.similarity_search_with_relevance_scores(query, k=k_fetch)
+    docs = [d for d, _ in pairs]
+    decision, n = rerank_plan(query, docs[0].page_content if docs else "", [s for _, s in pairs], k_rerank,
+                              RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN, RERANK_SHRINK_TO, RERANK_TITLE_MAX_WORDS)
+    if n:
+        scores = retriever.base_compressor.model.score([(query, d.page_content) for d in docs[:n]])
+        docs = [d for _, d in sorted(zip(scores, docs[:n]), key=lambda x: x[0], reverse=True)] + docs[n:]
+    return docs, decision
+
+
+def evaluate(retriever, queries: list[dict], k_fetch: int, k_reranks: list[int], rerank: bool | str,
+             page_offset: int) -> list[dict]:
+    """One pass over the queries (per k_rerank for "adaptive"); one result row per k_rerank."""
+    retriever.base_retriever.search_kwargs["k"] = k_fetch
+    comp = retriever.base_compressor
+    if rerank == "adaptive":
+        # the plan depends on k_rerank, so each k gets its own pass
+        rows = []
+        for k in k_reranks:
+            if k > k_fetch:
+                continue
+            times, rankings, skipped = [], [], 0
+            for q in queries:
+                t0 = time.perf_counter()
+                docs, decision = _adaptive(retriever, q["query"], k_fetch, k)
+                times.append((time.perf_counter() - t0) * 1000)
+                rankings.append([_page(d, page_offset) for d in docs])
+                skipped += decision.startswith("skipped")
+            row = _rows(queries, rankings, times, k_fetch, [k], rerank)[0]
+            rows.append({**row, "rerank_skipped": round(skipped / len(queries), 3)})
+        return rows
+    times, rankings = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        docs = retriever.base_retriever.invoke(q["query"])
+        if rerank and docs:
+            scores = comp.model.score([(q["query"], d.page_content) for d in docs])
+            docs = [d for _, d in sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)]
+        times.append((time.perf_counter() - t0) * 1000)
+        rankings.append([_page(d, page_offset) for d in docs])
+    return _rows(queries, rankings, times, k_fetch, k_reranks, rerank)
+
+
+def _rows(queries: list[dict], rankings: list[list], times: list[float], k_fetch: int, k_reranks: list[int],
+          rerank: bool | str) -> list[dict]:
+    rows = []
+    for k in k_reranks:
+        if k > k_fetch:
+            continue
+        scores = [score_ranking(r[:k], q["pages"]) for r, q in zip(rankings, queries)]
+        n = len(scores) or 1
+        rows.append({
+            "k_fetch": k_fetch,
+            "k_rerank": k,
+            "rerank": rerank,
+            "hit@k": round(sum(s["hit"] for s in scores) / n, 3),
+            "mrr": round(sum(s["rr"] for s in scores) / n, 3),
+            "page_recall": round(sum(s["page_recall"] for s in scores) / n, 3),
+            "p50_ms": round(percentile(times, 50), 3),
+            "p95_ms": round(percentile(times, 95), 3),
+        })
+    return rows
+
+
+def pick(rows: list[dict], max_p95_ms: float | None) -> dict | None:
+    """Best hit@k, then MRR, then lowest p50 — among rows within the p95 budget."""
+    ok = [r for r in rows if max_p95_ms is None or r["p95_ms"] <= max_p95_ms]
+    return max(ok, key=lambda r: (r["hit@k"], r["mrr"], -r["p50_ms"])) if ok else None
+
+
+def run(args) -> dict:
+    from config import PDF_PATH, BOOKS
+    from retrieval import build_retriever
+    import metrics
+
+    if args.models == "stub":
+        from benchmarks.stubs import HashEmbeddings, StubCrossEncoder
+        emb, cross = HashEmbeddings(), StubCrossEncoder()
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+        from config import EMBEDDING_MODEL, RERANKER_MODEL
+        emb, cross = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL), HuggingFaceCrossEncoder(model_name=RERANKER_MODEL)
+    if args.kg == "fixture":
+        from benchmarks.stubs import FixtureKG
+        kg = FixtureKG(emb if args.models == "stub" else None)
+    else:
+        from kg import open_kg
+        kg = open_kg()
+    try:
+        queries = labeled_queries(kg, args.variants)
+    finally:
+        kg.close()
+    if not queries:
+        raise SystemExit("no lessons with page ranges in the KG")
+
+    chunkers = [json.loads(c) for c in args.chunkers] if args.chunkers else DEFAULT_CHUNKERS
+    rows = []
+    for ci, chunker in enumerate(chunkers):
+        kwargs = dict(chunker)
+        mode = kwargs.pop("chunker", "semantic")
+        counting = CountingEmbeddings(emb)
+        token = metrics.start_request()
+        t0 = time.perf_counter()
+        retriever = build_retriever(PDF_PATH, emb=counting, cross=cross, ocr_cache=BOOKS[0].get("ocr_cache"),
+                                    collection_name=f"eval_{ci}", chunker=mode, chunker_kwargs=kwargs,
+                                    k_fetch=max(args.k_fetch), k_rerank=max(args.k_rerank))
+        build_s = time.perf_counter() - t0
+        stages = dict(metrics.end_request(token))
+        size = {**index_size(retriever), "build_s": round(build_s, 2),
+                "chunk_s": round(stages.get("retrieval.chunk", 0.0), 2),
+                "index_s": round(stages.get("retrieval.index", 0.0), 2),
+                "embedded_texts": counting.texts}
+        counting.texts = 0              # searches below are not build cost
+        print(f"chunker {chunker or 'default'}: {size['chunks']} chunks in {size['build_s']} s"
+              f" (chunking {size['chunk_s']} s, {size['embedded_texts']} texts embedded)", file=sys.stderr)
+        modes = {"both": [True, False], "all": [True, False, "adaptive"], "on": [True], "off": [False],
+                 "adaptive": ["adaptive"]}[args.rerank]
+        for k_fetch, rerank in itertools.product(args.k_fetch, modes):
+            for row in evaluate(retriever, queries, k_fetch, args.k_rerank, rerank, args.page_offset):
+                rows.append({"chunker": chunker, **row, "index": size})
+                print(f"  k_fetch {row['k_fetch']:3d} k_rerank {row['k_rerank']:2d} rerank {str(rerank):8s}"
+                      f"  hit@k {row['hit@k']:.3f}  mrr {row['mrr']:.3f}  pages {row['page_recall']:.3f}"
+                      f"  p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms", file=sys.stderr)
+        retriever.base_retriever.vectorstore.delete_collection()
+    best = pick(rows, args.max_p95_ms)
+    if best:
+        print(f"best: {json.dumps({k: v for k, v in best.items() if k != 'index'}, ensure_ascii=False)}",
+              file=sys.stderr)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "models": args.models,
+        "queries": len(queries),
+        "max_p95_ms": args.max_p95_ms,
+        "best": best,
+        "results": rows,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--models", choices=["stub", "real"], default="stub",
+                    help="hashed embeddings + overlap scorer, or the configured HF models")
+    ap.add_argument("--kg", choices=["fixture", "live"], default="fixture")
+    ap.add_argument("--chunkers", nargs="*",
+                    help='chunker settings as JSON, e.g. \'{"breakpoint_threshold_amount": 90}\' or '
+                         '\'{"chunker": "structural", "max_tokens": 150}\'')
+    ap.add_argument("--k-fetch", type=int, nargs="+", default=[4, 8, 12])
+    ap.add_argument("--k-rerank", type=int, nargs="+", default=[1, 3, 5])
+    ap.add_argument("--rerank", choices=["on", "off", "adaptive", "both", "all"], default="both",
+                    help='"both" = on and off, "all" adds adaptive')
+    ap.add_argument("--variants", action="store_true", help="also ask each lesson as a question")
+    ap.add_argument("--page-offset", type=int, default=0)
+    ap.add_argument("--max-p95-ms", type=float, help="latency budget for the recommended configuration")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    args = ap.parse_args(argv)
+
+    text = json.dumps(run(args), ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+HTTP load test of app.py with stubbed backends.
+
+Starts the real FastAPI app in a child process, with StubCrew (fixed
+`--llm-latency` per Gemini call), HashEmbeddings / StubCrossEncoder and the
+FixtureKG instead of Neo4j, in a throw-away working directory (lessons/,
+cache/, reports/). Then drives mixed /summary, /qa, /quiz and /finish
+traffic with `--concurrency` closed-loop clients per level and reports,
+per level:
+
+* throughput (completed requests / s) and error rate (non-2xx or failed);
+* p50 / p95 / p99 latency, overall and per endpoint;
+* event-loop lag of the server (how late a 10 ms asyncio.sleep wakes up),
+  which shows blocking work on the loop.
+
+    python -m benchmarks.loadtest --concurrency 1 8 32 --duration 20 --llm-latency 1.5 --out load.json
+    python -m benchmarks.loadtest --threadpool 64 --compare load.json
+
+`--url` drives an already running server instead (no stubs, no lag probe).
+Results are JSON; `--compare` prints throughput and p95 ratios against a
+previous run, level by level.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_components import ROOT, percentile, git_commit
+
+DEFAULT_MIX = "summary=2,qa=5,quiz=2,finish=1"
+QUESTIONS = ["شنوة دور الجلد؟", "علاش الهواء يتلوث؟", "كيفاش نحمي سناني؟", "شنوة يصير للماء كي نسخنوه؟",
+             "علاش لازمنا ناكلو الخضرة؟", "كيفاش النبتة تشرب الماء؟"]
+LAG_PATH = "/_loadtest/lag"
+
+
+# ───────────────────────────── server ─────────────────────────────────
+def _workdir() -> str:
+    """Temp working directory seeing the repo's config_files, so the run writes nothing in the tree."""
+    work = tempfile.mkdtemp(prefix="etude-load-")
+    os.symlink(ROOT / "config_files", Path(work) / "config_files")
+    return work
+
+
+def _server(port: int, llm_latency: float, threadpool: int) -> None:
+    """Child process: the stubbed app plus the event-loop lag probe, on 127.0.0.1:port."""
+    work = _workdir()
+    os.chdir(work)
+    sys.path.insert(0, str(ROOT))
+    os.environ["ETUDE_KG_BACKEND"] = "snapshot"     # no async Neo4j driver
+    import config
+    config.QUIZ_BANK_DIR = os.path.join(work, "cache", "quiz_bank")
+
+    from retrieval import build_retriever, ChapterRetrieverTool
+    from benchmarks.stubs import HashEmbeddings, StubCrossEncoder, StubCrew, FixtureKG, install_stub_runtime
+    import kg
+
+    emb = HashEmbeddings()
+    retriever = build_retriever(config.PDF_PATH, emb=emb, cross=StubCrossEncoder(),
+                                ocr_cache=config.BOOKS[0].get("ocr_cache"))
+    install_stub_runtime(ChapterRetrieverTool(retriever), cache_dir=os.path.join(work, "cache"))
+    StubCrew.latency = llm_latency
+    kg.open_kg = lambda backend=None: FixtureKG(emb)
+
+    import uvicorn
+    from app import app
+    from serve import _bind, _serve
+
+    lags: list[float] = []
+
+    async def probe(interval: float = 0.01) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, loop.time() - t - interval))
+
+    async def start_probe() -> None:
+        app.state.lag_probe = asyncio.create_task(probe())
+
+    async def lag(reset: int = 0) -> dict:
+        out = {"samples": len(lags)}
+        if lags:
+            out.update({f"p{p}_ms": round(percentile(lags, p) * 1000, 3) for p in (50, 95, 99)})
+            out["max_ms"] = round(max(lags) * 1000, 3)
+        if reset:
+            lags.clear()
+        return out
+
+    app.router.add_event_handler("startup", start_probe)
+    app.add_api_route(LAG_PATH, lag, methods=["GET"])
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="on"))
+    asyncio.run(_serve(server, _bind("127.0.0.1", port), threadpool))
+
+
+def _free_port() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(client, timeout: float, proc=None) -> None:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if proc is not None and not proc.is_alive():
+            raise SystemExit(f"server process exited with code {proc.exitcode}")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise SystemExit(f"server not ready after {timeout:g} s")
+
+
+# ───────────────────────────── traffic ────────────────────────────────
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("summary", "qa", "quiz", "finish"):
+            raise SystemExit(f"unknown endpoint {name!r} in --mix")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def fixture_topics() -> list[str]:
+    data = json.loads((ROOT / "benchmarks" / "kg_fixture.json").read_text(encoding="utf-8"))
+    return [t["name"] for b in data["branches"] for t in b["topics"]]
+
+
+def _request(kind: str, rng: random.Random, topics: list[str], client_id: int) -> tuple[str, dict]:
+    session = f"load-{client_id}"
+    if kind == "summary":
+        return "/summary", {"module": rng.choice(topics)}
+    if kind == "qa":
+        return "/qa", {"question": rng.choice(QUESTIONS), "session_id": session}
+    if kind == "quiz":
+        return "/quiz", {"module": rng.choice(topics), "session_id": session}
+    return "/finish", {"session_id": session}
+
+
+async def _client(client, client_id: int, mix: dict[str, float], topics: list[str], until: float,
+                  seed: int, out: list) -> None:
+    rng = random.Random(seed * 1000 + client_id)
+    kinds, weights = list(mix), list(mix.values())
+    while time.monotonic() < until:
+        kind = rng.choices(kinds, weights)[0]
+        path, body = _request(kind, rng, topics, client_id)
+        t0 = time.perf_counter()
+        try:
+            status = (await client.post(path, json=body)).status_code
+        except Exception:
+            status = 0                  # connection error / client timeout
+        out.append((kind, status, time.perf_counter() - t0))
+
+
+def _stats(samples: list[tuple[str, int, float]]) -> dict:
+    times = [s[2] * 1000 for s in samples]
+    errors = sum(1 for s in samples if not 200 <= s[1] < 300)
+    return {
+        "n": len(samples),
+        "errors": errors,
+        "p50_ms": round(percentile(times, 50), 1),
+        "p95_ms": round(percentile(times, 95), 1),
+        "p99_ms": round(percentile(times, 99), 1),
+    } if samples else {"n": 0, "errors": 0}
+
+
+async def run_level(client, concurrency: int, duration: float, warmup: float, mix: dict[str, float],
+                    topics: list[str], seed: int, lag_probe: bool) -> dict:
+    if warmup:
+        await asyncio.gather(*(_client(client, i, mix, topics, time.monotonic() + warmup, seed, [])
+                               for i in range(concurrency)))
+    if lag_probe:
+        await client.get(LAG_PATH, params={"reset": 1})
+    samples: list = []
+    t0 = time.monotonic()
+    await asyncio.gather(*(_client(client, i, mix, topics, t0 + duration, seed, samples)
+                           for i in range(concurrency)))
+    wall = time.monotonic() - t0
+    status: dict[str, int] = {}
+    for _, code, _ in samples:
+        status[str(code)] = status.get(str(code), 0) + 1
+    level = {
+        "concurrency": concurrency,
+        "seconds": round(wall, 2),
+        "rps": round(len(samples) / wall, 2),
+        "error_rate": round(sum(1 for s in samples if not 200 <= s[1] < 300) / (len(samples) or 1), 4),
+        "status": status,
+        "all": _stats(samples),
+        "endpoints": {k: _stats([s for s in samples if s[0] == k]) for k in mix},
+    }
+    if lag_probe:
+        level["loop_lag"] = (await client.get(LAG_PATH, params={"reset": 1})).json()
+    return level
+
+
+async def drive(args, base_url: str, proc=None) -> list[dict]:
+    import httpx
+    mix, topics = parse_mix(args.mix), fixture_topics()
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 4, max_keepalive_connections=max(args.concurrency) + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await _wait_ready(client, args.startup_timeout, proc)
+        lag_probe = proc is not None
+        levels = []
+        for c in args.concurrency:
+            level = await run_level(client, c, args.duration, args.warmup, mix, topics, args.seed, lag_probe)
+            levels.append(level)
+            lag = level.get("loop_lag", {})
+            print(f"c={c:4d}  {level['rps']:8.2f} req/s  err {level['error_rate']:.2%}"
+                  f"  p50 {level['all'].get('p50_ms', 0):8.1f} ms  p95 {level['all'].get('p95_ms', 0):8.1f} ms"
+                  f"  p99 {level['all'].get('p99_ms', 0):8.1f} ms"
+                  + (f"  loop lag p99 {lag.get('p99_ms', 0):7.2f} ms max {lag.get('max_ms', 0):7.2f} ms" if lag else ""),
+                  file=sys.stderr)
+        return levels
+
+
+def run(args) -> dict:
+    proc = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        port = _free_port()
+        proc = multiprocessing.get_context("spawn").Process(
+            target=_server, args=(port, args.llm_latency, args.threadpool), daemon=True)
+        proc.start()
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        levels = asyncio.run(drive(args, base_url, proc))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.join(10)
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.url or "stub",
+        "llm_latency_s": None if args.url else args.llm_latency,
+        "threadpool": None if args.url else args.threadpool,
+        "mix": parse_mix(args.mix),
+        "duration_s": args.duration,
+        "levels": levels,
+    }
+
+
+def compare(current: dict, baseline: dict, fail_above: float | None) -> int:
+    """Throughput and p95 ratios current/baseline per concurrency; non-zero exit if a p95 ratio exceeds `fail_above`."""
+    base = {lv["concurrency"]: lv for lv in baseline["levels"]}
+    worst = 0.0
+    print(f"{'concurrency':>11s} {'rps x':>8s} {'p95 x':>8s} {'err Δ':>8s}  ({baseline.get('commit')} → {current.get('commit')})",
+          file=sys.stderr)
+    for lv in current["levels"]:
+        b = base.get(lv["concurrency"])
+        if not b or not b["rps"] or not b["all"].get("p95_ms"):
+            continue
+        rps = lv["rps"] / b["rps"]
+        p95 = lv["all"].get("p95_ms", 0) / b["all"]["p95_ms"]
+        worst = max(worst, p95)
+        print(f"{lv['concurrency']:11d} {rps:8.2f} {p95:8.2f} {lv['error_rate'] - b['error_rate']:+8.2%}", file=sys.stderr)
+    return 1 if fail_above and worst > fail_above else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import SERVE_THREADPOOL
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    ap.add_argument("--duration", type=float, default=15.0, help="seconds measured per level")
+    ap.add_argument("--warmup", type=float, default=2.0, help="seconds of unmeasured traffic before each level")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. summary=1,qa=8,quiz=1")
+    ap.add_argument("--llm-latency", type=float, default=1.0, help="seconds per stubbed Gemini call")
+    ap.add_argument("--threadpool", type=int, default=SERVE_THREADPOOL, help="run_in_threadpool limit of the server")
+    ap.add_argument("--timeout", type=float, default=120.0, help="client timeout per request (s)")
+    ap.add_argument("--startup-timeout", type=float, default=300.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--url", help="drive this running server instead of a stubbed one")
+    ap.add_argument("--out", help="write JSON results here (default: stdout)")
+    ap.add_argument("--compare", help="baseline JSON from a previous run")
+    ap.add_argument("--fail-above", type=float, help="exit 1 if any p95 ratio exceeds this")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        return compare(report, json.loads(Path(args.compare).read_text(encoding="utf-8")), args.fail_above)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Offline stand-ins for the external services, shared by the benchmark scripts:
+
+* HashEmbeddings   – deterministic char-trigram hashing instead of GATE-AraBert
+* StubCrossEncoder – token-overlap scorer instead of ARA-Reranker
+* StubCrew/StubTask – canned, deterministic Gemini replies (optional latency)
+* FixtureKG        – SnapshotKG over kg_fixture.json instead of Neo4j
+* install_stub_runtime – a `runtime` module wired with the above, so that
+  `handlers` can be imported without loading models or calling Gemini.
+"""
+from __future__ import annotations
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import types
+import zlib
+from pathlib import Path
+from typing import Any, List
+
+from langchain_community.cross_encoders import BaseCrossEncoder
+
+from kg_snapshot import SnapshotKG
+
+FIXTURE_PATH = Path(__file__).with_name("kg_fixture.json")
+
+
+# ───────────────────────────── models ─────────────────────────────────
+class HashEmbeddings:
+    """Embeddings interface (embed_documents / embed_query) over hashed char trigrams."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.model_name = f"hash-trigram-{dim}"
+
+    def _vec(self, text: str) -> List[float]:
+        v = [0.0] * self.dim
+        t = f"  {text.strip()}  "
+        for i in range(len(t) - 2):
+            v[zlib.crc32(t[i:i + 3].encode("utf-8")) % self.dim] += 1.0
+        n = math.sqrt(sum(x * x for x in v)) or 1.0
+        return [x / n for x in v]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vec(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vec(text)
+
+
+class StubCrossEncoder(BaseCrossEncoder):
+    """Scores (query, passage) pairs by word overlap."""
+
+    def score(self, text_pairs: List[tuple[str, str]]) -> List[float]:
+        out = []
+        for q, d in text_pairs:
+            qs, ds = set(q.split()), set(d.split())
+            out.append(len(qs & ds) / (len(qs) or 1))
+        return out
+
+
+# ───────────────────────────── LLM ────────────────────────────────────
+class StubUsage:
+    def __init__(self, prompt: str, completion: str):
+        self.prompt_tokens = len(prompt.split())
+        self.completion_tokens = len(completion.split())
+        self.total_tokens = self.prompt_tokens + self.completion_tokens
+
+
+class StubOutput:
+    def __init__(self, raw: str, prompt: str):
+        self.raw = raw
+        self.token_usage = StubUsage(prompt, raw)
+
+
+class StubTask:
+    def __init__(self, description: str, expected_output: str = "", agent: Any = None, **kwargs):
+        self.description = description
+        self.expected_output = expected_output
+        self.agent = agent
+
+
+SUMMARY_REPLY = {
+    "title": "درس تجريبي",
+    "slides": [
+        {"number": "1", "text": "مرحبا! اليوم باش نتعلّمو حاجة جديدة."},
+        {"number": "2", "text": "• الفكرة الرئيسية بعبارة ساهلة.\n![صورة](page_6_img_3.jpeg)"},
+        {"number": "3", "text": "العبرة: راجع الدرس مع صحابك."},
+    ],
+}
+QUIZ_REPLY = {
+    "questions": [
+        {"type": "mc", "q": f"سؤال اختيار رقم {i}", "options": ["أ", "ب", "ج", "د"], "a": "أ"}
+        for i in range(1, 7)
+    ] + [
+        {"type": "tf", "q": f"سؤال صح ولا خطأ رقم {i}", "a": "صح"} for i in range(1, 5)
+    ]
+}
+
+
+class StubCrew:
+    """Drop-in for crewai.Crew: `kickoff()` sleeps `latency` seconds and returns a canned reply."""
+    latency: float = 0.0
+    calls: int = 0
+
+    def __init__(self, agents=None, tasks=None, verbose=False, **kwargs):
+        self.tasks = tasks or []
+
+    def kickoff(self, inputs: dict | None = None) -> StubOutput:
+        type(self).calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        task = self.tasks[-1]
+        prompt = task.description
+        if task.expected_output == "json" and "slides" in prompt:
+            raw = "```json\n" + json.dumps(SUMMARY_REPLY, ensure_ascii=False) + "\n```"
+        elif task.expected_output == "json":
+            raw = "```json\n" + json.dumps(QUIZ_REPLY, ensure_ascii=False).replace('"', "'") + "\n```"
+        else:
+            raw = "جواب تجريبي: الماء سائل ضروري للحياة، مثلا نشربو كل نهار."
+        return StubOutput(raw, prompt)
+
+
+# ───────────────────────────── KG ─────────────────────────────────────
+class FixtureKG(SnapshotKG):
+    """SnapshotKG over kg_fixture.json; missing lesson embeddings are computed with `emb`."""
+
+    def __init__(self, emb=None, path: Path | str = FIXTURE_PATH):
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        emb = emb or HashEmbeddings()
+        lessons = [l for b in data["branches"] for t in b["topics"] for l in t["lessons"]
+                   if l.get("embedding") is None]
+        for l, vec in zip(lessons, emb.embed_documents([l["title"] for l in lessons])):
+            l["embedding"] = vec
+        super().__init__(data=data)
+
+
+# ───────────────────────────── runtime ────────────────────────────────
+def install_stub_runtime(tool, cache_dir: str | None = None) -> types.ModuleType:
+    """
+    Register a fake `runtime` module (agents, tool, memory, caches, a
+    one-book corpus over `tool`'s retriever, an LLM invoker) and patch
+    Crew/Task in `llm_call`. Returns the imported `handlers` module.
+    """
+    from pdf_report import SessionMemory
+    from qa_cache import EmbeddingCache, AnswerCache, LastGoodCache
+    from llm_call import LLMInvoker
+    import llm_call
+    from image_select import ImageSelector, CaptionEmbeddingCache, ImageQueryEmbeddingCache
+    from corpus import CorpusManager
+    from config import BOOKS
+
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix="etude-bench-")
+    retriever = tool._retriever
+    rt = types.ModuleType("runtime")
+    rt.TOOL = tool
+    rt.EMB = retriever.base_retriever.vectorstore._embedding_function
+    rt.CORPUS = CorpusManager(BOOKS[:1], emb=rt.EMB, cross=retriever.base_compressor.model)
+    rt.CORPUS.attach(rt.CORPUS.default_book, retriever)
+    rt.ROUTER = rt.SUMMARY_AGENT = rt.QA_AGENT = rt.QUIZ_AGENT = rt.FEEDBACK_AGENT = object()
+    rt.SESSION_COMPACT = None
+    rt.GLOBAL_MEM = SessionMemory()
+    rt.EMB_CACHE = EmbeddingCache(os.path.join(cache_dir, "qa_embeddings.json"), 2000, "stub")
+    rt.ANSWER_CACHE = AnswerCache(os.path.join(cache_dir, "qa_answers.json"), 500, "stub")
+    rt.IMAGE_SELECTOR = ImageSelector(
+        rt.EMB, CaptionEmbeddingCache(os.path.join(cache_dir, "image_captions.json"), 2000, "stub"),
+        query_cache=ImageQueryEmbeddingCache(os.path.join(cache_dir, "image_queries.json"), 500, "stub"))
+    rt.LLM_INVOKER = LLMInvoker({}, default_deadline=600.0, hedge_quantile=0,
+                                fallback=LastGoodCache(os.path.join(cache_dir, "llm_last_good.json"), 500))
+    llm_call.Crew = StubCrew
+    llm_call.Task = StubTask
+    sys.modules["runtime"] = rt
+
+    import handlers
+    return handlers
@@ -0,0 +1,150 @@
+"""
+Chunking stage of build_retriever (CHUNKER, or `chunker=` per build).
+
+* "semantic"   – SemanticChunker: embeds every sentence of the book to find
+  topic breakpoints, then the chunks are embedded again when indexed, so
+  an index build costs about two embedding passes. Chunks may span pages.
+* "structural" – no embeddings. Each OCR page is cut into blocks at blank
+  lines and heading-like lines (الموضوع :, الهدف :, "2- الإشكالية :", …);
+  blocks are packed into chunks of at most `max_tokens` (longer blocks
+  are cut so the overlap still fits ahead of each piece), a heading starts
+  a new chunk, and the last `overlap_tokens` of a chunk are repeated at
+  the start of the next one. A chunk never crosses a page, so it keeps the
+  page metadata (and maps onto lesson page ranges), plus the heading in
+  force where it starts.
+
+Tokens are estimated as in context_assembly (CONTEXT_CHARS_PER_TOKEN).
+Compare both with benchmarks/eval_retrieval.py.
+"""
+from __future__ import annotations
+import re
+from typing import List
+
+from langchain_core.documents import Document
+
+from context_assembly import estimate_tokens
+
+CHUNKERS = ("semantic", "structural")
+
+_HEADING = re.compile(
+    r"^\s*(?:\d+\s*)?\d+\s*[-.)]\s*\S"                                  # 2- الإشكالية / 1. / 3)
+    r"|^\s*(?:الموضوع|الهدف|المحور|الدرس|الإشكالية|نشاط|تمرين|أتعلم|ألاحظ|أستنتج|أتدرب|الخلاصة)"
+    r"|[:：]\s*$"
+)
+_SENTENCE_END = re.compile(r"(?<=[.!؟?…])\s+")
+
+
+def is_heading(line: str, max_words: int = 8) -> bool:
+    line = line.strip()
+    return bool(line) and len(line.split()) <= max_words and bool(_HEADING.search(line))
+
+
+def split_blocks(text: str) -> List[tuple[str, bool]]:
+    """(block, starts_with_heading) pairs: paragraphs split at blank lines and before headings."""
+    blocks, cur, cur_heading = [], [], False
+    for line in text.splitlines():
+        heading = is_heading(line)
+        if (not line.strip() or heading) and cur:
+            blocks.append(("\n".join(cur), cur_heading))
+            cur, cur_heading = [], False
+        if line.strip():
+            if not cur:
+                cur_heading = heading
+            cur.append(line.strip())
+    if cur:
+        blocks.append(("\n".join(cur), cur_heading))
+    return blocks
+
+
+def _pieces(block: str, max_tokens: int) -> List[str]:
+    """A block cut at sentence ends, then at words, into pieces of at most `max_tokens`."""
+    if estimate_tokens(block) <= max_tokens:
+        return [block]
+    out = []
+    for part in _SENTENCE_END.split(block):
+        if estimate_tokens(part) <= max_tokens:
+            out.append(part)
+            continue
+        words, cur = part.split(), []
+        for w in words:
+            if cur and estimate_tokens(" ".join(cur + [w])) > max_tokens:
+                out.append(" ".join(cur))
+                cur = []
+            cur.append(w)
+        if cur:
+            out.append(" ".join(cur))
+    return out
+
+
+def _tail(text: str, tokens: int) -> str:
+    """The last words of `text` worth about `tokens`."""
+    if tokens <= 0:
+        return ""
+    words, out = text.split(), []
+    for w in reversed(words):
+        if out and estimate_tokens(" ".join([w] + out)) > tokens:
+            break
+        out.insert(0, w)
+    return " ".join(out)
+
+
+def structural_chunks(docs: List[Document], max_tokens: int = 200, overlap_tokens: int = 30,
+                      min_tokens: int = 25) -> List[Document]:
+    """
+    Page-bounded chunks of `docs` (one Document per OCR page).
+    max_tokens     : chunk size limit (estimated tokens)
+    overlap_tokens : tail of a chunk repeated at the head of the next one (same page)
+    min_tokens     : a heading only starts a new chunk once the current one has this much;
+                     a smaller last chunk of a page is merged into the previous one if it fits
+    """
+    # pieces leave room for the overlap (and the joining newline) ahead of them
+    piece_max = max(1, max_tokens - overlap_tokens - 1) if overlap_tokens > 0 else max_tokens
+    out: List[Document] = []
+    for doc in docs:
+        page_chunks: List[tuple[str, str]] = []          # (text, heading) of this page
+        heading, chunk_heading, parts, size = "", "", [], 0
+        for block, starts_heading in split_blocks(doc.page_content):
+            if starts_heading:
+                if size >= min_tokens:
+                    page_chunks.append(("\n".join(parts), chunk_heading))
+                    parts, size = [], 0
+                heading = block.splitlines()[0]
+            for piece in _pieces(block, piece_max):
+                n = estimate_tokens(piece)
+                if parts and estimate_tokens("\n".join(parts + [piece])) > max_tokens:
+                    page_chunks.append(("\n".join(parts), chunk_heading))
+                    overlap = _tail(parts[-1], overlap_tokens)
+                    parts = [overlap] if overlap and estimate_tokens(f"{overlap}\n{piece}") <= max_tokens else []
+                    size = estimate_tokens(overlap) if parts else 0
+                if not parts:
+                    chunk_heading = heading
+                parts.append(piece)
+                size += n
+        if parts:
+            page_chunks.append(("\n".join(parts), chunk_heading))
+        if len(page_chunks) > 1 and estimate_tokens(page_chunks[-1][0]) < min_tokens:
+            last, prev = page_chunks.pop(), page_chunks.pop()
+            merged = prev[0] + "\n" + last[0]
+            if estimate_tokens(merged) <= max_tokens:
+                page_chunks.append((merged, prev[1]))
+            else:
+                page_chunks += [prev, last]
+        for i, (text, head) in enumerate(page_chunks):
+            meta = {**doc.metadata, "chunk": i}
+            if head:
+                meta["heading"] = head
+            out.append(Document(page_content=text, metadata=meta))
+    return out
+
+
+def split_documents(docs: List[Document], emb, chunker: str = "semantic", **kwargs) -> List[Document]:
+    """Chunks of `docs` with the given chunker; kwargs go to SemanticChunker / structural_chunks."""
+    if chunker == "semantic":
+        from langchain_experimental.text_splitter import SemanticChunker
+        return SemanticChunker(emb, **kwargs).split_documents(docs)
+    if chunker == "structural":
+        from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_MIN_TOKENS
+        settings = {"max_tokens": CHUNK_MAX_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+                    "min_tokens": CHUNK_MIN_TOKENS, **kwargs}
+        return structural_chunks(docs, **settings)
+    raise ValueError(f"unknown chunker {chunker!r} (expected one of {', '.join(CHUNKERS)})")
@@ -2,15 +2,23 @@ from pathlib import Path
 import re
 from IPython.display import Image as IPImage, display
 import json
-from crewai import Agent, Crew, Task, LLM
-from langchain_huggingface import HuggingFaceEmbeddings
-from handlers import _clean_json_block
+from crewai import Agent, LLM
+from handlers import _clean_json_block, _infer_lesson
+from runtime import LLM_INVOKER
+from llm_call import call_key
+from context_assembly import lesson_context
+from image_select import ImageSelector, open_caption_cache, open_query_cache
 from retrieval import build_retriever, ChapterRetrieverTool
 from agents import define_agents
 from images import fetch_lesson_images
 from pdf_report import SessionMemory, render_pdf
+from session_digest import feedback_parts, llm_compactor
 from kg import Neo4jKG, _ask_user_for_topic
-from utils_text import parse_quiz_json, _clean_user_question, cosine_similarity
+from utils_text import parse_quiz_json, _clean_user_question, normalize_arabic
+from intent import IntentRouter, summary_topic
+from config import (
+    INTENT_USE_EMBEDDINGS, INTENT_EMB_THRESHOLD, INTENT_EMB_MARGIN, IMAGES_PER_LESSON, SESSION_LLM_COMPACT,
+)
 
 def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
             img_dir: Path = Path("config_files/book_images")) -> None:
@@ -22,8 +30,27 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
     # 1) build Retriever tool + agents
     retriever = build_retriever(pdf_path)
     tool      = ChapterRetrieverTool(retriever)
-    mem       = SessionMemory()
     router, summary, qa_agent, quiz_agent, feedback = define_agents(tool)
+    mem       = SessionMemory(compact=llm_compactor(feedback, LLM_INVOKER) if SESSION_LLM_COMPACT else None)
+    image_selector = ImageSelector(retriever.base_retriever.vectorstore._embedding_function,
+                                   open_caption_cache(), per_lesson=IMAGES_PER_LESSON,
+                                   query_cache=open_query_cache())
+
+    # LLM router is only the fallback for lines the local classifier can't place
+    def llm_route(user_in: str) -> str:
+        return LLM_INVOKER.invoke(
+            router, f"👂 إفهم طلب الطفل: «{user_in}». أرجع كلمة واحدة: summary | qa | quiz | end",
+            "summary | qa | quiz | end", use="router",
+        ).raw
+
+    intents = IntentRouter(
+        llm_route,
+        emb=retriever.base_retriever.vectorstore._embedding_function if INTENT_USE_EMBEDDINGS else None,
+        emb_threshold=INTENT_EMB_THRESHOLD,
+        emb_margin=INTENT_EMB_MARGIN,
+    )
+    # summary topics come back normalized: map them to the KG's own names
+    kg_topics = {normalize_arabic(t): t for t in neo_kg.list_all_topics()}
 
     # 2) little helper to pretty-print markdown with inline pictures ----------
     def render_with_images(markdown: str) -> None:
@@ -52,25 +79,16 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
         if not user_in:
             continue
 
-        # Decide which branch the child wants
-        decision_task = Task(
-            description=f"👂 إفهم طلب الطفل: «{user_in}». أرجع كلمة واحدة: summary | qa | quiz | end",
-            expected_output="summary | qa | quiz | end",
-            agent=router,
-        )
-        decision = (
-            Crew(agents=[router], tasks=[decision_task], verbose=False)
-            .kickoff()
-            .raw.strip().lower()
-        )
+        # Decide which branch the child wants (keywords → embeddings → LLM router)
+        decision = intents.route(user_in)
 
         # ──────── SUMMARY branch ────────────────────────────────────────────
         if decision == "summary":
-            m = re.match(r"ملخص\s+(?:محور\s+)?(?P<topic>[\u0600-\u06FF ]+)", user_in)
-            topic: str | None = m.group("topic").strip() if m else None
+            topic = summary_topic(user_in)
             if not topic:
                 print("⚠️  لازم تذكر اسم المحور بعد كلمة «ملخص».")
                 continue
+            topic = kg_topics.get(topic, topic)       # KG spelling of the normalized name
 
             branch        = neo_kg.find_branch_for_topic(topic)
             lessons_info  = neo_kg.get_lessons_for_topic(topic)
@@ -78,18 +96,21 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
                 print(f" ما لقيتش المحور «{topic}» في الـ KG.")
                 continue
 
-            raw_chunks    : list[str] = []
+            ctx_text, ctx_stats = lesson_context(tool, [ld["title"] for ld in lessons_info], use="summary")
+            print(f"📏 السياق: {ctx_stats['tokens']}/{ctx_stats['budget']} tokens, {ctx_stats['chunks']} مقاطع")
+            chosen = image_selector.select([
+                (ld["title"], ctx_stats["per_lesson"].get(ld["title"], ""), fetch_lesson_images(neo_kg, ld["title"], (ld.get("start_page"), ld.get("end_page"))))
+                for ld in lessons_info
+            ])
             images_blocks : list[str] = []
             for lesson in lessons_info:
-                raw_chunks.extend(tool.run(lesson["title"]))
-                pics = fetch_lesson_images(neo_kg, lesson["title"])
+                pics = chosen[lesson["title"]]
                 if pics:
                     md = "\n".join(
                         f"* [{p['caption']}]({p['name']})" for p in pics
                     )
                     images_blocks.append(f"درس «{lesson['title']}» – التصاور:\n{md}\n")
 
-            ctx_text       = "\n".join(raw_chunks[:20])
             images_section = "\n".join(images_blocks) or "ما ثـمّـة حتى تصاور."
             sub_lessons_md = "\n".join(f"• {ld['title']}" for ld in lessons_info)
 
@@ -130,12 +151,8 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
               الصيغة ![alt](path) وقت تستعمل صورة).
             """
 
-            sum_task = Task(description=sum_prompt,
-                            expected_output="markdown with bullets & images",
-                            agent=summary)
-
-            md_out = Crew(agents=[summary], tasks=[sum_task],
-                          verbose=False).kickoff().raw
+            md_out = LLM_INVOKER.invoke(summary, sum_prompt, "markdown with bullets & images",
+                                        use="summary", key=call_key("summary.md", topic, branch)).raw
             mem.log("chapter_summary", md_out)
             render_with_images(md_out)
 
@@ -143,24 +160,11 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
         elif decision == "qa":
             question = _clean_user_question(user_in)
 
-            # 1) احسب embedding للسؤال
-            hf_emb = HuggingFaceEmbeddings(model_name="Omartificial-Intelligence-Space/GATE-AraBert-v1")
-            q_embedding = hf_emb.embed_query(question)
-
-            # 2) تجيب كل دروس المحفظة مع الـ embeddings متاعهم
-            all_lessons = neo_kg.fetch_all_lesson_embeddings()
-
-            # 3) احسب أعلى تشابه
-            best_score = -1.0
-            inferred_topic = None
-            inferred_lesson = None
-            for entry in all_lessons:
-                lesson_embed = entry["embedding"]
-                score = cosine_similarity(q_embedding, lesson_embed)
-                if score > best_score:
-                    best_score = score
-                    inferred_topic = entry["topic"]
-                    inferred_lesson = entry["lesson"]
+            # 1) احسب embedding للسؤال (بنفس الموديل متاع الـ retriever)
+            q_embedding = retriever.base_retriever.vectorstore._embedding_function.embed_query(question)
+
+            # 2-3) أقرب درس في الـ index متاع الدروس (ANN ولا exact حسب الحجم)
+            best_score, inferred_topic, inferred_lesson = _infer_lesson(q_embedding, neo_kg)
             print("inferedtopic",inferred_topic)
             print("inferred_lesson",inferred_lesson)
             # 4) إذا التشابه أقل من threshold (مثلاً 0.25)، نطلب من الطفل يحدد المحور يدويًا
@@ -174,11 +178,8 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
                 # يمكنك تخطي inferred_lesson أو جعله None → سنعتمد على inferred_topic فقط
             print("inferred_topic2",inferred_topic)
             lessons_info = neo_kg.get_lessons_for_topic(inferred_topic)
-            raw_chunks = []
-            for lesson in lessons_info:
-                raw_chunks.extend(tool.run(lesson["title"]))
-
-            ctx_text = "\n".join(raw_chunks[:20])
+            ctx_text, ctx_stats = lesson_context(tool, [ld["title"] for ld in lessons_info], use="qa")
+            print(f"📏 السياق: {ctx_stats['tokens']}/{ctx_stats['budget']} tokens, {ctx_stats['chunks']} مقاطع")
             branch = neo_kg.find_branch_for_topic(inferred_topic)
 
             # 6) بناء Prompt بيداغوجي باللهجة التونسية
@@ -197,14 +198,9 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
                 "- إذا في جزء صعيب، فسّره بخطوات بسيطة كأنك تشرح لتلميذ في الصف الرابع.\n\n"
                 "ما تذكرش أرقام الصفحات. أجب بلهجة دارجة تونسية."
             )
-            qa_task = Task(
-                description=qa_prompt,
-                expected_output="جواب …",
-                agent=qa_agent,
-            )
-
-            answer = Crew(agents=[qa_agent], tasks=[qa_task], verbose=False).kickoff().raw
-            mem.setdefault("qa_history", []).append((question, answer))
+            answer = LLM_INVOKER.invoke(qa_agent, qa_prompt, "جواب …", use="qa",
+                                        key=call_key("qa", question)).raw
+            mem.add_qa(question, answer)
             print(answer)
 
         # ── “اختبرني” (Quiz) branch ─────────────────────────────────────────────────
@@ -223,11 +219,8 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
 
             branch = neo_kg.find_branch_for_topic(chosen_topic)
             # 3) Gather raw text for each lesson
-            raw_chunks = []
-            for lesson in lessons_info:
-                raw_chunks.extend(tool.run(lesson["title"]))
-
-            ctx_text = "\n".join(raw_chunks[:30])  # a bit more to cover full chapter
+            ctx_text, ctx_stats = lesson_context(tool, [ld["title"] for ld in lessons_info], use="quiz")
+            print(f"📏 السياق: {ctx_stats['tokens']}/{ctx_stats['budget']} tokens, {ctx_stats['chunks']} مقاطع")
 
             # 4) Build a Quiz prompt: “Create 10 questions (5 MC, 5 T/F) covering all points”
             sub_lessons_list = "\n".join(f"• {ld['title']} (pages {ld['start_page']}–{ld['end_page']})"
@@ -243,13 +236,8 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
                 "Return exactly a JSON with structure:\n"
                 "{ 'questions': [ {'type':'mc','q':'…','options':['…','…','…','…'],'a':'…'}, … ] }\n"
             )
-            quiz_task = Task(
-                description=quiz_prompt,
-                expected_output="json",
-                agent=quiz_agent,
-            )
-
-            raw_json = Crew(agents=[quiz_agent], tasks=[quiz_task], verbose=False).kickoff().raw
+            raw_json = LLM_INVOKER.invoke(quiz_agent, quiz_prompt, "json", use="quiz",
+                                          key=call_key("quiz.cli", chosen_topic)).raw
             quiz_data = parse_quiz_json(raw_json)
             if not quiz_data or "questions" not in quiz_data:
                 print("❗ خطأ في JSON المولَّد.")
@@ -314,20 +302,8 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
         # ── “انهينا” (end) branch ───────────────────────────────────────────────────
         elif decision == "end":
             # 1) Build a prompt for the feedback agent, using all logged items in mem
-            fb_parts = []
-
-            # If there was a summary, include it
-            if "chapter_summary" in mem:
-                fb_parts.append(
-                    "ملخّص الدرس:\n" + mem["chapter_summary"] + "\n"
-                )
-
-            # If there is QA history, include those exchanges
-            if "qa_history" in mem:
-                qa_lines = []
-                for q, a in mem["qa_history"]:
-                    qa_lines.append(f"❓ {q}\n📥 {a}\n")
-                fb_parts.append("الأسئلة و الأجوبة:\n" + "\n".join(qa_lines) + "\n")
+            # (summary head, Q&A digest and missed quiz questions, within FEEDBACK_PROMPT_BUDGET)
+            fb_parts = feedback_parts(mem)
 
             # If the user took a quiz, include the quiz results
             if "quiz_results" in mem and "quiz_log" in mem:
@@ -397,17 +373,7 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
             )
 
 
-            feedback_task = Task(
-                description=fb_prompt,
-                expected_output="JSON ملخّص للجلسة",
-                agent=feedback,
-            )
-
-            fb_note = Crew(
-                agents=[feedback],
-                tasks=[feedback_task],
-                verbose=False
-            ).kickoff().raw
+            fb_note = LLM_INVOKER.invoke(feedback, fb_prompt, "JSON ملخّص للجلسة", use="feedback").raw
             
             cleaned = _clean_json_block(fb_note)
             session_report = json.loads(cleaned)
@@ -422,5 +388,6 @@ def run_cli(pdf_path: Path, neo_kg: Neo4jKG,
         else:
             print(" ممشيتش الأمور، جرّب كلمة أخرى.")
 
+    print("📊 توجيه الطلبات:", intents.summary_line())
     # When loop ends, close the Neo4j connection
     neo_kg.close()
@@ -15,6 +15,11 @@ PASSWORD = "C7ebpFAjR9JcM1QbLPJHy5R91gwzaQOUJoBvoUGhfWw"  # ← change to your N
 ARABIC_FONT_PATH = "config_files/NotoNaskhArabic-Regular.ttf"     # ← change if needed
 ARABIC_FONT_NAME = "NotoArabic"
 IMG_DIR = "config_files/book_images"     # adjust if your folder differs
+IMG_MANIFEST_PATH = "config_files/image_manifest.json"   # sizes + page index of IMG_DIR (image_manifest.py)
+IMAGES_PER_LESSON = 2                     # images offered to the summary prompt per lesson (closest captions)
+IMG_CAPTION_CACHE_SIZE = 5000             # cached caption embeddings
+IMG_QUERY_CACHE_SIZE = 500                # cached lesson-text query embeddings (kept apart from the captions)
+IMG_LOOKUP = "kg"                         # lesson images from "kg" (with captions) or "manifest" (page range, no query)
 MAX_IMG_W = 180                           # pixel width allowed on page
 MAX_IMG_H = 140                           # pixel height allowed on page
 
@@ -23,3 +28,136 @@ MD_IMG = re.compile(r'!\[(.*?)\]\((.*?)\)')   # ![alt](path)
 
 # Register the Arabic font
 pdfmetrics.registerFont(TTFont(ARABIC_FONT_NAME, ARABIC_FONT_PATH))
+
+# --- Models used for retrieval (shared by the retriever, QA and caches) ---
+EMBEDDING_MODEL = "Omartificial-Intelligence-Space/GATE-AraBert-v1"
+RERANKER_MODEL = "Omartificial-Intelligence-Space/ARA-Reranker-V1"
+
+# --- LLM calls (deadline per use, hedged second request, last good reply as fallback) ---
+LLM_DEADLINES = {"summary": 90.0, "summary.lesson": 60.0, "summary.merge": 45.0, "quiz": 60.0,
+                 "qa": 30.0, "feedback": 30.0, "router": 10.0}
+LLM_DEFAULT_DEADLINE = 60.0       # seconds, uses not listed above
+LLM_HEDGE_QUANTILE = 0.9          # hedge once a call is slower than this share of recent calls (0 = never)
+LLM_HEDGE_MIN_S = 2.0             # ... but never before this many seconds
+LLM_WORKERS = 16                  # concurrent LLM calls (hedges and abandoned calls included); more are rejected
+LLM_FALLBACK_SIZE = 500           # last good replies kept (cache/llm_last_good.json)
+
+# --- Chunking (build_retriever; compare with benchmarks/eval_retrieval.py) ---
+CHUNKER = os.getenv("ETUDE_CHUNKER", "semantic")   # semantic (SemanticChunker) | structural (page-aware, no embeddings)
+CHUNK_MAX_TOKENS = 200            # structural: chunk size limit (estimated tokens)
+CHUNK_OVERLAP_TOKENS = 30         # structural: tail repeated at the head of the next chunk on the page
+CHUNK_MIN_TOKENS = 25             # structural: smaller chunks are merged rather than cut at a heading
+
+# --- Adaptive reranking (skip / shrink the cross-encoder when the vector stage is confident) ---
+RERANK_MODE = os.getenv("ETUDE_RERANK_MODE", "always")   # always | adaptive | never
+RERANK_SKIP_MARGIN = 0.15         # top-1 minus top-2 vector relevance that skips the rerank
+RERANK_SHRINK_MARGIN = 0.05       # smaller gap: rerank only the best RERANK_SHRINK_TO candidates
+RERANK_SHRINK_TO = 4
+RERANK_TITLE_MAX_WORDS = 8        # a query this short found verbatim in the best chunk skips the rerank
+
+# --- QA caches (exact question → embedding, near-duplicate question → answer) ---
+QA_CACHE_DIR = "cache"
+QA_EMB_CACHE_SIZE = 2000          # max normalized questions kept with their embedding
+QA_ANSWER_CACHE_SIZE = 500        # max answered questions kept (all lessons together)
+QA_ANSWER_TTL = 7 * 24 * 3600     # seconds before a cached answer is considered stale
+QA_SEMANTIC_THRESHOLD = 0.93      # cosine similarity needed to reuse a previous answer
+
+# --- CLI intent routing (keywords first, then example-phrase embeddings, then the LLM router) ---
+INTENT_USE_EMBEDDINGS = True
+INTENT_EMB_THRESHOLD = 0.80       # min cosine to the closest example phrase
+INTENT_EMB_MARGIN = 0.05          # min gap between the best and the runner-up intent
+
+# --- Observability ---
+DEBUG_TIMINGS = os.environ.get("ETUDE_DEBUG_TIMINGS", "0") == "1"   # Server-Timing header on every response
+
+# --- KG backend: "neo4j" (remote graph) or "snapshot" (local read-only copy, see kg_snapshot.py) ---
+KG_BACKEND = os.environ.get("ETUDE_KG_BACKEND", "neo4j")
+KG_SNAPSHOT_PATH = os.environ.get("ETUDE_KG_SNAPSHOT", "config_files/kg_snapshot.json")
+
+# --- Neo4j driver pool (sync and async clients) ---
+NEO4J_MAX_POOL_SIZE = 50          # connections per driver
+NEO4J_ACQUISITION_TIMEOUT = 10.0  # seconds to wait for a free pooled connection
+NEO4J_CONNECTION_TIMEOUT = 10.0   # seconds to open a new connection
+NEO4J_MAX_RETRY_TIME = 15.0       # seconds a read transaction is retried on transient errors
+KG_ASYNC = True                   # FastAPI prefetches topic data with the async driver (neo4j backend only)
+
+# --- Lesson nearest-neighbour index (topic inference for QA) ---
+LESSON_INDEX_KIND = "auto"        # "exact" | "ivf" | "auto" (exact below ANN_EXACT_BELOW vectors)
+ANN_EXACT_BELOW = 5000
+ANN_NLIST = 0                     # IVF lists (0 → ≈ 4·√n)
+ANN_NPROBE = 8                    # IVF lists scanned per query: higher = better recall, slower
+LESSON_VECTORS_PATH = "cache/lesson_vectors.bin"   # memory-mapped export of the KG lesson embeddings (Neo4j backend)
+LESSON_VECTORS_DTYPE = "float32"                     # or "float16": half the size, slightly slower scoring
+
+# --- Corpus (one entry per book; a book serves the KG branches it lists, empty = fallback book) ---
+BOOKS = [
+    {
+        "id": "eveil-4",
+        "grade": 4,
+        "subject": "الإيقاظ العلمي",
+        "pdf": PDF_PATH,
+        "ocr_cache": "config_files/ktebjson/Book.json",
+        "branches": [],
+    },
+]
+CORPUS_RAM_BUDGET_MB = 1024       # resident book indexes above this are evicted, least recently used first (0 = no limit)
+
+# --- Quiz bank (pre-generated questions per topic) ---
+QUIZ_BANK_DIR = "cache/quiz_bank"
+QUIZ_BANK_TARGET_MC = 30          # pool size a top-up aims for
+QUIZ_BANK_TARGET_TF = 20
+QUIZ_BANK_LOW_WATER = 0.5         # top up in the background below this fraction of the target
+
+# --- Prompt context assembly ---
+CONTEXT_TOKEN_BUDGET = 2500       # estimated tokens of book text per prompt
+CONTEXT_CHARS_PER_TOKEN = 3.0     # token estimate for Arabic text
+CONTEXT_DEDUPE_THRESHOLD = 0.8    # word-trigram Jaccard above which two chunks count as the same
+
+# --- Summary fan-out (one generation per lesson, then a merge pass) ---
+SUMMARY_FANOUT = os.environ.get("ETUDE_SUMMARY_FANOUT", "0") == "1"   # per-lesson concurrent summaries
+SUMMARY_FANOUT_MIN_LESSONS = 3    # fewer lessons → single generation
+SUMMARY_FANOUT_WORKERS = 4        # concurrent lesson generations
+
+# --- Request coalescing (identical concurrent /summary, /quiz share one generation) ---
+SUMMARY_FLIGHT_TIMEOUT = 180.0    # seconds a request waits for the shared generation
+QUIZ_FLIGHT_TIMEOUT = 120.0
+TOPIC_LIST_TTL = 60.0             # seconds the KG topic names used to resolve module spellings are kept
+
+# --- Session compaction (bounded history for the end-of-session feedback prompt) ---
+SESSION_KEEP_RECENT = 3           # latest Q&A turns kept (clipped) as is
+SESSION_DIGEST_TOKENS = 600       # cap for the older, folded turns
+SESSION_TURN_TOKENS = 120         # cap per recent answer
+SESSION_LLM_COMPACT = os.getenv("ETUDE_SESSION_LLM_COMPACT", "0") == "1"  # rewrite folded turns with the LLM
+FEEDBACK_PROMPT_BUDGET = 1500     # tokens for summary + Q&A + quiz sections
+
+# --- Session reports (rendered in memory, streamed from GET /report/{id}) ---
+REPORT_CACHE_SIZE = 64            # reports kept in memory
+REPORT_TTL = 3600.0               # seconds a report stays downloadable
+REPORT_ARCHIVE_DIR = os.getenv("ETUDE_REPORT_ARCHIVE", "")   # e.g. "reports/archive"; empty = no write-behind
+REPORT_ARCHIVE_TTL = 7 * 86400.0  # seconds archived reports are kept
+
+# --- Batch generation (POST /batch, python -m batch) ---
+BATCH_WORKERS = 3                 # concurrent generations per job
+BATCH_RATE_PER_MIN = 30           # generations started per minute (0 = no limit)
+BATCH_MAX_ITEMS = 400             # modules × kinds accepted per request
+BATCH_JOBS_KEPT = 20              # finished jobs kept for GET /batch/{id}
+
+# --- Pre-fork serving (python -m serve) ---
+SERVE_HOST = "0.0.0.0"
+SERVE_PORT = 8000
+SERVE_WORKERS = int(os.getenv("ETUDE_WORKERS", "2"))    # forked workers sharing the preloaded models
+SERVE_THREADS_PER_WORKER = 2      # torch intra-op threads per worker
+SERVE_THREADPOOL = 16             # run_in_threadpool slots per worker
+
+# --- Shared worker state (sessions, reports, batch progress, profiles; see shared_state.py) ---
+SHARED_STATE_PATH = os.getenv("ETUDE_SHARED_STATE", "")   # empty = per process (single worker)
+SERVE_SHARED_STATE_PATH = os.path.join(QA_CACHE_DIR, "shared_state.sqlite3")   # set by serve.py for --workers > 1
+SHARED_STATE_TTL = 86400.0        # seconds a session, batch job or profile is kept
+
+# --- Profiling (X-Profile: 1 + X-Admin-Token; GET /admin/profiles) ---
+ADMIN_TOKEN = os.getenv("ETUDE_ADMIN_TOKEN", "")   # empty = on-demand profiling and /admin/* disabled
+PROFILE_INTERVAL = 0.005          # seconds between stack samples of an on-demand profile
+PROFILE_SAMPLE_RATE = float(os.getenv("ETUDE_PROFILE_SAMPLE_RATE", "0"))   # share of requests profiled always-on
+PROFILE_SAMPLED_INTERVAL = 0.02   # coarser sampling for the always-on profiles
+PROFILE_KEEP_SLOWEST = 20         # always-on profiles kept (slowest requests)
+PROFILE_KEEP_ADMIN = 20           # on-demand profiles kept (latest)
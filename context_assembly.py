@@ -0,0 +1,131 @@
+"""
+Token-budgeted prompt context from per-lesson retrieval results.
+
+Instead of concatenating every lesson's chunks and cutting at a fixed count:
+
+1. near-identical chunks retrieved by several lessons are kept once (the
+   best-scored copy), compared on word-trigram Jaccard similarity;
+   scores are min-max normalized per lesson first, since a search returns
+   cross-encoder scores or, when the rerank was skipped, vector relevance;
+2. the budget is filled in rounds — every lesson gets its best remaining
+   chunk before any lesson gets another, lessons with the higher
+   (normalized) score picking first — so lesson order no longer decides
+   what is cut;
+3. the per-lesson headers and separators count against the budget too,
+   so the returned text fits it; its tokens are recorded in
+   `etude_context_tokens`.
+
+Tokens are estimated from characters (CONTEXT_CHARS_PER_TOKEN), close
+enough for Gemini on Arabic text to keep prompt sizes predictable.
+"""
+from __future__ import annotations
+import math
+from typing import Iterable
+
+from utils_text import normalize_arabic
+from metrics import REGISTRY
+
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "etude_context_tokens", "Estimated tokens of assembled prompt context.", ("use",),
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000),
+)
+
+
+def estimate_tokens(text: str, chars_per_token: float | None = None) -> int:
+    return _chars_to_tokens(len(text), chars_per_token)
+
+
+def _chars_to_tokens(chars: int, chars_per_token: float | None = None) -> int:
+    if chars_per_token is None:
+        from config import CONTEXT_CHARS_PER_TOKEN as chars_per_token
+    return math.ceil(chars / chars_per_token) if chars else 0
+
+
+def _header(title: str) -> str:
+    return f"— «{title}»:\n"
+
+
+def _shingles(text: str) -> frozenset:
+    words = normalize_arabic(text).split()
+    if len(words) < 3:
+        return frozenset([" ".join(words)])
+    return frozenset(" ".join(words[i:i + 3]) for i in range(len(words) - 2))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def normalize_scores(hits: list[tuple[float, str]]) -> list[tuple[float, str]]:
+    """Scores of one lesson's hits mapped to 0..1 (best = 1), whatever scale they came on."""
+    if not hits:
+        return []
+    lo, hi = min(s for s, _ in hits), max(s for s, _ in hits)
+    return [((s - lo) / (hi - lo) if hi > lo else 1.0, text) for s, text in hits]
+
+
+def assemble_context(per_lesson: dict[str, list[tuple[float, str]]], budget_tokens: int,
+                     dedupe_threshold: float = 0.8, use: str = "") -> tuple[str, dict]:
+    """
+    per_lesson : lesson title -> [(score, chunk text), ...] (cross-encoder or
+                 vector relevance; normalized per lesson)
+    Returns (context text, stats); chunks stay grouped by lesson, in the
+    given lesson order, best first.
+    """
+    # 1) dedupe across (and within) lessons, best-scored copy wins
+    ranked = sorted(((s, title, text) for title, hits in per_lesson.items()
+                     for s, text in normalize_scores(hits) if text.strip()), key=lambda x: -x[0])
+    kept: list[tuple[float, str, str]] = []
+    kept_shingles: list[frozenset] = []
+    dupes = 0
+    for score, title, text in ranked:
+        sh = _shingles(text)
+        if any(_jaccard(sh, other) >= dedupe_threshold for other in kept_shingles):
+            dupes += 1
+            continue
+        kept.append((score, title, text))
+        kept_shingles.append(sh)
+
+    queues: dict[str, list[tuple[float, str]]] = {}
+    for score, title, text in kept:                      # already best-first
+        queues.setdefault(title, []).append((score, text))
+
+    # 2) round-robin fill, lessons ordered by their next chunk's score each round;
+    #    characters of the final text are counted (a lesson's first chunk brings its
+    #    header and the blank line before it), so the estimate is that of the result
+    chosen: dict[str, list[str]] = {t: [] for t in queues}
+    used_chars = skipped = 0
+    while any(queues.values()):
+        for title in sorted((t for t in queues if queues[t]), key=lambda t: -queues[t][0][0]):
+            _, text = queues[title].pop(0)
+            if chosen[title]:
+                added = 1 + len(text)                                    # "\n" between chunks
+            else:
+                added = (2 if used_chars else 0) + len(_header(title)) + len(text)
+            if _chars_to_tokens(used_chars + added) > budget_tokens:
+                skipped += 1
+                continue
+            chosen[title].append(text)
+            used_chars += added
+
+    parts = [_header(t) + "\n".join(chosen[t]) for t in per_lesson if chosen.get(t)]
+    text = "\n\n".join(parts)
+    stats = {
+        "tokens": estimate_tokens(text),
+        "budget": budget_tokens,
+        "chunks": sum(len(c) for c in chosen.values()),
+        "dropped_duplicates": dupes,
+        "dropped_budget": skipped,
+        "per_lesson": {t: "\n".join(c) for t, c in chosen.items()},
+    }
+    CONTEXT_TOKENS.observe(stats["tokens"], use=use)
+    return text, stats
+
+
+def lesson_context(tool, titles: Iterable[str], budget_tokens: int | None = None,
+                   use: str = "") -> tuple[str, dict]:
+    """Retrieve every lesson with `tool.search` and assemble the result within the budget."""
+    from config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUPE_THRESHOLD
+    per_lesson = {title: tool.search(title) for title in titles}
+    return assemble_context(per_lesson, budget_tokens or CONTEXT_TOKEN_BUDGET,
+                            CONTEXT_DEDUPE_THRESHOLD, use=use)
@@ -0,0 +1,255 @@
+"""
+Multi-book corpus: every registered book (grade, subject, PDF, OCR cache)
+gets its own retriever, built the first time a request needs it.
+
+* Routing   – a topic's KG branch picks the book that covers it; books with
+              no `branches` are the fallback.
+* Sharing   – the embedding model and cross-encoder are loaded once and
+              reused by every book's retriever.
+* Eviction  – resident book indexes are kept in LRU order; when their
+              estimated size exceeds `ram_budget_mb` the least recently used
+              ones are dropped (and rebuilt from the OCR cache on next use).
+              A book is pinned while a request uses it (`use`, and every
+              CorpusRetrieverTool search); pinned books are only released
+              once the last request using them is done.
+
+Handlers select the book for the current request with
+
+    with CORPUS.use_topic(kg, topic):
+        ...   # CorpusRetrieverTool searches that book
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+from retrieval import build_retriever, ChapterRetrieverTool
+from metrics import span
+
+_current_book: ContextVar[str | None] = ContextVar("etude_current_book", default=None)
+
+
+@dataclass(frozen=True)
+class Book:
+    id: str
+    pdf: str
+    grade: int | None = None
+    subject: str = ""
+    ocr_cache: str | None = None
+    branches: tuple[str, ...] = field(default_factory=tuple)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Book":
+        return cls(id=d["id"], pdf=d["pdf"], grade=d.get("grade"), subject=d.get("subject", ""),
+                   ocr_cache=d.get("ocr_cache"), branches=tuple(d.get("branches") or ()))
+
+
+def estimate_retriever_mb(retriever, sample: int = 32) -> float:
+    """
+    Rough resident size of a book index: vectors (+ HNSW graph ≈ same again) and chunk text.
+    Reads the collection's count, one vector and the chunk text size build_retriever
+    records (a sample's mean when absent) — never the whole collection.
+    """
+    try:
+        collection = retriever.base_retriever.vectorstore._collection
+        n = collection.count()
+        if not n:
+            return 0.0
+        got = collection.get(limit=sample, include=["documents", "embeddings"])
+    except Exception:
+        return 0.0
+    docs, embs = got.get("documents") or [], got.get("embeddings")
+    dim = len(embs[0]) if embs is not None and len(embs) else 0
+    text_bytes = (collection.metadata or {}).get("text_bytes")
+    if text_bytes is None:
+        text_bytes = n * sum(len(d.encode("utf-8")) for d in docs) / max(len(docs), 1)
+    return (2 * n * dim * 4 + text_bytes) / 2**20
+
+
+class CorpusManager:
+    def __init__(self, books: Iterable[Book | dict], ram_budget_mb: float = 0, emb=None, cross=None,
+                 k_fetch: int = 8, k_rerank: int = 3, build: Callable[..., Any] = build_retriever):
+        """
+        ram_budget_mb : evict least recently used book indexes above this (0 = no limit);
+                        books pinned by running requests are evicted once unpinned.
+        emb / cross   : shared models (loaded on first build when not given).
+        build         : retriever factory, `build_retriever` signature.
+        """
+        self.books: dict[str, Book] = {}
+        for b in books:
+            b = b if isinstance(b, Book) else Book.from_dict(b)
+            self.books[b.id] = b
+        if not self.books:
+            raise ValueError("corpus needs at least one book")
+        self._by_branch = {br: b.id for b in self.books.values() for br in b.branches}
+        self.default_book = next((b.id for b in self.books.values() if not b.branches), next(iter(self.books)))
+        self.ram_budget_mb = ram_budget_mb
+        self.emb, self.cross = emb, cross
+        self.k_fetch, self.k_rerank = k_fetch, k_rerank
+        self._build = build
+        self._loaded: OrderedDict[str, tuple[Any, float]] = OrderedDict()   # book id -> (retriever, MB)
+        self._lock = threading.Lock()
+        self._build_locks = {bid: threading.Lock() for bid in self.books}
+        self._pins: dict[str, int] = {}          # book id -> requests using it
+        self._doomed: set[str] = set()           # evict() on a pinned book: released when unpinned
+        self.loads = self.evictions = 0
+
+    # ─ routing ─────────────────────────────────────────────────────
+    def book_for_branch(self, branch: str | None) -> str:
+        return self._by_branch.get(branch, self.default_book)
+
+    def book_for_topic(self, kg, topic: str | None) -> str:
+        """Book covering `topic` (the KG is only asked when several books are registered)."""
+        if not topic or len(self.books) == 1:
+            return self.default_book
+        return self.book_for_branch(kg.find_branch_for_topic(topic))
+
+    @contextmanager
+    def use(self, book_id: str | None):
+        """Select `book_id` for this request and pin it (not evicted) until the block ends."""
+        pinned = book_id or self.default_book
+        with self._lock:
+            self._pins[pinned] = self._pins.get(pinned, 0) + 1
+        token = _current_book.set(book_id)
+        try:
+            yield book_id
+        finally:
+            _current_book.reset(token)
+            self._unpin(pinned)
+
+    def _unpin(self, book_id: str) -> None:
+        with self._lock:
+            self._pins[book_id] -= 1
+            if self._pins[book_id]:
+                return
+            del self._pins[book_id]
+            victims = self._pick_victims()
+        for victim, r in victims:
+            self._release(victim, r)
+
+    def use_branch(self, branch: str | None):
+        return self.use(self.book_for_branch(branch))
+
+    def use_topic(self, kg, topic: str | None):
+        return self.use(self.book_for_topic(kg, topic))
+
+    # ─ retrievers ──────────────────────────────────────────────────
+    def _models(self):
+        with self._lock:
+            if self.emb is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                from config import EMBEDDING_MODEL
+                self.emb = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+            if self.cross is None:
+                from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+                from config import RERANKER_MODEL
+                self.cross = HuggingFaceCrossEncoder(model_name=RERANKER_MODEL)
+        return self.emb, self.cross
+
+    def retriever(self, book_id: str | None = None):
+        """Retriever of `book_id` (default: the book selected for this request), built on first use."""
+        book_id = book_id or _current_book.get() or self.default_book
+        if book_id not in self.books:
+            raise LookupError(f"⚠️ الكتاب «{book_id}» موش مسجّل.")
+        with self._lock:
+            if book_id in self._loaded:
+                self._loaded.move_to_end(book_id)
+                return self._loaded[book_id][0]
+        with self._build_locks[book_id]:                  # one build per book, other books not blocked
+            with self._lock:
+                if book_id in self._loaded:
+                    return self._loaded[book_id][0]
+            book = self.books[book_id]
+            emb, cross = self._models()
+            t0 = time.perf_counter()
+            with span("corpus.load_book"):
+                retriever = self._build(book.pdf, k_fetch=self.k_fetch, k_rerank=self.k_rerank,
+                                        emb=emb, cross=cross, ocr_cache=book.ocr_cache,
+                                        collection_name=f"book_{book.id}")
+            print(f"📚 book «{book.id}» loaded in {time.perf_counter() - t0:.1f}s")
+            self.attach(book_id, retriever)
+        return retriever
+
+    def attach(self, book_id: str, retriever, size_mb: float | None = None) -> None:
+        """Register an already-built retriever for `book_id` (then apply the RAM budget)."""
+        size_mb = estimate_retriever_mb(retriever) if size_mb is None else size_mb
+        with self._lock:
+            self._loaded[book_id] = (retriever, size_mb)
+            self._loaded.move_to_end(book_id)
+            self.loads += 1
+            victims = self._pick_victims()
+        for victim, r in victims:
+            self._release(victim, r)
+
+    def _pick_victims(self) -> list[tuple[str, Any]]:
+        """Unpinned books to drop: pending evict() calls, then LRU above the budget (lock held)."""
+        victims = []
+        for book_id in [b for b in self._doomed if b not in self._pins]:
+            self._doomed.discard(book_id)
+            if book_id in self._loaded:
+                victims.append((book_id, self._loaded.pop(book_id)[0]))
+                self.evictions += 1
+        while self.ram_budget_mb and len(self._loaded) > 1 and self.resident_mb() > self.ram_budget_mb:
+            newest = next(reversed(self._loaded))
+            victim = next((b for b in self._loaded if b not in self._pins and b != newest), None)
+            if victim is None:
+                break                   # everything else is in use: over budget until a request ends
+            victims.append((victim, self._loaded.pop(victim)[0]))
+            self.evictions += 1
+        return victims
+
+    def evict(self, book_id: str) -> bool:
+        """Drop `book_id` now, or when the last request using it ends."""
+        with self._lock:
+            if book_id not in self._loaded:
+                return False
+            if book_id in self._pins:
+                self._doomed.add(book_id)
+                return True
+            entry = self._loaded.pop(book_id)
+            self.evictions += 1
+        self._release(book_id, entry[0])
+        return True
+
+    @staticmethod
+    def _release(book_id: str, retriever) -> None:
+        print(f"♻️  book «{book_id}» evicted from memory")
+        try:
+            retriever.base_retriever.vectorstore.delete_collection()
+        except Exception:
+            pass
+
+    def resident_mb(self) -> float:
+        return sum(mb for _, mb in self._loaded.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "books": len(self.books),
+                "resident": {bid: round(mb, 1) for bid, (_, mb) in self._loaded.items()},
+                "resident_mb": round(self.resident_mb(), 1),
+                "pinned": dict(self._pins),
+                "ram_budget_mb": self.ram_budget_mb,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+class CorpusRetrieverTool(ChapterRetrieverTool):
+    """chapter_retriever over the book selected for the current request."""
+
+    def __init__(self, corpus: CorpusManager, rerank: str | None = None):
+        super().__init__(None, rerank=rerank)
+        object.__setattr__(self, "_corpus", corpus)
+
+    def _current_retriever(self):
+        return self._corpus.retriever()
+
+    def search(self, query: str):
+        # pin the book for the whole search, also when called outside CORPUS.use()
+        with self._corpus.use(_current_book.get()):
+            return super().search(query)
@@ -1,14 +1,21 @@
 from __future__ import annotations
-import json, re
+import json, re, weakref
 from typing import Tuple, Any, List
-from crewai import Crew, Task
 
 from images import fetch_lesson_images
 from retrieval import ChapterRetrieverTool  # for type hints only
 from pdf_report import render_pdf
 from kg import Neo4jKG
+from metrics import span, timed, record_llm_usage
+from ann_index import build_lesson_index, load_or_build_lesson_index
+from context_assembly import lesson_context
 
-from runtime import SUMMARY_AGENT, QA_AGENT, QUIZ_AGENT, FEEDBACK_AGENT, TOOL, GLOBAL_MEM
+from runtime import (
+    SUMMARY_AGENT, QA_AGENT, QUIZ_AGENT, FEEDBACK_AGENT, TOOL, GLOBAL_MEM,
+    EMB_CACHE, ANSWER_CACHE, CORPUS, IMAGE_SELECTOR, LLM_INVOKER,
+)
+from llm_call import call_key, _own_agent
+from quiz_bank import QUIZ_JSON_SCHEMA
 
 # ——— small helpers (kept in-file to avoid touching your utils) ———
 def _clean_user_question(raw: str) -> str:
@@ -32,31 +39,84 @@ def parse_quiz_json(raw_text: str):
             return None
 
 # ——— shared retrieval of context & images ———
-def retrieve_context(topic: str, kg: Neo4jKG) -> Tuple[str, str]:
-    lessons = kg.get_lessons_for_topic(topic)
-    text_chunks: List[str] = []
+@timed("handlers.retrieve_context")
+def retrieve_context(topic: str, kg: Neo4jKG, bundle: dict | None = None,
+                     use: str = "", with_images: bool = True) -> Tuple[str, str]:
+    """
+    bundle      : optional prefetched kg.fetch_topic_bundle(topic), so no KG
+                  query is repeated here.
+    use         : label for the context-size metric (summary / qa / quiz).
+    with_images : False skips the image lookups (the images block is then empty).
+    The book text is deduplicated and fitted to CONTEXT_TOKEN_BUDGET; each
+    lesson keeps only its IMAGES_PER_LESSON images closest to that text.
+    """
+    lessons = bundle["lessons"] if bundle else kg.get_lessons_for_topic(topic)
+    ctx_text, ctx_stats = lesson_context(TOOL, [ld["title"] for ld in lessons], use=use)
+    if not with_images:
+        return ctx_text, "ما ثـمّـة حتى تصاور."
+    chosen = IMAGE_SELECTOR.select([
+        (ld["title"], ctx_stats["per_lesson"].get(ld["title"], ""),
+         (bundle["images"].get(ld["title"]) if bundle
+          else fetch_lesson_images(kg, ld["title"], (ld.get("start_page"), ld.get("end_page")))) or [])
+        for ld in lessons
+    ])
     images_blocks: List[str] = []
     for ld in lessons:
-        text_chunks.extend(TOOL.run(ld["title"]))
-        pics = fetch_lesson_images(kg, ld["title"])
+        pics = chosen.get(ld["title"])
         if pics:
             md = "\n".join(f"* [{p['caption']}]({p['name']})" for p in pics)
             images_blocks.append(f"درس «{ld['title']}» – التصاور:\n{md}\n")
-    return "\n".join(text_chunks[:30]), ("\n".join(images_blocks) or "ما ثـمّـة حتى تصاور.")
+    return ctx_text, ("\n".join(images_blocks) or "ما ثـمّـة حتى تصاور.")
 
 # ——— SUMMARY ———
-def generate_summary_json(user_in: str, kg: Neo4jKG) -> dict:
+def _parse_json_object(raw: str) -> dict:
+    """Outermost {...} of an LLM reply (code fences stripped)."""
+    with span("json.parse"):
+        cleaned = _clean_json_block(raw)
+        start = cleaned.find("{"); end = cleaned.rfind("}")
+        if start < 0 or end < 0:
+            from fastapi import HTTPException
+            raise HTTPException(502, "No JSON object found in LLM output")
+
+        return json.loads(cleaned[start:end+1])
+
+def generate_summary_json(user_in: str, kg: Neo4jKG, bundle: dict | None = None,
+                          fanout: bool | None = None) -> dict:
+    """
+    fanout : one concurrent generation per lesson + a merge pass for the
+             intro / conclusion (default: SUMMARY_FANOUT for topics with at
+             least SUMMARY_FANOUT_MIN_LESSONS lessons).
+    """
+    from config import SUMMARY_FANOUT, SUMMARY_FANOUT_MIN_LESSONS
     m = re.match(r"ملخص\s+(?:محور\s+)?(?P<topic>[\u0600-\u06FF ]+)", user_in)
     if not m:
         raise ValueError("⚠️ لازم تذكر اسم المحور بعد كلمة «ملخص».")
     topic = m.group("topic").strip()
 
-    branch = kg.find_branch_for_topic(topic)
-    lessons_info = kg.get_lessons_for_topic(topic)
+    if bundle is None or bundle["topic"] != topic:
+        bundle = kg.fetch_topic_bundle(topic)
+    branch, lessons_info = bundle["branch"], bundle["lessons"]
     if not branch or not lessons_info:
         raise LookupError(f"⚠️ ما لقيتش المحور «{topic}» في الـ KG.")
 
-    ctx_text, images_section = retrieve_context(topic, kg)
+    if fanout is None:
+        fanout = SUMMARY_FANOUT and len(lessons_info) >= SUMMARY_FANOUT_MIN_LESSONS
+    with CORPUS.use_branch(branch):
+        data = _summary_fanout(topic, branch, bundle) if fanout else _summary_single(topic, branch, kg, bundle)
+    filename = f"{branch}_{topic}.json".replace(" ", "_")
+
+    # where to write lesson JSON (match your existing pattern if you have one)
+    from pathlib import Path
+    out_dir = Path("lessons"); out_dir.mkdir(exist_ok=True)
+    path = out_dir / filename
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    return {"path": f"/lessons/{filename}", "data": data}
+
+def _summary_single(topic: str, branch: str, kg: Neo4jKG, bundle: dict) -> dict:
+    """Whole topic in one SUMMARY_AGENT generation."""
+    lessons_info = bundle["lessons"]
+    ctx_text, images_section = retrieve_context(topic, kg, bundle, use="summary")
     sub_lessons_md = "\n".join(f"• {ld['title']}" for ld in lessons_info)
 
     prompt = f"""
@@ -91,47 +151,129 @@ def generate_summary_json(user_in: str, kg: Neo4jKG) -> dict:
 }}
 """.strip()
 
-    task = Task(description=prompt, expected_output="json", agent=SUMMARY_AGENT)
-    raw = Crew(agents=[SUMMARY_AGENT], tasks=[task], verbose=False).kickoff().raw
-    cleaned = _clean_json_block(raw)
-    start = cleaned.find("{"); end = cleaned.rfind("}")
-    if start < 0 or end < 0:
-        from fastapi import HTTPException
-        raise HTTPException(502, "No JSON object found in LLM output")
+    with span("llm.summary"):
+        out = LLM_INVOKER.invoke(SUMMARY_AGENT, prompt, "json", use="summary", key=call_key("summary", topic, branch))
+    record_llm_usage("summary", out)
+    return _parse_json_object(out.raw)
 
-    data = json.loads(cleaned[start:end+1])
-    filename = f"{branch}_{topic}.json".replace(" ", "_")
+def _summary_lesson_slides(topic: str, branch: str, ld: dict, pics: list[dict], budget: int) -> list[dict]:
+    """Slides explaining one lesson (runs in a fan-out worker)."""
+    ctx_text, _ = lesson_context(TOOL, [ld["title"]], budget_tokens=budget, use="summary.lesson")
+    pics = IMAGE_SELECTOR.select([(ld["title"], ctx_text, pics)])[ld["title"]]
+    images_md = "\n".join(f"* [{p['caption']}]({p['name']})" for p in pics) or "ما ثـمّـة حتى تصاور."
+    prompt = f"""
+إنتي معلّم/ة تونسي/ة تبسّط درس “{ld['title']}” (محور “{topic}”، فرع “{branch}”) لتلميذ في
+السنة الرابعة ابتـدائي، بالدارجة.
 
-    # where to write lesson JSON (match your existing pattern if you have one)
-    from pathlib import Path
-    from config import Path as _Path  # just to avoid shadowing
-    out_dir = Path("lessons"); out_dir.mkdir(exist_ok=True)
-    path = out_dir / filename
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+┌─ مقتطفات من الكتاب:
+{ctx_text}
 
-    return {"path": f"/lessons/{filename}", "data": data}
+┌─ تصاور الدرس (اختياري، صورة وحدة على الأكثر):
+{images_md}
+
+• اشرح الفكرة الرئيسية بعبارة مبسّطة.
+• أعط مثال واقعي من حياة الطفل.
+• إذا لزم الأمر أدرج صورة هكذا: ![alt](file-name.jpeg)
+
+أخرج JSON فقط: {{ "slides": [ {{ "text": "..." }} ] }} (شريحة ولا زوز).
+""".strip()
+    with span("llm.summary.lesson"):
+        out = LLM_INVOKER.invoke(_own_agent(SUMMARY_AGENT), prompt, "json", use="summary.lesson",
+                                 key=call_key("summary.lesson", topic, ld["title"]))
+    record_llm_usage("summary", out)
+    return [s for s in _parse_json_object(out.raw).get("slides", []) if s.get("text")]
+
+def _summary_fanout(topic: str, branch: str, bundle: dict) -> dict:
+    """
+    One generation per lesson, at most SUMMARY_FANOUT_WORKERS at a time,
+    then a short merge generation for the title, intro and closing line.
+    """
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+    from config import SUMMARY_FANOUT_WORKERS, CONTEXT_TOKEN_BUDGET
+
+    lessons = bundle["lessons"]
+    budget = max(500, CONTEXT_TOKEN_BUDGET // 2)
+    with ThreadPoolExecutor(max_workers=SUMMARY_FANOUT_WORKERS) as pool:
+        # each worker runs in a copy of this context: same book, same request timings
+        futures = [
+            pool.submit(contextvars.copy_context().run, _summary_lesson_slides,
+                        topic, branch, ld, bundle["images"].get(ld["title"]) or [], budget)
+            for ld in lessons
+        ]
+        per_lesson = []
+        for ld, fut in zip(lessons, futures):
+            try:
+                per_lesson.append(fut.result() or [{"text": f"• {ld['title']}"}])
+            except Exception as e:
+                print(f"⚠️  summary of lesson «{ld['title']}» failed: {e}")
+                per_lesson.append([{"text": f"• {ld['title']}"}])
+
+    digest = "\n".join(f"• {ld['title']}: {slides[0]['text'][:160]}" for ld, slides in zip(lessons, per_lesson))
+    prompt = f"""
+محور “{topic}” (فرع “{branch}”) تشرح درس درس هكا:
+{digest}
+
+أكتب بالدارجة التونسية لتلميذ في السنة الرابعة:
+- "intro": إفتتاحيّة (سطرين ـ ٣ سطور) تعرّف بالمحور ولماذا يهمّ التلميذ.
+- "closing": سطر يُلخّص «رسالة/عبرة» المحور.
+
+أخرج JSON فقط: {{ "title": "درس عن {topic}", "intro": "...", "closing": "..." }}
+""".strip()
+    with span("llm.summary.merge"):
+        out = LLM_INVOKER.invoke(SUMMARY_AGENT, prompt, "json", use="summary.merge",
+                                 key=call_key("summary.merge", topic, branch))
+    record_llm_usage("summary", out)
+    merged = _parse_json_object(out.raw)
+
+    texts = [merged.get("intro", "")] + [s["text"] for slides in per_lesson for s in slides] + [merged.get("closing", "")]
+    return {
+        "title": merged.get("title") or f"درس عن {topic}",
+        "slides": [{"number": str(i), "text": t} for i, t in enumerate((t for t in texts if t), 1)],
+    }
 
 # ——— QA ———
+_LESSON_INDEXES: "weakref.WeakKeyDictionary[Any, Any]" = weakref.WeakKeyDictionary()   # KG -> index, dropped with the KG
+
+def lesson_index(kg: Neo4jKG):
+    """
+    Nearest-neighbour index over the KG lesson embeddings, built once per KG
+    instance. For the remote backend it sits on the memory-mapped export
+    (LESSON_VECTORS_PATH), shared by all worker processes and only
+    re-pulled from Neo4j when the KG's lessons changed.
+    """
+    idx = _LESSON_INDEXES.get(kg)
+    if idx is None:
+        idx = load_or_build_lesson_index(kg) if isinstance(kg, Neo4jKG) else build_lesson_index(kg)
+        _LESSON_INDEXES[kg] = idx
+    return idx
+
+def _infer_lesson(q_emb: List[float], kg: Neo4jKG) -> Tuple[float, str | None, str | None]:
+    """Best (cosine score, topic, lesson) for a question embedding over the KG lessons."""
+    hits = lesson_index(kg).search(q_emb, k=1)
+    if not hits:
+        return -1.0, None, None
+    score, hit = hits[0]
+    return score, hit["topic"], hit["lesson"]
+
 def handle_qa(question: str, kg: Neo4jKG, emb) -> str:
     q = _clean_user_question(question)
+    # exact cache: the same (normalized) question is only embedded once
+    with span("qa.embed"):
+        q_emb = EMB_CACHE.embed_query(emb, q)
     # basic vector-based topic pick using your KG embeddings
-    q_emb = emb.embed_query(q)
-    all_lessons = kg.fetch_all_lesson_embeddings()
-
-    def _cos(a, b):
-        import math
-        dot = sum(x*y for x, y in zip(a, b))
-        n1 = math.sqrt(sum(x*x for x in a)); n2 = math.sqrt(sum(y*y for y in b))
-        return dot/(n1*n2) if n1 and n2 else 0.0
-
-    best_score, inferred_topic, inferred_lesson = -1.0, None, None
-    for row in all_lessons:
-        score = _cos(q_emb, row["embedding"])
-        if score > best_score:
-            best_score, inferred_topic, inferred_lesson = score, row["topic"], row["lesson"]
-
-    if best_score >= 0.25 and inferred_topic:
-        ctx_text, _ = retrieve_context(inferred_topic, kg)
+    with span("qa.topic_inference"):
+        best_score, inferred_topic, inferred_lesson = _infer_lesson(q_emb, kg)
+
+    on_lesson = best_score >= 0.25 and inferred_topic
+    book = CORPUS.book_for_topic(kg, inferred_topic if on_lesson else None)
+    if on_lesson:
+        # semantic cache: a near-identical question on this lesson was already answered
+        cached = ANSWER_CACHE.lookup(inferred_topic, inferred_lesson, q_emb)
+        if cached is not None:
+            return cached
+        with CORPUS.use(book):
+            ctx_text, _ = retrieve_context(inferred_topic, kg, use="qa", with_images=False)
         sub_md = "\n".join(f"• {ld['title']}" for ld in kg.get_lessons_for_topic(inferred_topic))
         prompt = (
             f"أنت معلّم صبور. السؤال: «{q}»\n"
@@ -145,26 +287,36 @@ def handle_qa(question: str, kg: Neo4jKG, emb) -> str:
             "اشرح ببساطة مع مثال من الحياة اليومية."
         )
 
-    task = Task(description=prompt, expected_output="text", agent=QA_AGENT)
-    answer = Crew(agents=[QA_AGENT], tasks=[task], verbose=False).kickoff().raw
+    with CORPUS.use(book), span("llm.qa"):
+        out = LLM_INVOKER.invoke(QA_AGENT, prompt, "text", use="qa", key=call_key("qa", q))
+    record_llm_usage("qa", out)
+    answer = out.raw
+    if on_lesson and not getattr(out, "fallback", False):
+        ANSWER_CACHE.put(inferred_topic, inferred_lesson, q, q_emb, answer)
     return answer
 
 # ——— QUIZ ———
-def generate_quiz_json(module: str, kg: Neo4jKG, num_mc: int = 6, num_tf: int = 4) -> dict:
-    branch = kg.find_branch_for_topic(module)
-    lessons_info = kg.get_lessons_for_topic(module)
+def generate_quiz_json(module: str, kg: Neo4jKG, num_mc: int = 6, num_tf: int = 4,
+                       bundle: dict | None = None) -> dict:
+    if bundle is None or bundle["topic"] != module:
+        bundle = kg.fetch_topic_bundle(module)
+    branch, lessons_info = bundle["branch"], bundle["lessons"]
     if not branch or not lessons_info:
         raise LookupError(f"⚠️ ما لقيتش المحور «{module}» في الـ KG.")
-    ctx_text, _ = retrieve_context(module, kg)
+    with CORPUS.use_branch(branch):
+        ctx_text, _ = retrieve_context(module, kg, bundle, use="quiz", with_images=False)
     sub_list = "\n".join(f"• {ld['title']} (pages {ld['start_page']}–{ld['end_page']})" for ld in lessons_info)
 
     prompt = (
         f"أنت صانع امتحانات لابتدائي. أعد JSON فيه {num_mc} MC و{num_tf} صح/خطأ "
         f"عن محور «{module}» (فرع «{branch}»). غطّ كل الدروس:\n{sub_list}\n\n"
         f"مقتطفات:\n{ctx_text}\n\n"
-        "Return JSON: { 'questions': [ {'type':'mc',...}, {'type':'tf',...} ] }"
+        + QUIZ_JSON_SCHEMA
     )
-    task = Task(description=prompt, expected_output="json", agent=QUIZ_AGENT)
-    raw = Crew(agents=[QUIZ_AGENT], tasks=[task], verbose=False).kickoff().raw
-    data = parse_quiz_json(raw)
+    with CORPUS.use_branch(branch), span("llm.quiz"):
+        out = LLM_INVOKER.invoke(QUIZ_AGENT, prompt, "json", use="quiz",
+                                 key=call_key("quiz", module, num_mc, num_tf))
+    record_llm_usage("quiz", out)
+    with span("json.parse"):
+        data = parse_quiz_json(out.raw)
     return {"module": module, "data": data}
@@ -0,0 +1,148 @@
+"""
+Manifest of the extracted book images (config_files/book_images).
+
+Filenames already encode the page (`page_{N}_img_{M}.jpeg`), so one scan
+records, per image: file, page, index, width, height, format and byte size.
+The manifest then answers
+
+* `size(name)`              – layout in render_pdf without decoding the image;
+* `for_pages(start, end)`   – images of a lesson's page range without a KG query.
+
+It is stored as JSON (IMG_MANIFEST_PATH) and refreshed on load: only new or
+resized files are opened, removed files are dropped.
+
+    python -m image_manifest build
+    python -m image_manifest info
+"""
+from __future__ import annotations
+import bisect
+import json
+import os
+import re
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+_NAME = re.compile(r"page_(\d+)_img_(\d+)\.\w+$", re.IGNORECASE)
+_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+
+
+class ImageManifest:
+    def __init__(self, img_dir: str | Path, entries: dict[str, dict]):
+        self.img_dir = Path(img_dir)
+        self.entries = entries
+        paged = sorted((e["page"], e["index"], name) for name, e in entries.items() if e.get("page") is not None)
+        self._pages = [p for p, _, _ in paged]
+        self._paged_names = [name for _, _, name in paged]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def get(self, name: str) -> dict | None:
+        return self.entries.get(name)
+
+    def size(self, name: str) -> tuple[int, int] | None:
+        e = self.entries.get(name)
+        return (e["width"], e["height"]) if e else None
+
+    def for_pages(self, start: int | None, end: int | None) -> list[dict]:
+        """Images on pages start..end (inclusive), in page then index order."""
+        if start is None:
+            return []
+        end = start if end is None else end
+        lo = bisect.bisect_left(self._pages, start)
+        hi = bisect.bisect_right(self._pages, end)
+        return [self.entries[n] for n in self._paged_names[lo:hi]]
+
+    def to_json(self) -> dict:
+        return {"img_dir": str(self.img_dir), "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "images": [self.entries[n] for n in sorted(self.entries)]}
+
+
+def _describe(path: Path) -> dict:
+    from PIL import Image
+    m = _NAME.search(path.name)
+    with Image.open(path) as im:          # header only; pixels are not decoded
+        width, height, fmt = im.width, im.height, im.format
+    return {
+        "file": path.name,
+        "page": int(m.group(1)) if m else None,
+        "index": int(m.group(2)) if m else 0,
+        "width": width,
+        "height": height,
+        "format": fmt,
+        "bytes": path.stat().st_size,
+    }
+
+
+def build_manifest(img_dir: str | Path, previous: dict[str, dict] | None = None) -> tuple[ImageManifest, int]:
+    """Scan `img_dir`; entries of `previous` whose byte size is unchanged are reused. Returns (manifest, files opened)."""
+    img_dir = Path(img_dir)
+    previous = previous or {}
+    entries, opened = {}, 0
+    if img_dir.is_dir():
+        for de in os.scandir(img_dir):
+            if not de.is_file() or Path(de.name).suffix.lower() not in _EXTS:
+                continue
+            old = previous.get(de.name)
+            if old is not None and old.get("bytes") == de.stat().st_size:
+                entries[de.name] = old
+                continue
+            try:
+                entries[de.name] = _describe(Path(de.path))
+                opened += 1
+            except Exception as e:
+                print(f"⚠️  image {de.path} skipped ({e})")
+    return ImageManifest(img_dir, entries), opened
+
+
+def load_manifest(img_dir: str | Path | None = None, path: str | Path | None = None) -> ImageManifest:
+    """Manifest from `path`, refreshed against `img_dir` and rewritten if anything changed."""
+    from config import IMG_DIR, IMG_MANIFEST_PATH
+    img_dir, path = Path(img_dir or IMG_DIR), Path(path or IMG_MANIFEST_PATH)
+    previous = {}
+    if path.exists():
+        try:
+            previous = {e["file"]: e for e in json.loads(path.read_text(encoding="utf-8"))["images"]}
+        except Exception as e:
+            print(f"⚠️  image manifest {path} unreadable, rebuilding ({e})")
+    manifest, opened = build_manifest(img_dir, previous)
+    if opened or set(previous) != set(manifest.entries):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".json.tmp")
+            tmp.write_text(json.dumps(manifest.to_json(), ensure_ascii=False, indent=1), encoding="utf-8")
+            tmp.replace(path)
+        except OSError as e:
+            print(f"⚠️  image manifest {path} not saved ({e})")
+    return manifest
+
+
+@lru_cache(maxsize=1)
+def get_manifest() -> ImageManifest:
+    """Process-wide manifest of IMG_DIR (loaded on first use)."""
+    return load_manifest()
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="Build / inspect the book image manifest.")
+    ap.add_argument("cmd", choices=["build", "info"])
+    args = ap.parse_args(argv)
+    manifest = load_manifest()
+    pages = [e["page"] for e in manifest.entries.values() if e.get("page") is not None]
+    print(json.dumps({
+        "img_dir": str(manifest.img_dir),
+        "images": len(manifest),
+        "pages": [min(pages), max(pages)] if pages else None,
+        "bytes": sum(e["bytes"] for e in manifest.entries.values()),
+    }, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Pick the few images worth putting in a prompt.
+
+The summary prompt used to list every caption of every lesson although
+the model may use at most 3 images. ImageSelector keeps, per lesson, the
+`per_lesson` images whose caption embedding is closest to that lesson's
+retrieved text. Caption embeddings are cached on disk, so after
+`python -m image_select warm` a selection only embeds captions it has not
+seen before; the per-request lesson-text queries go to a separate, smaller
+cache so that traffic never evicts the warmed captions.
+"""
+from __future__ import annotations
+import os
+import sys
+
+import numpy as np
+
+from qa_cache import EmbeddingCache
+from metrics import REGISTRY, span
+
+IMAGES_SELECTED = REGISTRY.counter("etude_images_selected_total", "Lesson images offered to prompts.", ("result",))
+
+
+class CaptionEmbeddingCache(EmbeddingCache):
+    name = "image_captions"
+
+
+class ImageQueryEmbeddingCache(EmbeddingCache):
+    name = "image_queries"
+
+
+def open_caption_cache() -> CaptionEmbeddingCache:
+    from config import QA_CACHE_DIR, IMG_CAPTION_CACHE_SIZE, EMBEDDING_MODEL
+    return CaptionEmbeddingCache(os.path.join(QA_CACHE_DIR, "image_captions.json"),
+                                 IMG_CAPTION_CACHE_SIZE, model_name=EMBEDDING_MODEL)
+
+
+def open_query_cache() -> ImageQueryEmbeddingCache:
+    from config import QA_CACHE_DIR, IMG_QUERY_CACHE_SIZE, EMBEDDING_MODEL
+    return ImageQueryEmbeddingCache(os.path.join(QA_CACHE_DIR, "image_queries.json"),
+                                    IMG_QUERY_CACHE_SIZE, model_name=EMBEDDING_MODEL)
+
+
+def _caption(pic: dict) -> str:
+    return (pic.get("caption") or "").strip() or pic["name"]
+
+
+class ImageSelector:
+    def __init__(self, emb, cache: EmbeddingCache, per_lesson: int = 2, query_chars: int = 600,
+                 query_cache: EmbeddingCache | None = None):
+        """
+        cache       : caption embeddings (warmed ahead of time)
+        per_lesson  : images kept per lesson (lessons with fewer are left as is)
+        query_chars : how much of a lesson's retrieved text is embedded as its query
+        query_cache : lesson-text query embeddings (None: not cached)
+        """
+        self.emb, self.cache, self.query_cache = emb, cache, query_cache
+        self.per_lesson, self.query_chars = per_lesson, query_chars
+
+    def select(self, lessons: list[tuple[str, str, list[dict]]]) -> dict[str, list[dict]]:
+        """
+        lessons : [(lesson title, retrieved lesson text, images), ...]
+        Returns lesson title -> kept images, in their original (page) order.
+        """
+        out = {title: pics for title, _, pics in lessons}
+        crowded = [(title, text, pics) for title, text, pics in lessons if len(pics) > self.per_lesson]
+        if not crowded:
+            IMAGES_SELECTED.inc(sum(len(p) for p in out.values()), result="kept")
+            return out
+        with span("images.select"):
+            texts = [f"{title}\n{text[:self.query_chars]}" for title, text, _ in crowded]
+            queries = np.asarray(self.query_cache.embed_many(self.emb, texts) if self.query_cache is not None
+                                 else self.emb.embed_documents(texts), dtype=np.float32)
+            captions = list(dict.fromkeys(_caption(p) for _, _, pics in crowded for p in pics))
+            cap_vecs = np.asarray(self.cache.embed_many(self.emb, captions), dtype=np.float32)
+            cap_vecs /= np.linalg.norm(cap_vecs, axis=1, keepdims=True).clip(min=1e-12)
+            row = {c: i for i, c in enumerate(captions)}
+            for (title, _, pics), q in zip(crowded, queries):
+                scores = cap_vecs[[row[_caption(p)] for p in pics]] @ q
+                keep = sorted(np.argsort(-scores)[:self.per_lesson])
+                out[title] = [pics[i] for i in keep]
+        kept = sum(len(p) for p in out.values())
+        IMAGES_SELECTED.inc(kept, result="kept")
+        IMAGES_SELECTED.inc(sum(len(pics) for _, _, pics in lessons) - kept, result="dropped")
+        return out
+
+    def warm(self, kg) -> int:
+        """Embed every image caption of the KG ahead of time; returns how many captions there are."""
+        captions = [
+            _caption(p)
+            for topic in kg.list_all_topics()
+            for ld in kg.get_lessons_for_topic(topic)
+            for p in kg.fetch_lesson_images(ld["title"])
+        ]
+        captions = list(dict.fromkeys(captions))
+        if captions:
+            self.cache.embed_many(self.emb, captions)
+            self.cache.flush()
+        return len(captions)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from config import EMBEDDING_MODEL
+    from kg import open_kg
+
+    ap = argparse.ArgumentParser(description="Precompute image caption embeddings.")
+    ap.add_argument("cmd", choices=["warm"])
+    ap.parse_args(argv)
+    kg = open_kg()
+    try:
+        n = ImageSelector(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL), open_caption_cache()).warm(kg)
+    finally:
+        kg.close()
+    print(f"✅ {n} captions embedded")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,30 @@
-from typing import List
-from kg import Neo4jKG
+from __future__ import annotations
+from typing import TYPE_CHECKING, List
 
-def fetch_lesson_images(kg: Neo4jKG, lesson_title: str) -> list[dict]:
+if TYPE_CHECKING:                  # kg imports this module for its topic bundles
+    from kg import Neo4jKG
+
+def fetch_lesson_images(kg: Neo4jKG, lesson_title: str,
+                        pages: tuple[int, int] | None = None) -> list[dict]:
     """
     Return every Image attached to a Lesson via
     (l:Lesson)-[:HAS_IMAGE]->(img:Image).
-    Each row is a dict with keys: file, caption, page.
-    """
-    cypher = """
-    MATCH (l:Lesson {title: $title})-[:HAS_IMAGE]->(img:Image)
-    RETURN img.name    AS name,
-           img.caption AS caption,
-           img.page    AS page
-    ORDER BY img.page
+    Each row is a dict with keys: name, caption, page.
+    (The query lives on the KG backend so local backends can answer it too.)
+
+    pages : the lesson's (start_page, end_page); with IMG_LOOKUP = "manifest"
+            the images on those pages are taken from the image manifest
+            instead (no KG query, captions are generic).
     """
-    with kg.driver.session() as session:
-        return session.run(cypher, title=lesson_title).data()
+    pics = manifest_images(pages)
+    return pics if pics is not None else kg.fetch_lesson_images(lesson_title)
+
+
+def manifest_images(pages: tuple[int, int] | None) -> list[dict] | None:
+    """Images on the pages `pages` from the manifest; None unless IMG_LOOKUP = "manifest" and pages are known."""
+    from config import IMG_LOOKUP
+    if IMG_LOOKUP != "manifest" or not pages or pages[0] is None:
+        return None
+    from image_manifest import get_manifest
+    return [{"name": e["file"], "caption": f"صورة صفحة {e['page']}", "page": e["page"]}
+            for e in get_manifest().for_pages(*pages)]
@@ -0,0 +1,126 @@
+"""
+Fast-path intent routing for the CLI: summary | qa | quiz | end.
+
+The prompts tell the child exactly what to type ('ملخص …', 'سؤال: …',
+'اختبرني', 'انهينا'), so most lines can be routed locally:
+
+1) keyword / regex rules          → instant, confidence 1.0 (or 0.8 for
+                                     question-looking lines)
+2) optional embedding classifier  → nearest example phrase, accepted only
+                                     above a threshold and with a margin
+3) the LLM router                 → only for what is still ambiguous
+
+`IntentRouter.stats` counts how often each path was taken.
+"""
+from __future__ import annotations
+import logging
+import re
+from collections import Counter
+from typing import Callable
+
+from utils_text import cosine_similarity, normalize_arabic
+
+log = logging.getLogger(__name__)
+
+INTENTS = ("summary", "qa", "quiz", "end")
+
+SUMMARY_KEYWORDS = r"(ملخص|لخص|لخصلي|لخصلنا|summary)"
+
+# Rules run on normalize_arabic(text): no diacritics, unified alef, no punctuation.
+INTENT_RULES: list[tuple[str, re.Pattern, float]] = [
+    ("end",     re.compile(r"^(انهينا|كملنا|وفينا|خلاص|يزي|باي|bye|exit|quit|end)\b"), 1.0),
+    ("summary", re.compile(rf"^{SUMMARY_KEYWORDS}\b"), 1.0),
+    ("qa",      re.compile(r"^(سؤال|qa)\b"), 1.0),
+    ("quiz",    re.compile(r"^(اختبار|امتحني|امتحان|كويز|quiz)\b|\bاختبرني\b"), 1.0),
+    ("qa",      re.compile(r"^(شنوه|شنوة|شنية|شنو|علاش|كيفاش|وقتاش|وين|شكون|قداش|اشنوه|"
+                           r"ما هو|ما هي|ماذا|لماذا|كيف|متى|اين|من هو|هل)\b"), 0.8),
+]
+
+INTENT_EXAMPLES: dict[str, list[str]] = {
+    "summary": ["ملخص محور الهواء", "لخصلي الدرس", "نحب ملخص على الحواس", "فسرلي المحور الكل"],
+    "qa":      ["سؤال: شنوة الماء؟", "علاش السماء زرقاء", "كيفاش نحمي سناني", "عندي سؤال على الدرس"],
+    "quiz":    ["اختبرني", "نحب نعمل امتحان", "اعطيني أسئلة نجاوب عليها", "نحب نختبر روحي"],
+    "end":     ["انهينا", "وفينا اليوم", "نحب نوقف", "خلاص بركة"],
+}
+
+_SUMMARY_WORD = re.compile(rf"\b{SUMMARY_KEYWORDS}\b")
+_TOPIC_FILLER = re.compile(r"^(?:(?:علي|عن|في|محور|المحور|درس|الدرس|of|on|about)(?:\s+|$))*")   # normalized forms
+
+
+def summary_topic(text: str) -> str | None:
+    """
+    Topic named after the summary keyword ('ملخّص محور الهواء' → 'الهواء'), in
+    normalize_arabic form like the rules see it; None when nothing follows.
+    """
+    norm = normalize_arabic(text)
+    m = _SUMMARY_WORD.search(norm)
+    if not m:
+        return None
+    topic = _TOPIC_FILLER.sub("", norm[m.end():].strip())
+    return topic or None
+
+
+class IntentRouter:
+    def __init__(self, llm_route: Callable[[str], str], emb=None,
+                 examples: dict[str, list[str]] = INTENT_EXAMPLES,
+                 emb_threshold: float = 0.80, emb_margin: float = 0.05,
+                 min_rule_confidence: float = 0.75):
+        """
+        llm_route : fallback, takes the raw line and returns one of INTENTS
+        emb       : optional embeddings object (embed_query/embed_documents)
+        """
+        self.llm_route = llm_route
+        self.emb = emb
+        self.examples = examples
+        self.emb_threshold = emb_threshold
+        self.emb_margin = emb_margin
+        self.min_rule_confidence = min_rule_confidence
+        self._example_vecs: list[tuple[str, list[float]]] | None = None
+        self.stats: Counter = Counter()
+
+    def classify_rules(self, text: str) -> tuple[str | None, float]:
+        norm = normalize_arabic(text)
+        for intent, pattern, confidence in INTENT_RULES:
+            if pattern.search(norm):
+                return intent, confidence
+        if text.rstrip().endswith(("؟", "?")):
+            return "qa", 0.8
+        return None, 0.0
+
+    def classify_embedding(self, text: str) -> tuple[str | None, float]:
+        if self.emb is None:
+            return None, 0.0
+        if self._example_vecs is None:
+            labels = [(i, p) for i, phrases in self.examples.items() for p in phrases]
+            vecs = self.emb.embed_documents([p for _, p in labels])
+            self._example_vecs = [(i, v) for (i, _), v in zip(labels, vecs)]
+        q = self.emb.embed_query(text)
+        best: dict[str, float] = {}
+        for intent, vec in self._example_vecs:
+            best[intent] = max(best.get(intent, -1.0), cosine_similarity(q, vec))
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+        top_intent, top = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        if top >= self.emb_threshold and top - runner_up >= self.emb_margin:
+            return top_intent, top
+        return None, top
+
+    def route(self, text: str) -> str:
+        intent, conf = self.classify_rules(text)
+        if intent and conf >= self.min_rule_confidence:
+            return self._taken("rule", intent, text)
+        intent, conf = self.classify_embedding(text)
+        if intent:
+            return self._taken("embedding", intent, text)
+        decision = self.llm_route(text).strip().lower()
+        return self._taken("llm", decision, text)
+
+    def _taken(self, path: str, intent: str, text: str) -> str:
+        self.stats[path] += 1
+        log.info("intent %s via %s (%s)", intent, path, dict(self.stats))
+        return intent
+
+    def summary_line(self) -> str:
+        total = sum(self.stats.values()) or 1
+        return "  ".join(f"{p}: {self.stats[p]} ({100 * self.stats[p] / total:.0f}%)"
+                         for p in ("rule", "embedding", "llm"))
@@ -1,47 +1,82 @@
 from neo4j import GraphDatabase
 from typing import Dict, Tuple
 
+from metrics import timed
+
+# Cypher shared by the sync (Neo4jKG) and async (kg_async.AsyncNeo4jKG) clients
+Q_LESSONS_FOR_TOPIC = """
+MATCH (t:Topic {name: $topic_name})-[:HAS_LESSON]->(l:Lesson)
+RETURN l.title AS title, l.start_page AS start_page, l.end_page AS end_page
+ORDER BY l.title
+"""
+Q_BRANCH_FOR_TOPIC = """
+MATCH (b:Branch)-[:HAS_TOPIC]->(t:Topic {name: $topic_name})
+RETURN b.name AS branch_name
+"""
+Q_ALL_TOPICS = "MATCH (t:Topic) RETURN t.name AS name ORDER BY t.name"
+Q_ALL_LESSON_EMBEDDINGS = """
+MATCH (t:Topic)-[:HAS_LESSON]->(l:Lesson)
+WHERE l.vector_embedding IS NOT NULL
+RETURN t.name AS topic, l.title AS lesson, l.vector_embedding AS embedding
+"""
+Q_LESSON_KEYS = """
+MATCH (t:Topic)-[:HAS_LESSON]->(l:Lesson)
+WHERE l.vector_embedding IS NOT NULL
+RETURN t.name AS topic, l.title AS lesson, size(l.vector_embedding) AS dim,
+       reduce(s = 0.0, i IN range(0, size(l.vector_embedding) - 1) |
+              s + (i + 1) * l.vector_embedding[i]) AS checksum
+"""
+Q_LESSON_IMAGES = """
+MATCH (l:Lesson {title: $title})-[:HAS_IMAGE]->(img:Image)
+RETURN img.name    AS name,
+       img.caption AS caption,
+       img.page    AS page
+ORDER BY img.page
+"""
+
 class Neo4jKG:
-    def __init__(self, uri: str, user: str, pwd: str):
-        self.driver = GraphDatabase.driver(uri, auth=(user, pwd))
+    def __init__(self, uri: str, user: str, pwd: str, **driver_kwargs):
+        """
+        driver_kwargs are passed to GraphDatabase.driver, e.g.
+        max_connection_pool_size, connection_acquisition_timeout,
+        connection_timeout, max_transaction_retry_time.
+        """
+        self.driver = GraphDatabase.driver(uri, auth=(user, pwd), **driver_kwargs)
 
     def close(self):
         self.driver.close()
 
+    def _read(self, query: str, **params) -> list[dict]:
+        """Run `query` in a managed read transaction (retried on transient errors)."""
+        def work(tx):
+            return tx.run(query, **params).data()
+        with self.driver.session() as session:
+            return session.execute_read(work)
+
+    @timed("kg.get_lessons_for_topic")
     def get_lessons_for_topic(self, topic_name: str) -> list[dict]:
         """
         Returns a list of dicts:
           [{ 'title': <string>, 'start_page': <int>, 'end_page': <int> }, …]
         """
-        query = """
-        MATCH (t:Topic {name: $topic_name})-[:HAS_LESSON]->(l:Lesson)
-        RETURN l.title AS title, l.start_page AS start_page, l.end_page AS end_page
-        ORDER BY l.title
-        """
-        with self.driver.session() as session:
-            result = session.run(query, topic_name=topic_name)
-            return [record.data() for record in result]
+        return self._read(Q_LESSONS_FOR_TOPIC, topic_name=topic_name)
 
+    @timed("kg.find_branch_for_topic")
     def find_branch_for_topic(self, topic_name: str) -> str | None:
         """
         Returns the parent Branch name of a given topic, or None if not found.
         """
-        query = """
-        MATCH (b:Branch)-[:HAS_TOPIC]->(t:Topic {name: $topic_name})
-        RETURN b.name AS branch_name
-        """
-        with self.driver.session() as session:
-            rec = session.run(query, topic_name=topic_name).single()
-            return rec["branch_name"] if rec else None
+        rows = self._read(Q_BRANCH_FOR_TOPIC, topic_name=topic_name)
+        return rows[0]["branch_name"] if rows else None
 
+    @timed("kg.list_all_topics")
     def list_all_topics(self) -> list[str]:
         """
         Returns the list of all topic names currently in the KG.
         """
-        query = "MATCH (t:Topic) RETURN t.name AS name ORDER BY t.name"
-        with self.driver.session() as session:
-            result = session.run(query)
-            return [record["name"] for record in result]
+        return [row["name"] for row in self._read(Q_ALL_TOPICS)]
+
+    @timed("kg.fetch_all_lesson_embeddings")
     def fetch_all_lesson_embeddings(self) -> list[dict]:
         """
         Return a list of dicts, each containing:
@@ -49,14 +84,71 @@ class Neo4jKG:
           - 'lesson': lesson title
           - 'embedding': the stored vector_embedding (list of floats)
         """
-        cypher = """
-        MATCH (t:Topic)-[:HAS_LESSON]->(l:Lesson)
-        WHERE l.vector_embedding IS NOT NULL
-        RETURN t.name AS topic, l.title AS lesson, l.vector_embedding AS embedding
+        return self._read(Q_ALL_LESSON_EMBEDDINGS)
+
+    @timed("kg.list_lesson_keys")
+    def list_lesson_keys(self) -> list[dict]:
+        """
+        Same rows as fetch_all_lesson_embeddings without the vectors
+        ('topic', 'lesson', 'dim', and 'checksum' = Σ (i+1)·v[i], see
+        lesson_vectors.embedding_checksum): a cheap way to tell whether an
+        exported copy of the embeddings is still current.
         """
-        with self.driver.session() as session:
-            records = session.run(cypher)
-            return [record.data() for record in records]
+        return self._read(Q_LESSON_KEYS)
+
+    @timed("kg.fetch_lesson_images")
+    def fetch_lesson_images(self, lesson_title: str) -> list[dict]:
+        """
+        Return every Image attached to a Lesson via
+        (l:Lesson)-[:HAS_IMAGE]->(img:Image).
+        Each row is a dict with keys: name, caption, page.
+        """
+        return self._read(Q_LESSON_IMAGES, title=lesson_title)
+
+    def fetch_topic_bundle(self, topic_name: str) -> dict:
+        """
+        Everything the summary/quiz paths read for one topic:
+          {'topic', 'branch', 'lessons': [...], 'images': {lesson_title: [...]}}
+        """
+        return topic_bundle(self, topic_name)
+
+def topic_bundle(kg, topic_name: str) -> dict:
+    """fetch_topic_bundle for any backend exposing the per-item read methods."""
+    from images import fetch_lesson_images
+    lessons = kg.get_lessons_for_topic(topic_name)
+    return {
+        "topic": topic_name,
+        "branch": kg.find_branch_for_topic(topic_name),
+        "lessons": lessons,
+        "images": {ld["title"]: fetch_lesson_images(kg, ld["title"], (ld.get("start_page"), ld.get("end_page")))
+                   for ld in lessons},
+    }
+
+def open_kg(backend: str | None = None):
+    """
+    Build the KG backend selected in config (KG_BACKEND):
+      - "neo4j"    → Neo4jKG on URI/USER/PASSWORD
+      - "snapshot" → SnapshotKG loaded from KG_SNAPSHOT_PATH (no network)
+    """
+    from config import URI, USER, PASSWORD, KG_BACKEND, KG_SNAPSHOT_PATH
+    backend = backend or KG_BACKEND
+    if backend == "snapshot":
+        from kg_snapshot import SnapshotKG
+        return SnapshotKG(KG_SNAPSHOT_PATH)
+    if backend == "neo4j":
+        return Neo4jKG(URI, USER, PASSWORD, **neo4j_driver_settings())
+    raise ValueError(f"unknown KG backend {backend!r} (expected 'neo4j' or 'snapshot')")
+
+def neo4j_driver_settings() -> dict:
+    """Pool / timeout / retry settings from config, for both the sync and async drivers."""
+    from config import (NEO4J_MAX_POOL_SIZE, NEO4J_ACQUISITION_TIMEOUT,
+                        NEO4J_CONNECTION_TIMEOUT, NEO4J_MAX_RETRY_TIME)
+    return {
+        "max_connection_pool_size": NEO4J_MAX_POOL_SIZE,
+        "connection_acquisition_timeout": NEO4J_ACQUISITION_TIMEOUT,
+        "connection_timeout": NEO4J_CONNECTION_TIMEOUT,
+        "max_transaction_retry_time": NEO4J_MAX_RETRY_TIME,
+    }
 
 def _ask_user_for_topic(kg: Neo4jKG) -> str | None:
     """
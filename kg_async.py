@@ -0,0 +1,94 @@
+"""
+Async Neo4j access for the FastAPI handlers.
+
+AsyncNeo4jKG mirrors Neo4jKG on neo4j's async driver: one pooled driver,
+every query in a managed (retrying) read transaction, and independent
+lookups issued concurrently — `fetch_topic_bundle` gets the branch and the
+lessons together, then all lessons' images together, so a topic costs two
+round-trips instead of 2 + N sequential ones.
+"""
+from __future__ import annotations
+import asyncio
+
+from neo4j import AsyncGraphDatabase
+
+from kg import (
+    Q_LESSONS_FOR_TOPIC, Q_BRANCH_FOR_TOPIC, Q_ALL_TOPICS,
+    Q_ALL_LESSON_EMBEDDINGS, Q_LESSON_KEYS, Q_LESSON_IMAGES, neo4j_driver_settings,
+)
+from metrics import span
+
+
+class AsyncNeo4jKG:
+    def __init__(self, uri: str, user: str, pwd: str, database: str | None = None, **driver_kwargs):
+        """
+        driver_kwargs are passed to AsyncGraphDatabase.driver, e.g.
+        max_connection_pool_size, connection_acquisition_timeout,
+        connection_timeout, max_transaction_retry_time.
+        """
+        self.database = database
+        self.driver = AsyncGraphDatabase.driver(uri, auth=(user, pwd), **driver_kwargs)
+
+    async def close(self):
+        await self.driver.close()
+
+    async def _read(self, query: str, **params) -> list[dict]:
+        async def work(tx):
+            result = await tx.run(query, **params)
+            return await result.data()
+        async with self.driver.session(database=self.database) as session:
+            return await session.execute_read(work)
+
+    async def get_lessons_for_topic(self, topic_name: str) -> list[dict]:
+        with span("kg.get_lessons_for_topic"):
+            return await self._read(Q_LESSONS_FOR_TOPIC, topic_name=topic_name)
+
+    async def find_branch_for_topic(self, topic_name: str) -> str | None:
+        with span("kg.find_branch_for_topic"):
+            rows = await self._read(Q_BRANCH_FOR_TOPIC, topic_name=topic_name)
+        return rows[0]["branch_name"] if rows else None
+
+    async def list_all_topics(self) -> list[str]:
+        with span("kg.list_all_topics"):
+            return [row["name"] for row in await self._read(Q_ALL_TOPICS)]
+
+    async def fetch_all_lesson_embeddings(self) -> list[dict]:
+        with span("kg.fetch_all_lesson_embeddings"):
+            return await self._read(Q_ALL_LESSON_EMBEDDINGS)
+
+    async def list_lesson_keys(self) -> list[dict]:
+        with span("kg.list_lesson_keys"):
+            return await self._read(Q_LESSON_KEYS)
+
+    async def fetch_lesson_images(self, lesson_title: str) -> list[dict]:
+        with span("kg.fetch_lesson_images"):
+            return await self._read(Q_LESSON_IMAGES, title=lesson_title)
+
+    async def _lesson_images(self, ld: dict) -> list[dict]:
+        """images.fetch_lesson_images: the manifest's page range when IMG_LOOKUP = "manifest", else the KG."""
+        from images import manifest_images
+        pics = manifest_images((ld.get("start_page"), ld.get("end_page")))
+        return pics if pics is not None else await self.fetch_lesson_images(ld["title"])
+
+    async def fetch_topic_bundle(self, topic_name: str) -> dict:
+        """Same dict as Neo4jKG.fetch_topic_bundle, with independent queries run concurrently."""
+        with span("kg.fetch_topic_bundle"):
+            branch, lessons = await asyncio.gather(
+                self.find_branch_for_topic(topic_name),
+                self.get_lessons_for_topic(topic_name),
+            )
+            pics = await asyncio.gather(*(self._lesson_images(ld) for ld in lessons))
+        return {
+            "topic": topic_name,
+            "branch": branch,
+            "lessons": lessons,
+            "images": {ld["title"]: p for ld, p in zip(lessons, pics)},
+        }
+
+
+def open_async_kg() -> AsyncNeo4jKG | None:
+    """AsyncNeo4jKG for the configured graph, or None when KG_ASYNC is off or the backend is local."""
+    from config import URI, USER, PASSWORD, KG_BACKEND, KG_ASYNC
+    if not KG_ASYNC or KG_BACKEND != "neo4j":
+        return None
+    return AsyncNeo4jKG(URI, USER, PASSWORD, **neo4j_driver_settings())
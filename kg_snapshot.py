@@ -0,0 +1,150 @@
+"""
+Read-only, in-memory KG backend.
+
+The curriculum graph (branches → topics → lessons → images, plus lesson
+embeddings) is small and does not change while serving, so it can be
+exported once from Neo4j into a JSON snapshot and answered from dicts:
+
+    python -m kg_snapshot export --out config_files/kg_snapshot.json
+    python -m kg_snapshot info config_files/kg_snapshot.json
+
+Snapshot layout (same as benchmarks/kg_fixture.json, embeddings optional):
+{
+  "version": 1, "exported_at": "...", "source": "...",
+  "branches": [
+    { "name": "...", "topics": [
+        { "name": "...", "lessons": [
+            { "title": "...", "start_page": 5, "end_page": 7,
+              "embedding": [...],
+              "images": [ { "name": "...", "caption": "...", "page": 6 } ] } ] } ] } ]
+}
+"""
+from __future__ import annotations
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotKG:
+    """Same read interface as Neo4jKG, backed by indexed in-memory structures."""
+
+    def __init__(self, path: str | Path | None = None, data: dict | None = None):
+        if data is None:
+            data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("version", SNAPSHOT_VERSION) > SNAPSHOT_VERSION:
+            raise ValueError(f"KG snapshot version {data['version']} is newer than supported ({SNAPSHOT_VERSION})")
+        self.meta = {k: v for k, v in data.items() if k != "branches"}
+        self._branch_of: dict[str, str | None] = {}
+        self._lessons: dict[str, list[dict]] = {}
+        self._images: dict[str, list[dict]] = {}
+        self._embeddings: list[dict] = []
+        for b in data.get("branches", []):
+            for t in b.get("topics", []):
+                self._branch_of[t["name"]] = b.get("name")
+                lessons = sorted(t.get("lessons", []), key=lambda l: l["title"])
+                self._lessons[t["name"]] = [
+                    {"title": l["title"], "start_page": l.get("start_page"), "end_page": l.get("end_page")}
+                    for l in lessons
+                ]
+                for l in lessons:
+                    self._images[l["title"]] = sorted(l.get("images", []), key=lambda i: i.get("page") or 0)
+                    if l.get("embedding") is not None:
+                        self._embeddings.append({"topic": t["name"], "lesson": l["title"], "embedding": l["embedding"]})
+        self._topics = sorted(self._lessons)
+
+    def close(self):
+        pass
+
+    def get_lessons_for_topic(self, topic_name: str) -> list[dict]:
+        return [dict(l) for l in self._lessons.get(topic_name, [])]
+
+    def find_branch_for_topic(self, topic_name: str) -> str | None:
+        return self._branch_of.get(topic_name)
+
+    def list_all_topics(self) -> list[str]:
+        return list(self._topics)
+
+    def fetch_all_lesson_embeddings(self) -> list[dict]:
+        return list(self._embeddings)
+
+    def list_lesson_keys(self) -> list[dict]:
+        from lesson_vectors import embedding_checksum
+        return [{"topic": e["topic"], "lesson": e["lesson"], "dim": len(e["embedding"]),
+                 "checksum": embedding_checksum(e["embedding"])} for e in self._embeddings]
+
+    def fetch_lesson_images(self, lesson_title: str) -> list[dict]:
+        return [dict(i) for i in self._images.get(lesson_title, [])]
+
+    def fetch_topic_bundle(self, topic_name: str) -> dict:
+        from images import fetch_lesson_images
+        lessons = self.get_lessons_for_topic(topic_name)
+        return {
+            "topic": topic_name,
+            "branch": self.find_branch_for_topic(topic_name),
+            "lessons": lessons,
+            "images": {ld["title"]: fetch_lesson_images(self, ld["title"], (ld.get("start_page"), ld.get("end_page")))
+                       for ld in lessons},
+        }
+
+
+def export_snapshot(kg, out_path: str | Path, source: str = "") -> dict:
+    """Dump everything the serving path reads from `kg` (any backend) into a snapshot file."""
+    embeddings = {(r["topic"], r["lesson"]): r["embedding"] for r in kg.fetch_all_lesson_embeddings()}
+    branches: dict[str | None, list[dict]] = {}
+    for topic in kg.list_all_topics():
+        lessons = []
+        for ld in kg.get_lessons_for_topic(topic):
+            lessons.append({
+                **ld,
+                "embedding": embeddings.get((topic, ld["title"])),
+                "images": kg.fetch_lesson_images(ld["title"]),
+            })
+        branches.setdefault(kg.find_branch_for_topic(topic), []).append({"name": topic, "lessons": lessons})
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "source": source,
+        "branches": [{"name": b, "topics": ts} for b, ts in branches.items()],
+    }
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(out_path)
+    return data
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import KG_SNAPSHOT_PATH
+
+    ap = argparse.ArgumentParser(description="Export / inspect KG snapshots.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="export the Neo4j graph to a snapshot file")
+    ex.add_argument("--out", default=KG_SNAPSHOT_PATH)
+    info = sub.add_parser("info", help="print counts for a snapshot file")
+    info.add_argument("path", nargs="?", default=KG_SNAPSHOT_PATH)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        from config import URI, USER, PASSWORD
+        from kg import Neo4jKG
+        kg = Neo4jKG(URI, USER, PASSWORD)
+        try:
+            data = export_snapshot(kg, args.out, source=URI)
+        finally:
+            kg.close()
+        print(f"✅ snapshot written to {args.out} ({sum(len(b['topics']) for b in data['branches'])} topics)")
+    else:
+        kg = SnapshotKG(args.path)
+        n_lessons = sum(len(kg.get_lessons_for_topic(t)) for t in kg.list_all_topics())
+        print(json.dumps({**kg.meta, "topics": len(kg.list_all_topics()), "lessons": n_lessons,
+                          "lesson_embeddings": len(kg.fetch_all_lesson_embeddings())}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
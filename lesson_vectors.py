@@ -0,0 +1,165 @@
+"""
+Compact, memory-mapped copy of the KG lesson embeddings.
+
+Neo4j returns `l.vector_embedding` as lists of Python floats, and every
+worker process kept its own boxed copy. The vectors are exported once to a
+raw row-major float32 (or float16) file next to a JSON sidecar:
+
+    cache/lesson_vectors.bin    count × dim, L2-normalized
+    cache/lesson_vectors.json   {"version", "dtype", "dim", "count", "stamp",
+                                 "model", "exported_at", "source",
+                                 "rows": [{"id", "topic", "lesson"}, ...]}
+
+Workers open the .bin with a read-only np.memmap, so all processes share
+the same page-cache pages. `stamp` is a hash of the KG's (topic, lesson,
+dim, embedding checksum) keys; `open_lesson_vectors` re-exports when it no
+longer matches (lessons added / removed / re-embedded) or when the file was
+exported for another EMBEDDING_MODEL.
+
+    python -m lesson_vectors export [--dtype float16]
+    python -m lesson_vectors info
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+VECTORS_VERSION = 1
+
+
+def embedding_checksum(vec) -> float:
+    """Σ (i+1)·v[i] in float64, the same sum Neo4j computes in Q_LESSON_KEYS."""
+    s = 0.0
+    for i, x in enumerate(vec):
+        s += (i + 1) * float(x)
+    return s
+
+
+def lesson_stamp(keys: list[dict]) -> str:
+    """Order-independent fingerprint of the KG's embedded lessons (names, dims and vector checksums)."""
+    lines = sorted(f"{k['topic']}\x1f{k['lesson']}\x1f{k.get('dim')}\x1f{float(k.get('checksum') or 0.0):.6g}"
+                   for k in keys)
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def _sidecar(path: Path) -> Path:
+    return path.with_suffix(".json")
+
+
+def export_lesson_vectors(kg, path: str | Path, dtype: str = "float32", source: str = "",
+                          model: str = "") -> dict:
+    """Write the lesson embeddings of `kg` (any backend) to `path` + sidecar; returns the sidecar dict."""
+    path = Path(path)
+    rows = kg.fetch_all_lesson_embeddings()
+    vecs = np.asarray([r["embedding"] for r in rows], dtype=np.float32).reshape(len(rows), -1)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vecs = (vecs / norms).astype(dtype)
+    meta = {
+        "version": VECTORS_VERSION,
+        "dtype": np.dtype(dtype).name,
+        "dim": int(vecs.shape[1]),
+        "count": len(rows),
+        "stamp": lesson_stamp([{"topic": r["topic"], "lesson": r["lesson"], "dim": len(r["embedding"]),
+                                "checksum": embedding_checksum(r["embedding"])} for r in rows]),
+        "model": model,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "source": source,
+        "rows": [{"id": i, "topic": r["topic"], "lesson": r["lesson"]} for i, r in enumerate(rows)],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write both files under temporary names and swap them in: readers that
+    # already mapped the old file keep their pages
+    suffix = f".{os.getpid()}.tmp"
+    tmp_bin, tmp_meta = Path(str(path) + suffix), Path(str(_sidecar(path)) + suffix)
+    vecs.tofile(tmp_bin)
+    tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    tmp_bin.replace(path)
+    tmp_meta.replace(_sidecar(path))
+    return meta
+
+
+class LessonVectors:
+    """Read-only view of an exported lesson-vector file."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.meta = json.loads(_sidecar(self.path).read_text(encoding="utf-8"))
+        if self.meta.get("version", VECTORS_VERSION) > VECTORS_VERSION:
+            raise ValueError(f"lesson vectors version {self.meta['version']} is newer than supported")
+        count, dim = self.meta["count"], self.meta["dim"]
+        expected = count * dim * np.dtype(self.meta["dtype"]).itemsize
+        if self.path.stat().st_size != expected:
+            raise ValueError(f"{self.path} has {self.path.stat().st_size} bytes, sidecar says {expected}")
+        self.vectors = (np.memmap(self.path, dtype=self.meta["dtype"], mode="r", shape=(count, dim))
+                        if count else np.zeros((0, dim), dtype=self.meta["dtype"]))
+        self.rows: list[dict] = self.meta["rows"]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def stamp(self) -> str:
+        return self.meta["stamp"]
+
+    def payloads(self) -> list[dict]:
+        return [{"topic": r["topic"], "lesson": r["lesson"]} for r in self.rows]
+
+    def is_stale(self, kg, model: str | None = None) -> bool:
+        """True when the KG's lessons / vectors changed, or the file was exported for another `model`."""
+        if model is not None and self.meta.get("model") != model:
+            return True
+        return self.stamp != lesson_stamp(kg.list_lesson_keys())
+
+
+def open_lesson_vectors(kg, path: str | Path | None = None, dtype: str | None = None) -> LessonVectors:
+    """Memory-map the exported vectors, (re-)exporting them from `kg` when missing, unreadable or stale."""
+    from config import LESSON_VECTORS_PATH, LESSON_VECTORS_DTYPE, EMBEDDING_MODEL
+    path = Path(path or LESSON_VECTORS_PATH)
+    if path.exists():
+        try:
+            vecs = LessonVectors(path)
+            if not vecs.is_stale(kg, EMBEDDING_MODEL):
+                return vecs
+            print(f"♻️  lesson vectors {path} are stale, re-exporting")
+        except Exception as e:
+            print(f"⚠️  lesson vectors {path} unreadable, re-exporting ({e})")
+    export_lesson_vectors(kg, path, dtype or LESSON_VECTORS_DTYPE, model=EMBEDDING_MODEL)
+    return LessonVectors(path)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    from config import LESSON_VECTORS_PATH, LESSON_VECTORS_DTYPE, EMBEDDING_MODEL, URI
+
+    ap = argparse.ArgumentParser(description="Export / inspect the memory-mapped lesson vectors.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="export the lesson embeddings from the KG")
+    ex.add_argument("--out", default=LESSON_VECTORS_PATH)
+    ex.add_argument("--dtype", choices=["float32", "float16"], default=LESSON_VECTORS_DTYPE)
+    info = sub.add_parser("info", help="print the sidecar header and staleness")
+    info.add_argument("path", nargs="?", default=LESSON_VECTORS_PATH)
+    args = ap.parse_args(argv)
+
+    from kg import open_kg
+    kg = open_kg()
+    try:
+        if args.cmd == "export":
+            meta = export_lesson_vectors(kg, args.out, args.dtype, source=URI, model=EMBEDDING_MODEL)
+            print(f"✅ {meta['count']} × {meta['dim']} {meta['dtype']} lesson vectors written to {args.out}")
+        else:
+            vecs = LessonVectors(args.path)
+            header = {k: v for k, v in vecs.meta.items() if k != "rows"}
+            print(json.dumps({**header, "stale": vecs.is_stale(kg, EMBEDDING_MODEL)}, ensure_ascii=False))
+    finally:
+        kg.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+One way to call the LLM: deadlines, hedged requests, last-good fallback.
+
+`Crew(...).kickoff()` used to block for as long as Gemini took. Every
+generation now goes through `LLMInvoker.invoke`:
+
+* the crew runs on a shared thread pool (in a copy of the caller's
+  context, so the selected book and request timings follow it) and the
+  caller waits at most the deadline of its `use` (LLM_DEADLINES);
+* when the call is still running after the `hedge_quantile` of that use's
+  recent latencies, or failed early, one hedged request is started on a
+  private copy of the agent; the first good reply wins;
+* a successful reply is remembered per call key (LastGoodCache). On a
+  missed deadline or an error the last good reply for the same key is
+  returned instead (`output.fallback` is True), else LLMTimeout / the error
+  is raised. A late reply still refreshes the cache.
+* a call missing its deadline keeps its pool thread until Gemini answers,
+  so at most `workers` calls (hedges included) may be running or abandoned
+  at once; beyond that a call is rejected right away — fallback, else
+  LLMBusy — and a hedge is not started, instead of queueing behind a slow
+  upstream until its own deadline has passed.
+
+Outcomes (ok, hedge_won, fallback, timeout, error, rejected) and started
+hedges are counted in etude_llm_calls_total / etude_llm_hedges_total.
+"""
+from __future__ import annotations
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any
+
+from crewai import Crew, Task
+
+from utils_text import normalize_arabic
+from metrics import REGISTRY, profiled_thread
+
+LLM_CALLS = REGISTRY.counter("etude_llm_calls_total", "LLM calls by use and outcome.", ("use", "outcome"))
+LLM_HEDGES = REGISTRY.counter("etude_llm_hedges_total", "Hedged second LLM requests started.", ("use",))
+
+
+class LLMTimeout(TimeoutError):
+    pass
+
+
+class LLMBusy(LLMTimeout):
+    """Every LLM slot is taken (slow or abandoned calls): rejected without waiting."""
+
+
+class FallbackOutput:
+    """Stands in for a CrewOutput when the last good reply is served."""
+    fallback = True
+    token_usage = None
+
+    def __init__(self, raw: str):
+        self.raw = raw
+
+
+def call_key(use: str, *parts: Any) -> str:
+    """Fallback key: the use plus its Arabic-normalized parameters."""
+    return "\x1f".join([use] + [normalize_arabic(p) if isinstance(p, str) else str(p) for p in parts])
+
+
+class LatencyTracker:
+    """Recent successful call durations per use."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._window = window
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, use: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(use, deque(maxlen=self._window)).append(seconds)
+
+    def quantile(self, use: str, q: float) -> float | None:
+        with self._lock:
+            s = sorted(self._samples.get(use, ()))
+        if len(s) < self.min_samples:
+            return None
+        return s[max(0, min(len(s) - 1, math.ceil(q * len(s)) - 1))]
+
+
+def _own_agent(agent):
+    """Private copy of an agent for a concurrent crew (crewai agents keep per-run state)."""
+    return agent.copy() if hasattr(agent, "copy") else agent
+
+
+class LLMInvoker:
+    def __init__(self, deadlines: dict[str, float], default_deadline: float = 60.0, hedge_quantile: float = 0.9,
+                 hedge_min_s: float = 2.0, fallback=None, workers: int = 16):
+        """
+        deadlines      : seconds per use (summary, quiz, qa, …); others get default_deadline
+        hedge_quantile : latency quantile after which a hedge is started (needs
+                         LatencyTracker.min_samples successful calls; 0 disables hedging)
+        hedge_min_s    : never hedge earlier than this
+        fallback       : LastGoodCache for stale replies (None disables the fallback)
+        """
+        self.deadlines, self.default_deadline = deadlines, default_deadline
+        self.hedge_quantile, self.hedge_min_s = hedge_quantile, hedge_min_s
+        self.fallback = fallback
+        self.latency = LatencyTracker()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self._slots = threading.BoundedSemaphore(workers)     # held from submit until the call returns
+
+    def _kickoff(self, agent, description: str, expected_output: str):
+        with profiled_thread():      # a profiled request also samples the thread waiting on the LLM
+            task = Task(description=description, expected_output=expected_output, agent=agent)
+            return Crew(agents=[agent], tasks=[task], verbose=False).kickoff()
+
+    def _submit(self, use: str, key: str | None, agent, description: str, expected_output: str) -> Future | None:
+        """The running call, or None when no slot is free (nothing is queued)."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        t0 = time.perf_counter()
+        try:
+            fut = self._pool.submit(contextvars.copy_context().run, self._kickoff, agent, description, expected_output)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        def done(f: Future) -> None:
+            self._slots.release()
+            if f.cancelled():
+                return
+            if f.exception() is None:
+                self.latency.observe(use, time.perf_counter() - t0)
+                if key is not None and self.fallback is not None:
+                    self.fallback.put(key, f.result().raw)   # late replies refresh it too
+        fut.add_done_callback(done)
+        return fut
+
+    def hedge_after(self, use: str, deadline: float) -> float | None:
+        if not self.hedge_quantile:
+            return None
+        q = self.latency.quantile(use, self.hedge_quantile)
+        return None if q is None else min(max(q, self.hedge_min_s), deadline)
+
+    def invoke(self, agent, description: str, expected_output: str = "text", use: str = "llm",
+               key: str | None = None, deadline: float | None = None, hedge: bool = True):
+        """
+        Run one Task on `agent` and return its CrewOutput (or a FallbackOutput).
+        key      : call_key(...) of this generation, for the last-good fallback
+        deadline : seconds; default from `deadlines[use]`
+        hedge    : allow one hedged request (off for calls that must not run twice)
+        """
+        deadline = deadline or self.deadlines.get(use, self.default_deadline)
+        start = time.monotonic()
+        end = start + deadline
+        primary = self._submit(use, key, agent, description, expected_output)
+        if primary is None:
+            LLM_CALLS.inc(use=use, outcome="rejected")
+            stale = self.fallback.get(key) if key is not None and self.fallback is not None else None
+            if stale is not None:
+                print(f"⚠️  {use} LLM call rejected (all slots busy), serving the last good reply")
+                return FallbackOutput(stale)
+            raise LLMBusy(f"{use} generation rejected: all LLM slots are busy")
+        pending, hedged, error = {primary}, not hedge, None
+        hedge_at = None if hedged else self.hedge_after(use, deadline)
+
+        while pending:
+            until = end if hedged or hedge_at is None else min(end, start + hedge_at)
+            done, pending = wait(pending, timeout=max(0.0, until - time.monotonic()), return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    LLM_CALLS.inc(use=use, outcome="ok" if fut is primary else "hedge_won")
+                    return fut.result()
+                error = fut.exception()
+            now = time.monotonic()
+            if now >= end:
+                break
+            # hedge once: after the latency threshold, or right away if the first try failed
+            if not hedged and (not pending or (hedge_at is not None and now >= start + hedge_at)):
+                hedged = True
+                second = self._submit(use, key, _own_agent(agent), description, expected_output)
+                if second is not None:                   # no free slot: keep waiting on the first try
+                    LLM_HEDGES.inc(use=use)
+                    pending.add(second)
+
+        stale = self.fallback.get(key) if key is not None and self.fallback is not None else None
+        if stale is not None:
+            LLM_CALLS.inc(use=use, outcome="fallback")
+            print(f"⚠️  {use} LLM call {'failed' if not pending else 'timed out'}, serving the last good reply")
+            return FallbackOutput(stale)
+        if pending:
+            LLM_CALLS.inc(use=use, outcome="timeout")
+            raise LLMTimeout(f"{use} generation exceeded {deadline:g} s")
+        LLM_CALLS.inc(use=use, outcome="error")
+        raise error
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
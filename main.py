@@ -1,10 +1,9 @@
 from pathlib import Path
-from kg import Neo4jKG
+from kg import open_kg
 from cli import run_cli
-from config import URI, USER, PASSWORD
 def main():
     sample_pdf = Path("config_files/الإيقاظ العلمي - السنة الرابعة من التعليم الأساسي (1).pdf")
-    neo_kg = Neo4jKG(URI, USER, PASSWORD)
+    neo_kg = open_kg()
     if sample_pdf.exists():
         run_cli(sample_pdf, neo_kg)
     else:
@@ -0,0 +1,205 @@
+"""
+Lightweight in-process metrics with a Prometheus text exposition.
+
+    with span("kg.get_lessons_for_topic"):
+        ...
+
+records the duration in `etude_stage_seconds{stage=...}` and, while a
+request is being served, appends it to that request's timing breakdown
+(returned as a Server-Timing header when ETUDE_DEBUG_TIMINGS=1).
+"""
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Iterable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+
+def _fmt_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"'.replace("\n", " ") for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {v:g}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        self._series: dict[tuple, list] = {}        # key -> [bucket_counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                for upper, c in zip(self.buckets, counts):
+                    le = 'le="%g"' % upper
+                    out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {c}")
+                le = 'le="+Inf"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {n}")
+                out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total:.6f}")
+                out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("etude_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+REQUEST_SECONDS = REGISTRY.histogram("etude_request_seconds", "HTTP request latency.", ("endpoint", "status"))
+REQUESTS_TOTAL = REGISTRY.counter("etude_requests_total", "HTTP requests served.", ("endpoint", "status"))
+CACHE_REQUESTS = REGISTRY.counter("etude_cache_requests_total", "Cache lookups by result.", ("cache", "result"))
+LLM_TOKENS = REGISTRY.counter("etude_llm_tokens_total", "LLM tokens used.", ("agent", "kind"))
+
+# per-request list of (stage, seconds); None outside of a request
+_request_timings: ContextVar[list | None] = ContextVar("etude_request_timings", default=None)
+# profile of the current request, if it is being profiled (see profiling.py)
+_request_profile: ContextVar[Any] = ContextVar("etude_request_profile", default=None)
+
+
+@contextmanager
+def profiled_thread():
+    """While the block runs, the current request's profile (if any) samples this thread."""
+    prof = _request_profile.get()
+    if prof is None:
+        yield
+        return
+    prof.enter()
+    try:
+        yield
+    finally:
+        prof.leave()
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        with profiled_thread():
+            yield
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, dt))
+
+
+def timed(stage: str):
+    """Decorator form of `span`."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def cache_hit_rate(cache: str) -> float:
+    hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+    total = hits + CACHE_REQUESTS.value(cache=cache, result="miss")
+    return hits / total if total else 0.0
+
+
+def record_llm_usage(agent: str, output: Any) -> None:
+    """Count prompt/completion tokens from a CrewOutput (if the provider reported them)."""
+    usage = getattr(output, "token_usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        n = getattr(usage, kind, 0) or 0
+        if n:
+            LLM_TOKENS.inc(n, agent=agent, kind=kind.split("_")[0])
+
+
+# ─ per-request breakdown ────────────────────────────────────────────
+def start_request():
+    return _request_timings.set([])
+
+
+def end_request(token) -> list[tuple[str, float]]:
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return timings
+
+
+def start_profile(profile):
+    return _request_profile.set(profile)
+
+
+def end_profile(token) -> None:
+    _request_profile.reset(token)
+
+
+def server_timing_header(timings: list[tuple[str, float]]) -> str:
+    """Aggregate (stage, seconds) pairs into a Server-Timing header value (ms)."""
+    total: dict[str, list] = {}
+    for stage, dt in timings:
+        agg = total.setdefault(stage, [0.0, 0])
+        agg[0] += dt
+        agg[1] += 1
+    return ", ".join(
+        f'{stage.replace(" ", "_")};dur={secs * 1000:.1f};desc="x{n}"' for stage, (secs, n) in total.items()
+    )
@@ -5,6 +5,8 @@ import io
 import os
 import json
 from langchain.schema import Document
+
+from metrics import span
 import os
 import pytesseract
 
@@ -13,17 +15,18 @@ os.environ['TESSDATA_PREFIX'] = os.path.abspath("./tessdata")
 
 # Point to your tesseract.exe directly
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-def load_arabic_pdf(pdf_path, lang="ara", batch_size=40, cache_dir="config_files/ktebjson"):
-    os.makedirs(cache_dir, exist_ok=True)
-
+def load_arabic_pdf(pdf_path, lang="ara", batch_size=40, cache_dir="config_files/ktebjson", cache_file=None):
+    """cache_file : OCR cache for this book (default: `cache_dir`/Book.json)."""
     # pdf_name = os.path.basename(pdf_path)
     # cache_file = os.path.join(cache_dir, pdf_name + ".json")
-    cache_file="config_files\ktebjson\Book.json"
+    cache_file = cache_file or os.path.join(cache_dir, "Book.json")
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
     if os.path.exists(cache_file):
         print(f"Loading cached OCR data from {cache_file}")
-        with open(cache_file, "r", encoding="utf-8") as f:
-            raw_docs = json.load(f)
-        return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in raw_docs]
+        with span("ocr.load_cache"):
+            with open(cache_file, "r", encoding="utf-8") as f:
+                raw_docs = json.load(f)
+            return [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in raw_docs]
 
     documents = []
 
@@ -37,9 +40,11 @@ def load_arabic_pdf(pdf_path, lang="ara", batch_size=40, cache_dir="config_files
 
             for i in range(start, end):
                 page = doc[i]
-                pix = page.get_pixmap(dpi=300)
-                img = Image.open(io.BytesIO(pix.tobytes("png")))
-                text = pytesseract.image_to_string(img, lang=lang)
+                with span("ocr.render_page"):
+                    pix = page.get_pixmap(dpi=300)
+                    img = Image.open(io.BytesIO(pix.tobytes("png")))
+                with span("ocr.tesseract"):
+                    text = pytesseract.image_to_string(img, lang=lang)
 
                 documents.append(
                     Document(
@@ -1,5 +1,7 @@
+from __future__ import annotations
+import io
 from pathlib import Path
-from typing import Any, List
+from typing import Any, BinaryIO, List
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas as pdf_canvas
 from reportlab.pdfbase import pdfmetrics
@@ -8,18 +10,51 @@ from PIL import Image
 
 from config import ARABIC_FONT_NAME, IMG_DIR, MAX_IMG_W, MAX_IMG_H, MD_IMG
 from utils_text import rtl, strip_unsupported
+from metrics import timed
+from image_manifest import get_manifest
+from session_digest import SessionDigest
 
 class SessionMemory(dict):
+    def __init__(self, *args, compact=None, on_compacted=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compact = compact          # optional LLM compaction for the Q&A digest
+        self.on_compacted = on_compacted
+
     def log(self, k: str, v: Any):
         self[k] = v
         print(f"📝  خزّنا {k}.")
 
-def render_pdf(mem: SessionMemory, outfile: Path) -> Path:
+    def add_qa(self, question: str, answer: str):
+        """Full history for the report, bounded digest for the feedback prompt."""
+        from config import SESSION_KEEP_RECENT, SESSION_DIGEST_TOKENS, SESSION_TURN_TOKENS
+        self.setdefault("qa_history", []).append((question, answer))
+        if "qa_digest" not in self:
+            self["qa_digest"] = SessionDigest(SESSION_KEEP_RECENT, SESSION_DIGEST_TOKENS, SESSION_TURN_TOKENS,
+                                              compact=self.compact, on_compacted=self.on_compacted)
+        self["qa_digest"].add(question, answer)
+
+    def to_state(self) -> dict:
+        """JSON-ready copy (shared_state.SessionStore)."""
+        state = {k: v for k, v in self.items() if k != "qa_digest"}
+        if "qa_digest" in self:
+            state["qa_digest"] = self["qa_digest"].to_state()
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict, compact=None, on_compacted=None) -> "SessionMemory":
+        mem = cls({k: v for k, v in state.items() if k != "qa_digest"}, compact=compact, on_compacted=on_compacted)
+        if "qa_digest" in state:
+            mem["qa_digest"] = SessionDigest.from_state(state["qa_digest"], compact=compact, on_compacted=on_compacted)
+        return mem
+
+@timed("pdf.render")
+def render_pdf(mem: SessionMemory, outfile: Path | BinaryIO) -> Path | BinaryIO:
     """
     Renders a PDF report and now *also* draws any pictures that appear
     in mem['chapter_summary'] with the syntax ![alt](file-name.jpeg).
+    `outfile` is a path or a writable binary buffer (see render_pdf_bytes).
     """
-    c = pdf_canvas.Canvas(str(outfile), pagesize=A4)
+    c = pdf_canvas.Canvas(outfile if hasattr(outfile, "write") else str(outfile), pagesize=A4)
     w, h = A4
     margin_top, margin_bottom = 40, 40
     leading = 18
@@ -54,15 +89,19 @@ def render_pdf(mem: SessionMemory, outfile: Path) -> Path:
     def draw_image(img_path: str, alt: str):
         nonlocal y
         full_path = f"{IMG_DIR}/{img_path}".replace(" ", "")
-        try:
-            im = Image.open(full_path)
-        except FileNotFoundError:
-            # fallback: just write the alt text as normal line
-            draw_text(f"[صورة غير موجودة] {alt}")
-            return
+        # size from the manifest; only images it doesn't know are opened
+        size = get_manifest().size(Path(full_path).name)
+        if size is None:
+            try:
+                with Image.open(full_path) as im:
+                    size = im.size
+            except FileNotFoundError:
+                # fallback: just write the alt text as normal line
+                draw_text(f"[صورة غير موجودة] {alt}")
+                return
 
         # keep aspect ratio under MAX_IMG_W×MAX_IMG_H
-        iw, ih = im.size
+        iw, ih = size
         scale = min(MAX_IMG_W / iw, MAX_IMG_H / ih, 1.0)
         dw, dh = iw * scale, ih * scale
 
@@ -157,3 +196,10 @@ def render_pdf(mem: SessionMemory, outfile: Path) -> Path:
 
     c.save()
     return outfile
+
+
+def render_pdf_bytes(mem: SessionMemory) -> bytes:
+    """The report as bytes, rendered in memory (nothing touches the disk)."""
+    buf = io.BytesIO()
+    render_pdf(mem, buf)
+    return buf.getvalue()
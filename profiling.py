@@ -0,0 +1,232 @@
+"""
+Per-request sampling profiler for the API, flamegraph-ready.
+
+A request is profiled when
+
+* it carries `X-Profile: 1` (or `?profile=1`) together with a valid
+  `X-Admin-Token` (ADMIN_TOKEN; profiling on demand is off when unset) —
+  the profile id comes back in the `X-Profile-Id` header; or
+* the always-on sampler picks it (PROFILE_SAMPLE_RATE of the requests, at
+  the coarser PROFILE_SAMPLED_INTERVAL) — only the PROFILE_KEEP_SLOWEST
+  slowest of those are kept.
+
+One background thread samples `sys._current_frames()` every few ms for
+all profiled requests. A thread is sampled for a request only while it
+runs a `metrics.span` (or an LLM call) in that request's context, so
+run_in_threadpool, fan-out and LLM pool threads are covered without
+charging a request for what the same pooled thread does next. The event
+loop is shared by every request and is not sampled; idle waits of empty
+thread pools are left out.
+
+Profiles are folded stacks (`thread;func (file:line);… count`), readable
+by flamegraph.pl, speedscope or inferno:
+
+    GET /admin/profiles            list (X-Admin-Token required)
+    GET /admin/profiles/{id}       folded stacks as text
+
+With a SharedState the kept profiles are stored there too, so every
+serve.py worker lists and serves the profiles of all of them.
+"""
+from __future__ import annotations
+import heapq
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as _Counter, deque
+
+from metrics import REGISTRY
+
+PROFILES = REGISTRY.counter("etude_profiles_total", "Profiled requests by kind.", ("kind",))
+
+# leaf frames that mean "this thread is idle", not working for the request
+_IDLE = {("selectors.py", "select"), ("selectors.py", "poll"), ("thread.py", "_worker"),
+         ("queue.py", "get"), ("threading.py", "wait")}
+
+
+class Profile:
+    def __init__(self, kind: str, path: str, interval: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind, self.path, self.interval = kind, path, interval
+        self.threads: _Counter[int] = _Counter()      # thread ident -> open spans in it
+        self._threads_lock = threading.Lock()
+        self.counts: _Counter[str] = _Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.seconds = 0.0
+        self._next = 0.0
+
+    def enter(self) -> None:
+        """The current thread works for this request until the matching `leave`."""
+        with self._threads_lock:
+            self.threads[threading.get_ident()] += 1
+
+    def leave(self) -> None:
+        tid = threading.get_ident()
+        with self._threads_lock:
+            self.threads[tid] -= 1
+            if self.threads[tid] <= 0:
+                del self.threads[tid]
+
+    def active_threads(self) -> list[int]:
+        with self._threads_lock:
+            return list(self.threads)
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.counts.most_common()) + "\n"
+
+    def summary(self) -> dict:
+        return {"id": self.id, "kind": self.kind, "path": self.path, "seconds": round(self.seconds, 3),
+                "samples": self.samples, "interval_ms": self.interval * 1000,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started))}
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "started_at": self.started, "counts": dict(self.counts)}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Profile":
+        prof = cls(d["kind"], d["path"], d["interval_ms"] / 1000)
+        prof.id, prof.seconds, prof.samples, prof.started = d["id"], d["seconds"], d["samples"], d["started_at"]
+        prof.counts.update(d["counts"])
+        return prof
+
+
+def _fold(frame, thread_name: str, max_depth: int = 128) -> str | None:
+    names = []
+    leaf = frame
+    while frame is not None and len(names) < max_depth:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    code = leaf.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE:
+        return None
+    return ";".join([thread_name] + names[::-1])
+
+
+class Profiler:
+    def __init__(self, admin_token: str = "", interval: float = 0.005, sample_rate: float = 0.0,
+                 sampled_interval: float = 0.02, keep_slowest: int = 20, keep_admin: int = 20, shared=None):
+        """
+        admin_token      : required for on-demand profiles ("" disables them)
+        interval         : sampling period of on-demand profiles (s)
+        sample_rate      : share of all requests profiled always-on (0 = off)
+        sampled_interval : sampling period of always-on profiles (s)
+        keep_slowest     : always-on profiles kept (the slowest requests), per worker
+        keep_admin       : on-demand profiles kept (the latest), per worker
+        shared           : shared_state.SharedState storing the kept profiles (None → this process only)
+        """
+        self.admin_token, self.shared = admin_token, shared
+        self.interval, self.sample_rate, self.sampled_interval = interval, sample_rate, sampled_interval
+        self.keep_slowest = keep_slowest
+        self._slowest: list[tuple[float, str, Profile]] = []      # min-heap on seconds
+        self._admin: deque[Profile] = deque(maxlen=keep_admin)
+        self._active: set[Profile] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    # ─ access ──────────────────────────────────────────────────────
+    def is_admin(self, token: str | None) -> bool:
+        return bool(self.admin_token) and token is not None and hmac.compare_digest(token, self.admin_token)
+
+    def wants(self, headers, query) -> str | None:
+        """"admin", "sampled" or None for a request with these headers / query params."""
+        if (headers.get("x-profile") == "1" or query.get("profile") == "1") and self.is_admin(headers.get("x-admin-token")):
+            return "admin"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    # ─ lifecycle ───────────────────────────────────────────────────
+    def start(self, kind: str, path: str) -> Profile:
+        prof = Profile(kind, path, self.interval if kind == "admin" else self.sampled_interval)
+        with self._lock:
+            self._active.add(prof)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        PROFILES.inc(kind=kind)
+        return prof
+
+    def finish(self, prof: Profile, seconds: float) -> None:
+        prof.seconds = seconds
+        kept, dropped = True, None
+        with self._lock:
+            self._active.discard(prof)
+            if prof.kind == "admin":
+                if len(self._admin) == self._admin.maxlen:
+                    dropped = self._admin[0]
+                self._admin.append(prof)
+            elif len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, (seconds, prof.id, prof))
+            elif seconds > self._slowest[0][0]:
+                dropped = heapq.heapreplace(self._slowest, (seconds, prof.id, prof))[2]
+            else:
+                kept = False
+        if self.shared is not None:
+            if kept:
+                self.shared.put_json("profile", prof.id, prof.to_dict())
+            if dropped is not None:
+                self.shared.delete("profile", dropped.id)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._active)
+            if not active:
+                self._wake.clear()
+                self._wake.wait(1.0)
+                continue
+            now = time.monotonic()
+            due = [p for p in active if now >= p._next]
+            if due:
+                frames = sys._current_frames()
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for prof in due:
+                    prof._next = now + prof.interval
+                    prof.samples += 1
+                    for tid in prof.active_threads():
+                        frame = frames.get(tid)
+                        if frame is None or tid == me:
+                            continue
+                        stack = _fold(frame, names.get(tid, str(tid)))
+                        if stack:
+                            prof.counts[stack] += 1
+                del frames
+            time.sleep(max(0.0005, min(p._next for p in active) - time.monotonic()))
+
+    # ─ stored profiles ─────────────────────────────────────────────
+    def list(self) -> list[dict]:
+        if self.shared is not None:            # kept by every worker
+            stored = [{k: v for k, v in d.items() if k not in ("counts", "started_at")}
+                      for d in sorted(self.shared.values_json("profile"), key=lambda d: -d["started_at"])]
+            admin = [d for d in stored if d["kind"] == "admin"]
+            slow = sorted((d for d in stored if d["kind"] != "admin"), key=lambda d: -d["seconds"])
+            return admin + slow
+        with self._lock:
+            admin = [p.summary() for p in reversed(self._admin)]
+            slow = [p.summary() for _, _, p in sorted(self._slowest, key=lambda x: -x[0])]
+        return admin + slow
+
+    def get(self, profile_id: str) -> Profile | None:
+        with self._lock:
+            for prof in list(self._admin) + [p for _, _, p in self._slowest]:
+                if prof.id == profile_id:
+                    return prof
+        if self.shared is not None:
+            d = self.shared.get_json("profile", profile_id)
+            return Profile.from_dict(d) if d else None
+        return None
+
+
+def open_profiler(shared=None) -> Profiler:
+    from config import (ADMIN_TOKEN, PROFILE_INTERVAL, PROFILE_SAMPLE_RATE, PROFILE_SAMPLED_INTERVAL,
+                        PROFILE_KEEP_SLOWEST, PROFILE_KEEP_ADMIN)
+    return Profiler(ADMIN_TOKEN, PROFILE_INTERVAL, PROFILE_SAMPLE_RATE, PROFILE_SAMPLED_INTERVAL,
+                    PROFILE_KEEP_SLOWEST, PROFILE_KEEP_ADMIN, shared)
@@ -0,0 +1,271 @@
+"""
+Two-tier cache for the QA path.
+
+* EmbeddingCache – exact map: normalized question text → embedding, so the
+  same question is never embedded twice.
+* AnswerCache    – semantic map: (topic, lesson) → previously answered
+  questions. A new question on the same lesson whose embedding is within
+  `threshold` cosine similarity of a stored one gets the stored answer back,
+  without an LLM call.
+
+LastGoodCache (used by llm_call) keeps the last successful LLM output per
+call key, the stale-but-valid fallback when a call misses its deadline.
+
+Both tiers are bounded LRUs, persisted as JSON next to the other caches and
+tagged with the embedding model name (a different model invalidates them).
+"""
+from __future__ import annotations
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any
+
+from utils_text import cosine_similarity, normalize_question
+from metrics import record_cache
+
+
+_OPEN: "weakref.WeakSet[_PersistentLRU]" = weakref.WeakSet()
+
+
+def flush_all() -> None:
+    """Write back every open cache (for processes leaving through os._exit, which skips atexit)."""
+    for cache in list(_OPEN):
+        cache.flush()
+
+
+class _PersistentLRU:
+    """Bounded OrderedDict with JSON persistence (write-behind every N changes)."""
+
+    name = "lru"
+
+    def __init__(self, path: str, max_entries: int, model_name: str = "", flush_every: int = 20):
+        self.path = path
+        self.max_entries = max_entries
+        self.model_name = model_name
+        self.flush_every = flush_every
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._dirty = 0
+        self._lock = threading.RLock()
+        self.hits = self.misses = 0
+        self._load()
+        _OPEN.add(self)
+        atexit.register(self.flush)
+
+    # ─ persistence ─────────────────────────────────────────────────
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except Exception as e:
+            print(f"⚠️  cache {self.path} unreadable, starting empty ({e})")
+            return
+        if raw.get("model") != self.model_name:
+            print(f"♻️  cache {self.path} built with another model, discarded.")
+            return
+        for key, value in raw.get("entries", []):
+            self._data[key] = value
+        self._evict()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            # own temp file per process: serve.py workers flush the same caches
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "entries": list(self._data.items())},
+                              f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"⚠️  cache {self.path} not saved ({e})")
+                return
+            self._dirty = 0
+
+    def _touch(self) -> None:
+        self._dirty += 1
+        if self._dirty >= self.flush_every:
+            self.flush()
+
+    # ─ LRU housekeeping ────────────────────────────────────────────
+    def _evict(self) -> None:
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._dirty += 1
+            self.flush()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class EmbeddingCache(_PersistentLRU):
+    name = "qa_embeddings"
+
+    def get(self, question: str) -> list[float] | None:
+        key = normalize_question(question)
+        with self._lock:
+            vec = self._data.get(key)
+            record_cache(self.name, vec is not None)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, question: str, embedding: list[float]) -> None:
+        key = normalize_question(question)
+        with self._lock:
+            self._data[key] = [float(x) for x in embedding]
+            self._data.move_to_end(key)
+            self._evict()
+            self._touch()
+
+    def embed_query(self, emb, question: str) -> list[float]:
+        """Same contract as `emb.embed_query`, served from the cache when possible."""
+        vec = self.get(question)
+        if vec is None:
+            vec = emb.embed_query(normalize_question(question) or question)
+            self.put(question, vec)
+        return vec
+
+    def embed_many(self, emb, texts: list[str]) -> list[list[float]]:
+        """Batch form of `embed_query`: the misses go through one `emb.embed_documents` call."""
+        out = [self.get(t) for t in texts]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, out) if v is None))
+        if missing:
+            vecs = dict(zip(missing, emb.embed_documents([normalize_question(t) or t for t in missing])))
+            for t, v in vecs.items():
+                self.put(t, v)
+            out = [v if v is not None else vecs[t] for t, v in zip(texts, out)]
+        return out
+
+    def invalidate(self, question: str) -> None:
+        with self._lock:
+            if self._data.pop(normalize_question(question), None) is not None:
+                self._touch()
+
+
+class AnswerCache(_PersistentLRU):
+    """
+    Entries are keyed by an id and hold
+      {'topic', 'lesson', 'question', 'embedding', 'answer', 'ts'}.
+    Lookups only compare against entries of the same (topic, lesson).
+    """
+    name = "qa_answers"
+
+    def __init__(self, path: str, max_entries: int, model_name: str = "",
+                 threshold: float = 0.93, ttl: float | None = None, flush_every: int = 5):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._by_lesson: dict[tuple[str, str], set[str]] = {}
+        self._seq = 0
+        super().__init__(path, max_entries, model_name, flush_every)
+        for key, entry in self._data.items():
+            self._by_lesson.setdefault((entry["topic"], entry["lesson"]), set()).add(key)
+            self._seq = max(self._seq, int(key) + 1)
+
+    def _evict(self) -> None:
+        while len(self._data) > self.max_entries:
+            key, entry = self._data.popitem(last=False)
+            self._unindex(key, entry)
+
+    def _unindex(self, key: str, entry: dict) -> None:
+        ids = self._by_lesson.get((entry["topic"], entry["lesson"]))
+        if ids is not None:
+            ids.discard(key)
+            if not ids:
+                del self._by_lesson[(entry["topic"], entry["lesson"])]
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return self.ttl is not None and now - entry["ts"] > self.ttl
+
+    def lookup(self, topic: str, lesson: str, q_emb: list[float]) -> str | None:
+        """Return the stored answer of the closest question on this lesson, if close enough."""
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key in list(self._by_lesson.get((topic, lesson), ())):
+                entry = self._data[key]
+                if self._expired(entry, now):
+                    self._unindex(key, self._data.pop(key))
+                    self._touch()
+                    continue
+                score = cosine_similarity(q_emb, entry["embedding"])
+                if score >= best_score:
+                    best_key, best_score = key, score
+            record_cache(self.name, best_key is not None)
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(best_key)
+            self.hits += 1
+            return self._data[best_key]["answer"]
+
+    def put(self, topic: str, lesson: str, question: str,
+            q_emb: list[float], answer: str) -> None:
+        with self._lock:
+            key = str(self._seq)
+            self._seq += 1
+            self._data[key] = {
+                "topic": topic, "lesson": lesson, "question": question,
+                "embedding": [float(x) for x in q_emb], "answer": answer, "ts": time.time(),
+            }
+            self._by_lesson.setdefault((topic, lesson), set()).add(key)
+            self._evict()
+            self._touch()
+
+    def invalidate(self, topic: str | None = None, lesson: str | None = None) -> int:
+        """Drop cached answers for a topic and/or lesson (everything if both are None)."""
+        with self._lock:
+            doomed = [k for k, e in self._data.items()
+                      if (topic is None or e["topic"] == topic)
+                      and (lesson is None or e["lesson"] == lesson)]
+            for key in doomed:
+                self._unindex(key, self._data.pop(key))
+            if doomed:
+                self._dirty += 1
+                self.flush()
+            return len(doomed)
+
+    def clear(self) -> None:
+        self.invalidate()
+
+
+class LastGoodCache(_PersistentLRU):
+    """Last successful LLM output per call key, served when a later call misses its deadline."""
+    name = "llm_last_good"
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._data.get(key)
+            record_cache(self.name, entry is not None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry["raw"]
+
+    def put(self, key: str, raw: str) -> None:
+        with self._lock:
+            self._data[key] = {"raw": raw, "ts": time.time()}
+            self._data.move_to_end(key)
+            self._evict()
+            self._touch()
@@ -0,0 +1,301 @@
+"""
+Pre-generated quiz bank: a validated pool of MC and T/F questions per topic.
+
+`/quiz` samples from the pool (no question twice in the same session, also
+across serve.py workers when the served ids are in a SharedState) in
+milliseconds instead of making a fresh LLM generation. When a topic's pool
+falls below `low_water` × target it is topped up in a background thread;
+the pools can also be filled offline:
+
+    python -m quiz_bank fill                    # every topic in the KG
+    python -m quiz_bank fill --topics "الماء"
+    python -m quiz_bank info
+
+One JSON file per topic under QUIZ_BANK_DIR:
+{ "topic": "...", "updated_at": "...",
+  "questions": [ {"id": "...", "type": "mc", "q": "...", "options": [...], "a": "..."},
+                 {"id": "...", "type": "tf", "q": "...", "a": "صح"} ] }
+"""
+from __future__ import annotations
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from utils_text import normalize_arabic
+from metrics import record_cache, span
+
+_TRUE = {"صح", "صحيح", "t", "true", "vrai", "نعم"}
+_FALSE = {"خطأ", "خطا", "غلط", "خاطئ", "f", "false", "faux", "لا"}
+
+# the schema generate_quiz_json asks for, which validate_question stores
+QUIZ_JSON_SCHEMA = (
+    "Return JSON only, exactly in this form (no other keys):\n"
+    '{"questions": [\n'
+    '  {"type": "mc", "q": "<السؤال>", "options": ["<اختيار>", "<اختيار>", "<اختيار>", "<اختيار>"], '
+    '"a": "<الاختيار الصحيح كما هو مكتوب في options>"},\n'
+    '  {"type": "tf", "q": "<جملة>", "a": "صح"}\n'
+    "]}\n"
+    '"a" of a tf question is "صح" or "خطأ".'
+)
+# what models return instead of the schema's keys and types
+_KEY_ALIASES = {"q": ("q", "question", "text", "statement", "prompt"),
+                "a": ("a", "answer", "correct", "correct_answer", "solution"),
+                "options": ("options", "choices", "propositions")}
+_KIND_ALIASES = {"mc": {"mc", "mcq", "qcm", "multiple_choice", "multiple choice", "choice"},
+                 "tf": {"tf", "true_false", "true/false", "truefalse", "vrai_faux", "صح/خطأ", "boolean"}}
+
+
+def _field(q: dict, name: str):
+    return next((q[k] for k in _KEY_ALIASES[name] if q.get(k) not in (None, "", [])), None)
+
+
+def validate_question(q: dict) -> dict | None:
+    """Normalized copy of a generated question (common key variants accepted), or None if it is unusable."""
+    if not isinstance(q, dict):
+        return None
+    raw_kind = str(q.get("type", "")).strip().lower()
+    kind = next((k for k, names in _KIND_ALIASES.items() if raw_kind in names), raw_kind)
+    text = str(_field(q, "q") or "").strip()
+    answer = _field(q, "a")
+    options = [str(o).strip() for o in _field(q, "options") or [] if str(o).strip()]
+    if kind not in ("mc", "tf"):
+        kind = "mc" if options else "tf" if isinstance(answer, bool) else kind
+    if isinstance(answer, bool):
+        answer = "true" if answer else "false"
+    elif kind == "mc" and isinstance(answer, int) and 0 <= answer < len(options):
+        answer = options[answer]                          # index of the right option
+    elif kind == "mc" and isinstance(answer, str) and answer.strip() not in options \
+            and len(answer.strip()) == 1 and "a" <= answer.strip().lower() < chr(ord("a") + len(options)):
+        answer = options[ord(answer.strip().lower()) - ord("a")]      # "B" for the second option
+    answer = str(answer or "").strip()
+    if not text or not answer:
+        return None
+    if kind == "mc":
+        if len(options) < 2 or len(set(options)) != len(options) or answer not in options:
+            return None
+        out = {"type": "mc", "q": text, "options": options, "a": answer}
+    elif kind == "tf":
+        a = answer.lower()
+        if a not in _TRUE | _FALSE:
+            return None
+        out = {"type": "tf", "q": text, "a": "صح" if a in _TRUE else "خطأ"}
+    else:
+        return None
+    out["id"] = hashlib.sha1(f"{kind}|{normalize_arabic(text)}".encode("utf-8")).hexdigest()[:12]
+    return out
+
+
+class QuizBank:
+    def __init__(self, root: str | Path, generate: Callable[[str, int, int], dict | None],
+                 target_mc: int = 30, target_tf: int = 20, low_water: float = 0.5,
+                 batch_mc: int = 6, batch_tf: int = 4, max_rounds: int = 8, max_sessions: int = 1000,
+                 shared=None):
+        """
+        generate   : (topic, num_mc, num_tf) -> {"questions": [...]} — one LLM generation
+        target_*   : pool size a top-up aims for
+        low_water  : top up once a pool holds less than this fraction of the target
+        max_rounds : generations per top-up (stops early when a round adds nothing new)
+        shared     : shared_state.SharedState keeping the served ids per session
+                     (None → this process only)
+        """
+        self.root = Path(root)
+        self.generate = generate
+        self.target_mc, self.target_tf, self.low_water = target_mc, target_tf, low_water
+        self.batch_mc, self.batch_tf, self.max_rounds = batch_mc, batch_tf, max_rounds
+        self.max_sessions, self.shared = max_sessions, shared
+        self._pools: dict[str, list[dict]] = {}
+        self._seen: "OrderedDict[str, set[str]]" = OrderedDict()      # session id -> served question ids
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quiz-bank")
+        self._refilling: set[str] = set()
+
+    # ─ persistence ─────────────────────────────────────────────────
+    def _path(self, topic: str) -> Path:
+        slug = hashlib.sha1(topic.encode("utf-8")).hexdigest()[:10]
+        return self.root / f"{topic.replace(' ', '_').replace('/', '_')}_{slug}.json"
+
+    def _pool(self, topic: str) -> list[dict]:
+        with self._lock:
+            if topic not in self._pools:
+                path, pool = self._path(topic), []
+                if path.exists():
+                    try:
+                        raw = json.loads(path.read_text(encoding="utf-8"))
+                        pool = [q for q in map(validate_question, raw.get("questions", [])) if q]
+                    except Exception as e:
+                        print(f"⚠️  quiz pool {path} unreadable, starting empty ({e})")
+                self._pools[topic] = pool
+            return self._pools[topic]
+
+    def _save(self, topic: str) -> None:
+        path = self._path(topic)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"topic": topic, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "questions": self._pools[topic]}
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(path)
+
+    def _with_seen(self, session_id: str, fn: Callable[[set[str]], object]):
+        """fn(ids served in the session), which may add to them; returns what fn returns."""
+        if self.shared is None:
+            with self._lock:
+                seen = self._seen.setdefault(session_id, set())
+                self._seen.move_to_end(session_id)
+                while len(self._seen) > self.max_sessions:
+                    self._seen.popitem(last=False)
+                return fn(seen)
+        out = []
+
+        def apply(ids: list[str] | None) -> list[str]:
+            seen = set(ids or [])
+            out.append(fn(seen))
+            return sorted(seen)
+        self.shared.update_json("quiz_seen", session_id, apply)
+        return out[0]
+
+    # ─ pool ────────────────────────────────────────────────────────
+    def add(self, topic: str, questions: list[dict], session_id: str | None = None) -> int:
+        """
+        Validate and store new questions; returns how many were added
+        (duplicates are skipped). With `session_id` they also count as
+        already served in that session.
+        """
+        with self._lock:
+            pool = self._pool(topic)
+            known = {q["id"] for q in pool}
+            valid = [q for q in map(validate_question, questions or []) if q]
+            added = 0
+            for q in valid:
+                if q["id"] not in known:
+                    pool.append(q)
+                    known.add(q["id"])
+                    added += 1
+            if added:
+                self._save(topic)
+        if session_id is not None and valid:
+            self._with_seen(session_id, lambda seen: seen.update(q["id"] for q in valid))
+        return added
+
+    def counts(self, topic: str) -> dict:
+        pool = self._pool(topic)
+        return {"mc": sum(q["type"] == "mc" for q in pool), "tf": sum(q["type"] == "tf" for q in pool)}
+
+    def needs_top_up(self, topic: str) -> bool:
+        c = self.counts(topic)
+        return c["mc"] < self.low_water * self.target_mc or c["tf"] < self.low_water * self.target_tf
+
+    def top_up(self, topic: str) -> int:
+        """Generate until the pool reaches its targets (blocking); returns questions added."""
+        added = 0
+        for _ in range(self.max_rounds):
+            c = self.counts(topic)
+            need_mc, need_tf = max(0, self.target_mc - c["mc"]), max(0, self.target_tf - c["tf"])
+            if not need_mc and not need_tf:
+                break
+            with span("quiz_bank.generate"):
+                data = self.generate(topic, min(need_mc, self.batch_mc), min(need_tf, self.batch_tf))
+            n = self.add(topic, (data or {}).get("questions", []))
+            added += n
+            if not n:
+                break
+        return added
+
+    def schedule_top_up(self, topic: str) -> bool:
+        """Top up `topic` in the background unless a refill is already queued."""
+        with self._lock:
+            if topic in self._refilling:
+                return False
+            self._refilling.add(topic)
+
+        def job():
+            try:
+                n = self.top_up(topic)
+                print(f"🧩 quiz bank «{topic}»: +{n} questions")
+            except Exception as e:
+                print(f"⚠️  quiz bank top-up for «{topic}» failed: {e}")
+            finally:
+                with self._lock:
+                    self._refilling.discard(topic)
+
+        self._executor.submit(job)
+        return True
+
+    # ─ serving ─────────────────────────────────────────────────────
+    def sample(self, topic: str, num_mc: int, num_tf: int, session_id: str = "default") -> dict | None:
+        """
+        `num_mc` + `num_tf` random questions not yet served in this session,
+        as {"questions": [...]}; None when the pool cannot cover the request.
+        """
+        pool = list(self._pool(topic))
+
+        def pick(seen: set[str]) -> list[dict] | None:
+            picked = []
+            for kind, n in (("mc", num_mc), ("tf", num_tf)):
+                fresh = [q for q in pool if q["type"] == kind and q["id"] not in seen]
+                if len(fresh) < n:
+                    return None
+                picked.extend(random.sample(fresh, n))
+            seen.update(q["id"] for q in picked)
+            return picked
+
+        picked = self._with_seen(session_id, pick)
+        record_cache("quiz_bank", picked is not None)
+        if picked is None or self.needs_top_up(topic):
+            self.schedule_top_up(topic)
+        if picked is None:
+            return None
+        return {"questions": [{k: v for k, v in q.items() if k != "id"} for q in picked]}
+
+    def end_session(self, session_id: str = "default") -> None:
+        with self._lock:
+            self._seen.pop(session_id, None)
+        if self.shared is not None:
+            self.shared.delete("quiz_seen", session_id)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def open_quiz_bank(kg, shared=None) -> QuizBank:
+    """QuizBank over QUIZ_BANK_DIR, generating with handlers.generate_quiz_json on `kg`."""
+    from config import QUIZ_BANK_DIR, QUIZ_BANK_TARGET_MC, QUIZ_BANK_TARGET_TF, QUIZ_BANK_LOW_WATER
+    from handlers import generate_quiz_json
+
+    def generate(topic: str, num_mc: int, num_tf: int) -> dict | None:
+        return generate_quiz_json(topic, kg, num_mc=num_mc, num_tf=num_tf)["data"]
+
+    return QuizBank(QUIZ_BANK_DIR, generate, target_mc=QUIZ_BANK_TARGET_MC,
+                    target_tf=QUIZ_BANK_TARGET_TF, low_water=QUIZ_BANK_LOW_WATER, shared=shared)
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    from kg import open_kg
+
+    ap = argparse.ArgumentParser(description="Fill / inspect the quiz bank.")
+    ap.add_argument("cmd", choices=["fill", "info"])
+    ap.add_argument("--topics", nargs="*", help="default: every topic in the KG")
+    args = ap.parse_args(argv)
+    kg = open_kg()
+    try:
+        bank = open_quiz_bank(kg)
+        for topic in args.topics or kg.list_all_topics():
+            if args.cmd == "fill":
+                n = bank.top_up(topic)
+                print(f"«{topic}»: +{n} → {bank.counts(topic)}")
+            else:
+                print(json.dumps({"topic": topic, **bank.counts(topic)}, ensure_ascii=False))
+    finally:
+        kg.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
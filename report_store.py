@@ -0,0 +1,139 @@
+"""
+Per-session PDF reports, kept in memory and streamed by id.
+
+/finish used to render every report to reports/session_report.pdf and let
+StaticFiles serve it: a disk round trip per report, and two sessions
+finishing together overwrote each other's file. Reports are now rendered
+into a buffer (pdf_report.render_pdf_bytes) and stored here under a random
+id, bounded by count and age, for GET /report/{id}.
+
+Only when serve.py forks several workers (it then configures a SharedState,
+see shared_state.py) is each report also stored there, so any worker can
+answer GET /report/{id}; those copies follow the same count and age
+bounds (`ttl`, `max_items` per worker) as the in-memory ones.
+
+With an archive directory, each report is also written behind (in a
+single background thread) to a uniquely named file
+`report_{session}_{YYYYmmdd-HHMMSS}_{id8}.pdf`; archive files older than
+`archive_ttl` are removed on each write and by `cleanup()`.
+"""
+from __future__ import annotations
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from shared_state import SharedState
+
+REPORTS = REGISTRY.counter("etude_reports_total", "Session reports by outcome.", ("result",))
+
+_UNSAFE = re.compile(r"[^\w-]+")
+_ARCHIVE_GLOB = "report_*.pdf"
+
+
+class ReportStore:
+    def __init__(self, max_items: int = 64, ttl: float = 3600.0, archive_dir: str | Path | None = None,
+                 archive_ttl: float = 7 * 86400.0, shared: SharedState | None = None):
+        """
+        max_items   : reports kept in memory (oldest evicted first)
+        ttl         : seconds a report stays downloadable
+        archive_dir : write-behind directory (None → memory only)
+        archive_ttl : seconds archive files are kept
+        shared      : state shared with the other workers (None → this process only)
+        """
+        self.max_items, self.ttl, self.shared = max_items, ttl, shared
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.archive_ttl = archive_ttl
+        self._items: OrderedDict[str, tuple[float, str, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = (ThreadPoolExecutor(max_workers=1, thread_name_prefix="report-archive")
+                          if self.archive_dir else None)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, pdf: bytes, session_id: str = "default") -> str:
+        """Store a rendered report; returns its id."""
+        rid = uuid.uuid4().hex
+        now = time.time()
+        dropped = []
+        with self._lock:
+            self._items[rid] = (now, session_id, pdf)
+            self._expire(now)
+            while len(self._items) > self.max_items:
+                dropped.append(self._items.popitem(last=False)[0])
+        if self.shared is not None:
+            self.shared.put("report", rid, pdf, ttl=self.ttl)
+            for old in dropped:
+                self.shared.delete("report", old)
+            self.shared.cleanup()                        # expired reports leave the file too
+        REPORTS.inc(result="rendered")
+        if self._executor is not None:
+            self._executor.submit(self._archive, rid, session_id, pdf, now)
+        return rid
+
+    def get(self, rid: str) -> bytes | None:
+        with self._lock:
+            self._expire(time.time())
+            item = self._items.get(rid)
+        pdf = item[2] if item else None
+        if pdf is None and self.shared is not None:
+            pdf = self.shared.get("report", rid)          # rendered by another worker
+        REPORTS.inc(result="served" if pdf is not None else "missing")
+        return pdf
+
+    def _expire(self, now: float) -> None:
+        while self._items:
+            created = next(iter(self._items.values()))[0]
+            if now - created <= self.ttl:
+                break
+            self._items.popitem(last=False)
+
+    def archive_name(self, rid: str, session_id: str, created: float) -> str:
+        session = _UNSAFE.sub("_", session_id)[:40] or "session"
+        return f"report_{session}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(created))}_{rid[:8]}.pdf"
+
+    def _archive(self, rid: str, session_id: str, pdf: bytes, created: float) -> None:
+        path = self.archive_dir / self.archive_name(rid, session_id, created)
+        try:
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".pdf.tmp")
+            tmp.write_bytes(pdf)
+            tmp.replace(path)
+            REPORTS.inc(result="archived")
+            self.cleanup()
+        except OSError as e:
+            print(f"⚠️  report {rid} not archived ({e})")
+
+    def cleanup(self) -> int:
+        """Remove archive files older than archive_ttl; returns how many."""
+        if self.archive_dir is None or not self.archive_dir.is_dir():
+            return 0
+        cutoff, removed = time.time() - self.archive_ttl, 0
+        for path in self.archive_dir.glob(_ARCHIVE_GLOB):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def close(self) -> None:
+        """Finish pending archive writes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+def open_report_store(shared: SharedState | None = None) -> ReportStore:
+    from config import REPORT_CACHE_SIZE, REPORT_TTL, REPORT_ARCHIVE_DIR, REPORT_ARCHIVE_TTL
+    store = ReportStore(REPORT_CACHE_SIZE, REPORT_TTL, REPORT_ARCHIVE_DIR or None, REPORT_ARCHIVE_TTL, shared)
+    store.cleanup()
+    return store
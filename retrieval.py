@@ -1,8 +1,11 @@
-from typing import Any, List, Type
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, List, Optional, Type
 from pydantic import BaseModel, Field
 from crewai.tools import BaseTool
 
-from langchain_experimental.text_splitter import SemanticChunker
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_community.cross_encoders import HuggingFaceCrossEncoder
@@ -10,18 +13,117 @@ from langchain.retrievers.document_compressors import CrossEncoderReranker
 from langchain.retrievers import ContextualCompressionRetriever
 
 from ocr_pdf import load_arabic_pdf
+from chunking import split_documents
+from config import (
+    EMBEDDING_MODEL, RERANKER_MODEL, CHUNKER, RERANK_MODE, RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN,
+    RERANK_SHRINK_TO, RERANK_TITLE_MAX_WORDS,
+)
+from utils_text import normalize_arabic
+from metrics import REGISTRY, span
 
 # ─────────────────────────── Build Retriever ─────────────────────────
-def build_retriever(pdf_path, embedding_model="Omartificial-Intelligence-Space/GATE-AraBert-v1", reranker_model="Omartificial-Intelligence-Space/ARA-Reranker-V1", k_fetch=8, k_rerank=3):
-    docs = load_arabic_pdf(pdf_path)
-    emb = HuggingFaceEmbeddings(model_name=embedding_model)
-    chunks = SemanticChunker(emb).split_documents(docs)
-    vect = Chroma.from_documents(chunks, emb)
+def build_retriever(pdf_path, embedding_model=EMBEDDING_MODEL, reranker_model=RERANKER_MODEL, k_fetch=8, k_rerank=3,
+                    emb=None, cross=None, ocr_cache=None, collection_name="langchain", chunker=CHUNKER,
+                    chunker_kwargs=None):
+    """
+    emb / cross     : already-loaded embeddings and cross-encoder to reuse
+                      (otherwise they are loaded from `embedding_model` / `reranker_model`).
+    ocr_cache       : OCR cache file of this book (see load_arabic_pdf).
+    collection_name : Chroma collection; in-process collections with the same
+                      name are shared, so give every book its own.
+    chunker         : "semantic" (SemanticChunker) or "structural" (page-aware, no
+                      embedding pass), see chunking.py.
+    chunker_kwargs  : extra settings of that chunker (e.g. breakpoint_threshold_amount,
+                      max_tokens), see benchmarks/eval_retrieval.py.
+    """
+    docs = load_arabic_pdf(pdf_path, cache_file=ocr_cache)
+    with span("retrieval.load_models"):
+        emb = emb or HuggingFaceEmbeddings(model_name=embedding_model)
+        cross = cross or HuggingFaceCrossEncoder(model_name=reranker_model)
+    with span("retrieval.chunk"):
+        chunks = split_documents(docs, emb, chunker, **(chunker_kwargs or {}))
+    with span("retrieval.index"):
+        text_bytes = sum(len(c.page_content.encode("utf-8")) for c in chunks)   # see corpus.estimate_retriever_mb
+        vect = Chroma.from_documents(chunks, emb, collection_name=collection_name,
+                                     collection_metadata={"text_bytes": text_bytes})
     base_ret = vect.as_retriever(search_kwargs={"k": k_fetch})
-    cross = HuggingFaceCrossEncoder(model_name=reranker_model)
     comp = CrossEncoderReranker(model=cross, top_n=k_rerank)
     return ContextualCompressionRetriever(base_compressor=comp, base_retriever=base_ret)
 
+# ─────────────────────── Shared searches ─────────────────────────────
+class _SearchMemo:
+    """(retriever id, query) -> Future of the results; concurrent callers wait for the first search."""
+
+    def __init__(self):
+        self._futures: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: tuple, search: Callable[[], list]) -> list:
+        with self._lock:
+            fut = self._futures.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._futures[key] = Future()
+        if not owner:
+            return list(fut.result())
+        try:
+            hits = search()
+        except BaseException as e:
+            with self._lock:
+                self._futures.pop(key, None)      # let a later caller retry
+            fut.set_exception(e)
+            raise
+        fut.set_result(hits)
+        return list(hits)
+
+
+# active while a shared_search() block runs
+_SEARCH_MEMO: ContextVar[Optional[_SearchMemo]] = ContextVar("search_memo", default=None)
+
+@contextmanager
+def shared_search():
+    """
+    Inside the block (and in threads started with its copied context),
+    identical searches on the same retriever run once — e.g. a batch job
+    retrieving the same lessons for a topic's summary and its quiz. A search
+    asked for while the same one is running waits for its result.
+    """
+    if _SEARCH_MEMO.get() is not None:          # nested: reuse the outer memo
+        yield
+        return
+    token = _SEARCH_MEMO.set(_SearchMemo())
+    try:
+        yield
+    finally:
+        _SEARCH_MEMO.reset(token)
+
+# ─────────────────────── Adaptive reranking ──────────────────────────
+RERANK_DECISIONS = REGISTRY.counter(
+    "etude_rerank_decisions_total", "Cross-encoder stage per search: full, shrunk or skipped (and why).",
+    ("decision",),
+)
+
+def rerank_plan(query: str, top_text: str, sims: List[float], top_n: int, skip_margin: float,
+                shrink_margin: float, shrink_to: int, title_max_words: int) -> tuple[str, int]:
+    """
+    Decide the rerank stage of an adaptive search from the vector stage.
+    sims : relevance of the candidates (0..1, best first).
+    Returns (decision, candidates to rerank): "skipped_title" / "skipped_margin"
+    (0 → the vector stage picks the `top_n` kept), "shrunk" (the best
+    `shrink_to`) or "full" (all of them).
+    """
+    if len(sims) <= top_n:
+        return "full", len(sims)          # nothing would be cut anyway
+    q = normalize_arabic(query)
+    if len(q.split()) <= title_max_words and q and q in normalize_arabic(top_text):
+        return "skipped_title", 0         # a lesson title found verbatim in the best chunk
+    margin = sims[0] - sims[1]
+    if margin >= skip_margin:
+        return "skipped_margin", 0
+    if margin >= shrink_margin and shrink_to < len(sims):
+        return "shrunk", max(shrink_to, top_n)
+    return "full", len(sims)
+
 # ─────────────────────── ChapterRetriever Tool ──────────────────────
 class ChapterRetrieverInput(BaseModel):
     query: str = Field(..., description="السؤال أو عنوان الدرس")
@@ -31,10 +133,62 @@ class ChapterRetrieverTool(BaseTool):
     description: str = "يجيب مقاطع من الكتاب حسب السؤال أو عنوان الدرس."
     args_schema: Type[BaseModel] = ChapterRetrieverInput
 
-    def __init__(self, retriever: ContextualCompressionRetriever):
+    def __init__(self, retriever: Optional[ContextualCompressionRetriever], rerank: Optional[str] = None):
+        """
+        rerank : "always" (cross-encoder on every candidate), "adaptive" (skip or
+                 shrink it when the vector stage is confident, see rerank_plan)
+                 or "never"; default RERANK_MODE.
+        """
         super().__init__()
         object.__setattr__(self, "_retriever", retriever)
+        object.__setattr__(self, "_rerank", rerank or RERANK_MODE)
+
+    def _current_retriever(self) -> ContextualCompressionRetriever:
+        return self._retriever
+
+    def search(self, query: str) -> List[tuple[float, str]]:
+        """
+        Top chunks for `query` as (score, text), best first. The score is the
+        cross-encoder's when the rerank ran, the vector relevance (0..1) when it
+        was skipped ("never" mode, or an adaptive skip); assemble_context
+        normalizes the scores of each lesson before comparing lessons.
+        """
+        retriever = self._current_retriever()
+        memo = _SEARCH_MEMO.get()
+        if memo is not None:
+            return memo.run((id(retriever), query), lambda: self._search(retriever, query))
+        return self._search(retriever, query)
+
+    def _search(self, retriever, query: str) -> List[tuple[float, str]]:
+        # same two stages as ContextualCompressionRetriever.invoke, timed separately;
+        # the rerank is CrossEncoderReranker.compress_documents, keeping the scores
+        comp = retriever.base_compressor
+        if self._rerank == "always":
+            with span("retrieval.vector_search"):
+                docs = retriever.base_retriever.invoke(query)
+            sims, decision, n = [], "full", len(docs)
+        else:
+            with span("retrieval.vector_search"):
+                k = retriever.base_retriever.search_kwargs.get("k", 4)
+                pairs = retriever.base_retriever.vectorstore.similarity_search_with_relevance_scores(query, k=k)
+            docs, sims = [d for d, _ in pairs], [float(s) for _, s in pairs]
+            if self._rerank == "never":
+                decision, n = "skipped_mode", 0
+            else:
+                decision, n = rerank_plan(query, docs[0].page_content if docs else "", sims, comp.top_n,
+                                          RERANK_SKIP_MARGIN, RERANK_SHRINK_MARGIN, RERANK_SHRINK_TO,
+                                          RERANK_TITLE_MAX_WORDS)
+        RERANK_DECISIONS.inc(decision=decision)
+        if not n:
+            hits = [(s, d.page_content) for d, s in zip(docs, sims)][:comp.top_n]
+        else:
+            with span("retrieval.rerank"):
+                cand = docs[:n]
+                scores = comp.model.score([(query, d.page_content) for d in cand]) if cand else []
+                ranked = sorted(zip(scores, cand), key=lambda x: x[0], reverse=True)[:comp.top_n]
+            hits = [(float(s), d.page_content) for s, d in ranked]
+        return hits
 
     def _run(self, query: str, **kwargs: Any) -> List[str]:
         print(f"Retrieving pages for «{query}» …")
-        return [d.page_content for d in self._retriever.invoke(query)]
+        return [text for _, text in self.search(query)]
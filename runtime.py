@@ -18,23 +18,51 @@ try:
 except Exception:
     pass
 
-from retrieval import build_retriever, ChapterRetrieverTool
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from corpus import CorpusManager, CorpusRetrieverTool
 from agents import build_llm, define_agents
 from pdf_report import SessionMemory
+from qa_cache import EmbeddingCache, AnswerCache, LastGoodCache
+from llm_call import LLMInvoker
+from image_select import ImageSelector, open_caption_cache, open_query_cache
+from session_digest import llm_compactor
+from config import (
+    EMBEDDING_MODEL, BOOKS, CORPUS_RAM_BUDGET_MB, QA_CACHE_DIR, QA_EMB_CACHE_SIZE,
+    QA_ANSWER_CACHE_SIZE, QA_ANSWER_TTL, QA_SEMANTIC_THRESHOLD, IMAGES_PER_LESSON,
+    SESSION_LLM_COMPACT, LLM_DEADLINES, LLM_DEFAULT_DEADLINE, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_S,
+    LLM_WORKERS, LLM_FALLBACK_SIZE,
+)
 
-# If your config.py exposes a PDF_PATH, great; otherwise set your own here:
-try:
-    from config import PDF_PATH
-except Exception:
-    PDF_PATH = Path("book.pdf")  # <-- adjust to your PDF if needed
+# Shared embedding model (QA, intent routing and every book's index)
+EMB = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
 
-# Build once
-RETRIEVER = build_retriever(PDF_PATH)
-TOOL = ChapterRetrieverTool(RETRIEVER)
+# Books are indexed lazily, on the first request that needs them (see corpus.py)
+CORPUS = CorpusManager(BOOKS, ram_budget_mb=CORPUS_RAM_BUDGET_MB, emb=EMB)
+TOOL = CorpusRetrieverTool(CORPUS)
 
 LLM = build_llm()
 # define_agents(tool) returns (router, summary, qa, quiz, feedback) in your codebase
 ROUTER, SUMMARY_AGENT, QA_AGENT, QUIZ_AGENT, FEEDBACK_AGENT = define_agents(TOOL)
 
+# every generation goes through LLM_INVOKER: deadlines, hedging, last-good fallback (see llm_call.py)
+LLM_INVOKER = LLMInvoker(LLM_DEADLINES, LLM_DEFAULT_DEADLINE, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_S,
+                         fallback=LastGoodCache(os.path.join(QA_CACHE_DIR, "llm_last_good.json"), LLM_FALLBACK_SIZE),
+                         workers=LLM_WORKERS)
+
+# QA caches: exact question → embedding, near-duplicate question → answer
+EMB_CACHE = EmbeddingCache(os.path.join(QA_CACHE_DIR, "qa_embeddings.json"),
+                           QA_EMB_CACHE_SIZE, model_name=EMBEDDING_MODEL)
+ANSWER_CACHE = AnswerCache(os.path.join(QA_CACHE_DIR, "qa_answers.json"),
+                           QA_ANSWER_CACHE_SIZE, model_name=EMBEDDING_MODEL,
+                           threshold=QA_SEMANTIC_THRESHOLD, ttl=QA_ANSWER_TTL)
+
+# prompt images: the few per lesson whose caption matches the retrieved text
+IMAGE_SELECTOR = ImageSelector(EMB, open_caption_cache(), per_lesson=IMAGES_PER_LESSON,
+                               query_cache=open_query_cache())
+
 # simple session memory you already use in pdf_report.py
-GLOBAL_MEM = SessionMemory()
+# (older Q&A turns are folded into a bounded digest, optionally by the feedback agent;
+#  the API keeps one per session id, see shared_state.SessionStore)
+SESSION_COMPACT = llm_compactor(FEEDBACK_AGENT, LLM_INVOKER) if SESSION_LLM_COMPACT else None
+GLOBAL_MEM = SessionMemory(compact=SESSION_COMPACT)
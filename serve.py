@@ -0,0 +1,211 @@
+"""
+Pre-fork serving: load once, fork workers that share it copy-on-write.
+
+With `uvicorn --workers N` every worker imports runtime.py and loads its
+own embedding model, cross-encoder and Chroma indexes, so RAM and start-up
+time grow with N. Here the parent process
+
+1. loads the models, builds the book indexes (CORPUS), maps the lesson
+   vectors and the image manifest, with torch limited to one thread and
+   the tokenizers' parallelism off (their thread pools must not exist yet
+   when we fork);
+2. `gc.freeze()`s everything it loaded, so collections in the workers do
+   not touch (and copy) those pages;
+3. binds the listening socket and forks `--workers` workers, restarting
+   any that dies.
+
+Each worker sets its own torch threads and run_in_threadpool limit, then
+imports app.py, which opens the worker's own Neo4j connections and thread
+pools (sockets and threads must not cross a fork), and serves the shared
+socket with uvicorn.
+
+    python -m serve --workers 4 --threads 2      (or python main2.py, behind ngrok)
+
+Consecutive requests of a session may reach different workers, so what a
+later request reads back (session memory, reports, batch progress, stored
+profiles, questions already served) lives in the SQLite file of
+shared_state.py, which serve() turns on (ETUDE_SHARED_STATE, default
+SERVE_SHARED_STATE_PATH) before forking. /metrics stays per worker. The JSON caches (qa_cache.py)
+are loaded by the parent; each worker writes its copy back when it stops
+(before `os._exit`, which skips atexit), the last one to stop winning.
+Platforms without fork (Windows) or --workers 1 run a single in-process
+server.
+"""
+from __future__ import annotations
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def _set_torch_threads(n: int) -> None:
+    os.environ["OMP_NUM_THREADS"] = os.environ["MKL_NUM_THREADS"] = str(n)
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except ImportError:
+        pass
+
+
+def preload() -> dict:
+    """Load the shared read-only state in this (parent) process; returns what was loaded."""
+    t0 = time.perf_counter()
+    _set_torch_threads(1)
+    # HF tokenizers start a Rust thread pool on first use, which a forked worker would inherit broken
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import runtime
+    from config import KG_BACKEND
+    from image_manifest import get_manifest
+    import handlers  # noqa: F401  (module-level imports of the request path)
+
+    for book_id in runtime.CORPUS.books:
+        runtime.CORPUS.retriever(book_id)
+    # one call through each model so lazy initialisation happens before the fork
+    runtime.EMB.embed_query("تسخين")
+    retriever = runtime.CORPUS.retriever()
+    retriever.base_compressor.model.score([("تسخين", "تسخين")])
+    images = len(get_manifest())
+    lessons = 0
+    if KG_BACKEND == "neo4j":
+        # export / refresh the memory-mapped lesson vectors once; workers only map the file
+        from kg import open_kg
+        from lesson_vectors import open_lesson_vectors
+        kg = open_kg()
+        try:
+            lessons = len(open_lesson_vectors(kg))
+        finally:
+            kg.close()
+    return {"seconds": round(time.perf_counter() - t0, 1), "corpus": runtime.CORPUS.stats(),
+            "images": images, "lessons": lessons}
+
+
+def _flush_caches() -> None:
+    try:
+        from qa_cache import flush_all
+        flush_all()
+    except Exception as e:
+        print(f"⚠️  caches not flushed ({e!r})", file=sys.stderr)
+
+
+def _bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+async def _serve(server, sock: socket.socket, threadpool: int) -> None:
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = threadpool
+    await server.serve(sockets=[sock])
+
+
+def _worker(sock: socket.socket, threads: int, threadpool: int, log_level: str) -> None:
+    import asyncio
+    import uvicorn
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _set_torch_threads(threads)
+    from app import app
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level, lifespan="on"))
+    asyncio.run(_serve(server, sock, threadpool))
+
+
+def serve(host: str, port: int, workers: int, threads: int, threadpool: int, log_level: str = "info") -> int:
+    if workers <= 1 or not hasattr(os, "fork"):
+        import asyncio
+        import uvicorn
+        _set_torch_threads(threads)
+        from app import app
+        server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level=log_level))
+        asyncio.run(_serve(server, _bind(host, port), threadpool))
+        return 0
+
+    # workers must see each other's sessions, reports, batch jobs and profiles
+    import config
+    if not config.SHARED_STATE_PATH:
+        config.SHARED_STATE_PATH = os.environ["ETUDE_SHARED_STATE"] = config.SERVE_SHARED_STATE_PATH
+    sock = _bind(host, port)
+    info = preload()
+    print(f"✅ preloaded in {info['seconds']} s: {info['corpus']['resident_mb']} MB of indexes, "
+          f"{info['lessons']} lesson vectors, {info['images']} images")
+    _flush_caches()          # written once here, so the parent's exit does not overwrite the workers' copies
+    gc.collect()
+    gc.freeze()
+
+    children: dict[int, int] = {}          # pid -> worker slot
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _worker(sock, threads, threadpool, log_level)
+            except BaseException as e:
+                print(f"⚠️  worker {slot} crashed ({e!r})", file=sys.stderr)
+                code = 1
+            finally:
+                _flush_caches()
+                os._exit(code)
+        children[pid] = slot
+        print(f"👷 worker {slot} started (pid {pid})")
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+
+    restarts: list[float] = []
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        # restart a dead worker, unless workers keep dying right after start
+        now = time.monotonic()
+        restarts = [t for t in restarts if now - t < 60] + [now]
+        if len(restarts) > 2 * workers:
+            print("❌ workers keep exiting, shutting down", file=sys.stderr)
+            stop(signal.SIGTERM, None)
+            continue
+        print(f"♻️  worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        spawn(slot)
+    sock.close()
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    from config import SERVE_HOST, SERVE_PORT, SERVE_WORKERS, SERVE_THREADS_PER_WORKER, SERVE_THREADPOOL
+    ap = argparse.ArgumentParser(description="Pre-fork API server with shared, copy-on-write models.")
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    ap.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    ap.add_argument("--threads", type=int, default=SERVE_THREADS_PER_WORKER, help="torch threads per worker")
+    ap.add_argument("--threadpool", type=int, default=SERVE_THREADPOOL, help="run_in_threadpool limit per worker")
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args(argv)
+    return serve(args.host, args.port, args.workers, args.threads, args.threadpool, args.log_level)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
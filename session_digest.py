@@ -0,0 +1,164 @@
+"""
+Bounded session history for the end-of-session feedback prompt.
+
+The feedback prompt used to carry the whole chapter summary, every Q&A
+pair with its full answer and the quiz log, so its size grew with the
+session. Now:
+
+* SessionDigest keeps the last `keep_recent` Q&A turns verbatim (clipped)
+  and folds older ones into one line each (question + first sentence of
+  the answer). When the folded lines exceed their token budget the oldest
+  are dropped and counted — or, with a `compact` callable (an LLM), they
+  are rewritten into a short paragraph in a background thread.
+* feedback_parts(mem) builds the prompt sections under FEEDBACK_PROMPT_BUDGET
+  tokens, whatever the session length.
+"""
+from __future__ import annotations
+import re
+import threading
+from typing import Callable
+
+from context_assembly import estimate_tokens
+
+_SENTENCE_END = re.compile(r"(?<=[.!؟?…])\s+")
+
+
+def clip(text: str, max_tokens: int) -> str:
+    """`text` cut to about `max_tokens` (on a word boundary, with an ellipsis)."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    from config import CONTEXT_CHARS_PER_TOKEN
+    cut = text[:int(max_tokens * CONTEXT_CHARS_PER_TOKEN)]
+    return (cut.rsplit(" ", 1)[0] if " " in cut else cut) + " …"
+
+
+def first_sentence(text: str, max_tokens: int) -> str:
+    return clip(_SENTENCE_END.split(" ".join(str(text).split()), 1)[0], max_tokens)
+
+
+class SessionDigest:
+    def __init__(self, keep_recent: int = 3, budget_tokens: int = 600, turn_tokens: int = 120,
+                 compact: Callable[[str], str] | None = None,
+                 on_compacted: Callable[[list[str], str | None], None] | None = None):
+        """
+        keep_recent   : latest turns kept as question + clipped answer
+        budget_tokens : cap for the folded (older) turns
+        turn_tokens   : cap per recent answer; folded answers get a third of it
+        compact       : optional text -> shorter text (LLM), run in the background
+        on_compacted  : receives (folded lines, summary) instead of this digest when
+                        it is a copy of one stored elsewhere (shared_state.SessionStore)
+        """
+        self.keep_recent, self.budget_tokens, self.turn_tokens = keep_recent, budget_tokens, turn_tokens
+        self.compact, self.on_compacted = compact, on_compacted
+        self.recent: list[tuple[str, str]] = []
+        self.folded: list[str] = []
+        self.turns = self.dropped = 0
+        self._lock = threading.Lock()
+        self._compacting = False
+
+    def add(self, question: str, answer: str) -> None:
+        with self._lock:
+            self.turns += 1
+            self.recent.append((question, answer))
+            while len(self.recent) > self.keep_recent:
+                q, a = self.recent.pop(0)
+                self.folded.append(f"• {clip(q, 40)} ← {first_sentence(a, max(20, self.turn_tokens // 3))}")
+            over = estimate_tokens("\n".join(self.folded)) > self.budget_tokens
+            start_compaction = over and self.compact is not None and not self._compacting
+            if start_compaction:
+                self._compacting = True
+            elif over:
+                self._drop_oldest()
+        if start_compaction:
+            threading.Thread(target=self._compact_folded, daemon=True).start()
+
+    def _drop_oldest(self) -> None:
+        while len(self.folded) > 1 and estimate_tokens("\n".join(self.folded)) > self.budget_tokens:
+            self.folded.pop(0)
+            self.dropped += 1
+
+    def _compact_folded(self) -> None:
+        with self._lock:
+            lines = list(self.folded)
+        try:
+            summary = "• " + clip(" ".join(self.compact("\n".join(lines)).split()), self.budget_tokens // 2)
+        except Exception as e:
+            print(f"⚠️  session compaction failed, dropping oldest turns instead ({e})")
+            summary = None
+        (self.on_compacted or self.apply_compaction)(lines, summary)
+
+    def apply_compaction(self, lines: list[str], summary: str | None) -> None:
+        """Replace the folded `lines` sent to `compact` by its `summary` (None: it failed)."""
+        with self._lock:
+            if summary is not None:
+                # turns folded while the LLM was busy are kept after the summary
+                self.folded = [summary] + self.folded[len(lines):]
+            self._drop_oldest()
+            self._compacting = False
+
+    def to_state(self) -> dict:
+        with self._lock:
+            return {"keep_recent": self.keep_recent, "budget_tokens": self.budget_tokens,
+                    "turn_tokens": self.turn_tokens, "recent": [list(t) for t in self.recent],
+                    "folded": list(self.folded), "turns": self.turns, "dropped": self.dropped,
+                    "compacting": self._compacting}
+
+    @classmethod
+    def from_state(cls, state: dict, compact: Callable[[str], str] | None = None,
+                   on_compacted: Callable[[list[str], str | None], None] | None = None) -> "SessionDigest":
+        digest = cls(state["keep_recent"], state["budget_tokens"], state["turn_tokens"],
+                     compact=compact, on_compacted=on_compacted)
+        digest.recent = [tuple(t) for t in state["recent"]]
+        digest.folded = list(state["folded"])
+        digest.turns, digest.dropped = state["turns"], state["dropped"]
+        digest._compacting = state["compacting"]
+        return digest
+
+    def text(self) -> str:
+        with self._lock:
+            parts = []
+            if self.dropped:
+                parts.append(f"(+{self.dropped} أسئلة أخرى في بداية الجلسة)")
+            parts.extend(self.folded)
+            parts.extend(f"❓ {q}\n📥 {clip(a, self.turn_tokens)}" for q, a in self.recent)
+            return "\n".join(parts)
+
+
+def llm_compactor(agent, invoker) -> Callable[[str], str]:
+    """`compact` callable for SessionDigest backed by a crewai agent (through an LLMInvoker)."""
+    def compact(text: str) -> str:
+        prompt = ("لخّص هالأسئلة و الأجوبة متاع طفل في 3 أسطر على الأكثر، "
+                  "مع ذكر المواضيع اللي صعبت عليه:\n" + text)
+        return invoker.invoke(agent, prompt, "ملخّص قصير", use="session.compact").raw
+    return compact
+
+
+def _summary_text(summary) -> str:
+    """chapter_summary is markdown (CLI) or the {"title", "slides"} JSON (API)."""
+    if isinstance(summary, dict):
+        slides = summary.get("slides", [])
+        return "\n".join([summary.get("title", "")] + [first_sentence(s.get("text", ""), 60) for s in slides])
+    return str(summary)
+
+
+def feedback_parts(mem, budget_tokens: int | None = None) -> list[str]:
+    """Prompt sections (summary, Q&A digest, quiz) whose total stays under `budget_tokens`."""
+    from config import FEEDBACK_PROMPT_BUDGET
+    budget = budget_tokens or FEEDBACK_PROMPT_BUDGET
+    parts = []
+    if "chapter_summary" in mem:
+        parts.append("ملخّص الدرس:\n" + clip(_summary_text(mem["chapter_summary"]), int(budget * 0.3)))
+    if "qa_digest" in mem:
+        parts.append("الأسئلة و الأجوبة:\n" + clip(mem["qa_digest"].text(), int(budget * 0.45)))
+    elif "qa_history" in mem:
+        digest = SessionDigest()
+        for q, a in mem["qa_history"]:
+            digest.add(q, a)
+        parts.append("الأسئلة و الأجوبة:\n" + clip(digest.text(), int(budget * 0.45)))
+    if "quiz_log" in mem:
+        log = mem["quiz_log"]
+        wrong = [q for q in log if q.get("is_correct") is False]
+        lines = [f"{i+1}) {q.get('q')} – الصحيح: {q.get('correct', q.get('a'))}" for i, q in enumerate(wrong or log)]
+        title = "أسئلة غلط فيها:" if wrong else "تفاصيل الاختبار:"
+        parts.append(title + "\n" + clip("\n".join(lines), int(budget * 0.25)))
+    return parts
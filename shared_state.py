@@ -0,0 +1,156 @@
+"""
+State the API workers share (python -m serve --workers N).
+
+Forked workers accept from one listening socket, so the next request of a
+session, a report download or a batch poll may reach any of them.
+Everything a later request reads back is therefore kept here rather than
+in a worker's memory:
+
+* session    – SessionMemory per session id (summary, Q&A digest, quiz log)
+* report     – rendered PDFs by report id (report_store.ReportStore)
+* batch      – progress of batch jobs by job id (batch.BatchRunner)
+* profile    – kept request profiles by id (profiling.Profiler)
+* quiz_seen  – question ids already served per session (quiz_bank.QuizBank)
+
+One SQLite file (WAL: readers do not block the writer), one row per
+(kind, key) with an expiry time. Connections are opened per process and
+thread, so none crosses a fork. SHARED_STATE_PATH is empty by default —
+every store keeps its state in process memory — and serve.py sets it
+(ETUDE_SHARED_STATE) when it forks more than one worker.
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+from pdf_report import SessionMemory
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS state (
+    kind TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires REAL NOT NULL,
+    PRIMARY KEY (kind, key))"""
+
+
+class SharedState:
+    def __init__(self, path: str, ttl: float = 86400.0, busy_timeout: float = 10.0):
+        """
+        ttl          : default seconds an entry is kept
+        busy_timeout : seconds a write waits for another worker's transaction
+        """
+        self.path, self.ttl, self.busy_timeout = path, ttl, busy_timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(_SCHEMA)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    # ─ raw values ──────────────────────────────────────────────────
+    def put(self, kind: str, key: str, value: bytes, ttl: float | None = None) -> None:
+        self._db().execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)",
+                           (kind, key, value, time.time() + (ttl or self.ttl)))
+
+    def get(self, kind: str, key: str) -> bytes | None:
+        row = self._db().execute("SELECT value FROM state WHERE kind = ? AND key = ? AND expires > ?",
+                                 (kind, key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def values(self, kind: str) -> list[bytes]:
+        return [row[0] for row in self._db().execute(
+            "SELECT value FROM state WHERE kind = ? AND expires > ?", (kind, time.time()))]
+
+    def delete(self, kind: str, key: str) -> None:
+        self._db().execute("DELETE FROM state WHERE kind = ? AND key = ?", (kind, key))
+
+    def cleanup(self) -> int:
+        """Remove expired entries; returns how many."""
+        return self._db().execute("DELETE FROM state WHERE expires <= ?", (time.time(),)).rowcount
+
+    # ─ JSON values ─────────────────────────────────────────────────
+    def put_json(self, kind: str, key: str, value: Any, ttl: float | None = None) -> None:
+        self.put(kind, key, json.dumps(value, ensure_ascii=False).encode("utf-8"), ttl)
+
+    def get_json(self, kind: str, key: str) -> Any:
+        raw = self.get(kind, key)
+        return None if raw is None else json.loads(raw)
+
+    def values_json(self, kind: str) -> list[Any]:
+        return [json.loads(raw) for raw in self.values(kind)]
+
+    def update_json(self, kind: str, key: str, fn: Callable[[Any], Any], ttl: float | None = None) -> Any:
+        """Store fn(current value or None) in one write transaction (no other worker writes meanwhile)."""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            value = fn(self.get_json(kind, key))
+            self.put_json(kind, key, value, ttl)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return value
+
+
+class SessionStore:
+    """SessionMemory per session id: in SharedState when given, else in this process."""
+
+    def __init__(self, shared: SharedState | None = None, compact: Callable[[str], str] | None = None,
+                 max_sessions: int = 1000):
+        """compact : LLM compaction of the Q&A digest (see session_digest.SessionDigest)."""
+        self.shared, self.compact, self.max_sessions = shared, compact, max_sessions
+        self._sessions: OrderedDict[str, SessionMemory] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _local(self, session_id: str) -> SessionMemory:
+        mem = self._sessions.get(session_id)
+        if mem is None:
+            mem = self._sessions[session_id] = SessionMemory(compact=self.compact)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return mem
+
+    def _load(self, session_id: str, state: dict | None) -> SessionMemory:
+        def compacted(lines: list[str], summary: str | None) -> None:
+            # the compaction ran on a loaded copy: apply it to the stored session
+            self.update(session_id, lambda mem: mem["qa_digest"].apply_compaction(lines, summary))
+        return SessionMemory.from_state(state or {}, compact=self.compact, on_compacted=compacted)
+
+    def get(self, session_id: str) -> SessionMemory:
+        """The session's memory (a copy when shared: changes go through `update`)."""
+        if self.shared is None:
+            with self._lock:
+                return self._local(session_id)
+        return self._load(session_id, self.shared.get_json("session", session_id))
+
+    def update(self, session_id: str, fn: Callable[[SessionMemory], None]) -> None:
+        """Apply `fn` to the session's memory and keep the result."""
+        if self.shared is None:
+            with self._lock:
+                fn(self._local(session_id))
+            return
+
+        def apply(state: dict | None) -> dict:
+            mem = self._load(session_id, state)
+            fn(mem)
+            return mem.to_state()
+        self.shared.update_json("session", session_id, apply)
+
+
+def open_shared_state() -> SharedState | None:
+    """SharedState at SHARED_STATE_PATH (expired entries removed), None when it is empty."""
+    from config import SHARED_STATE_PATH, SHARED_STATE_TTL
+    if not SHARED_STATE_PATH:
+        return None
+    shared = SharedState(SHARED_STATE_PATH, SHARED_STATE_TTL)
+    shared.cleanup()
+    return shared
@@ -0,0 +1,63 @@
+"""
+In-flight request coalescing ("single flight") for the async endpoints.
+
+When a class opens the same chapter, many identical /summary or /quiz
+requests arrive together. `await FLIGHTS.do(key, work)` runs `work()`
+once per key; duplicates arriving while it is in flight await the same
+result (or the same exception). The shared work runs as its own task, so
+a caller that times out or disconnects does not cancel it for the others.
+
+Keys are (endpoint, normalized parameters), see `flight_key`.
+"""
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from utils_text import normalize_arabic
+from metrics import REGISTRY
+
+FLIGHT_REQUESTS = REGISTRY.counter(
+    "etude_singleflight_total", "Coalesced work by endpoint and role (leader ran it, follower shared it).",
+    ("endpoint", "role"),
+)
+
+
+def flight_key(endpoint: str, *params: Any) -> tuple:
+    """(endpoint, params…) with text parameters Arabic-normalized."""
+    return (endpoint,) + tuple(normalize_arabic(p) if isinstance(p, str) else p for p in params)
+
+
+class SingleFlight:
+    def __init__(self, default_timeout: float | None = None):
+        self.default_timeout = default_timeout
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[Any]],
+                 timeout: float | None = None) -> tuple[Any, bool]:
+        """
+        Result of `work()` for `key` and whether it was shared with an
+        earlier caller. Raises what `work` raised, or TimeoutError after
+        `timeout` seconds (the work itself keeps running for the others).
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(work())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        endpoint = key[0] if isinstance(key, tuple) and key else str(key)
+        FLIGHT_REQUESTS.inc(endpoint=endpoint, role="follower" if shared else "leader")
+        timeout = self.default_timeout if timeout is None else timeout
+        return await asyncio.wait_for(asyncio.shield(task), timeout), shared
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()      # retrieved: no "exception was never retrieved" warning
+
+
+FLIGHTS = SingleFlight()
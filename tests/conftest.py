@@ -0,0 +1,8 @@
+"""Tests import the flat top-level modules and read config_files/ relative to the repo root."""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from ann_index import ExactIndex, IVFIndex, build_index, load_index
+
+
+def clustered(n=600, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(12, dim))
+    x = centers[rng.integers(12, size=n)] + 0.1 * rng.normal(size=(n, dim))
+    return x.astype(np.float32), [{"id": i} for i in range(n)]
+
+
+def test_exact_index_finds_the_nearest_vector():
+    index = ExactIndex()
+    index.add([[1, 0], [0, 1], [1, 1]], [{"id": "x"}, {"id": "y"}, {"id": "xy"}])
+    (score, best), second = index.search([0.9, 0.1], k=2)
+    assert best == {"id": "x"} and second[1] == {"id": "xy"}
+    assert score == pytest.approx(0.9 / np.hypot(0.9, 0.1))
+    with pytest.raises(ValueError):
+        index.add([[1, 0, 0]], [{"id": "3d"}])
+
+
+def test_ivf_recall_against_exact():
+    x, payloads = clustered()
+    exact, ivf = build_index(x, payloads, kind="exact"), build_index(x, payloads, kind="ivf", nprobe=8)
+    queries = x[:50] + 0.05
+    hits = sum(ivf.search(q)[0][1] == exact.search(q)[0][1] for q in queries)
+    assert hits >= 48
+
+
+def test_ivf_save_load_round_trip(tmp_path):
+    x, payloads = clustered()
+    ivf = build_index(x, payloads, kind="ivf", nprobe=4)
+    ivf.save(tmp_path / "lessons.npz")
+    loaded = load_index(tmp_path / "lessons.npz")
+    assert isinstance(loaded, IVFIndex) and len(loaded) == len(ivf) and loaded.nprobe == 4
+    np.testing.assert_array_equal(loaded.centroids, ivf.centroids)
+    for q in x[::60]:
+        assert loaded.search(q, k=3) == ivf.search(q, k=3)
+    # the loaded index keeps growing incrementally
+    loaded.add(x[:1] * -1, [{"id": "new"}])
+    assert loaded.search(x[0] * -1)[0][1] == {"id": "new"}
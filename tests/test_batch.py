@@ -0,0 +1,36 @@
+import pytest
+
+from batch import BatchJob, BatchRunner
+from shared_state import SharedState
+
+
+def test_job_keeps_one_item_per_normalized_module_and_kind():
+    job = BatchJob(["الهواء", "الْهَواء ", "", "الماء"], ["summary", "quiz"])
+    assert job.modules == ["الهواء", "الماء"]
+    assert [(it.module, it.kind) for it in job.items] == [
+        ("الهواء", "summary"), ("الهواء", "quiz"), ("الماء", "summary"), ("الماء", "quiz")]
+    with pytest.raises(ValueError):
+        BatchJob(["الهواء"], ["summary", "poem"])
+
+
+def test_progress_counts_items_by_status():
+    job = BatchJob(["الهواء", "الماء"], ["summary"])
+    assert job.progress()["status"] == "queued"
+    job.items[0].status = "done"
+    job.items[1].status = "running"
+    p = job.progress()
+    assert (p["status"], p["total"], p["done"], p["running"], p["pending"]) == ("running", 2, 1, 1, 0)
+    job.items[1].status, job.finished = "failed", job.created + 1
+    p = job.progress()
+    assert (p["status"], p["failed"], p["elapsed"]) == ("finished", 1, 1.0)
+
+
+def test_progress_of_a_job_started_by_another_worker(tmp_path):
+    shared = SharedState(str(tmp_path / "state.sqlite3"))
+    here, there = BatchRunner(kg=None, shared=shared), BatchRunner(kg=None, shared=shared)
+    job = BatchJob(["الهواء"], ["quiz"])
+    here._jobs[job.id] = job
+    here._publish(job)
+    assert there.progress(job.id)["total"] == 1
+    assert there.progress("unknown") is None
+    here.close(), there.close()
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+from langchain_core.documents import Document  # noqa: E402
+
+from chunking import is_heading, split_blocks, split_documents, structural_chunks  # noqa: E402
+from context_assembly import estimate_tokens  # noqa: E402
+
+SENTENCE = "الهواء يحيط بالأرض و نتنفسه كل يوم و يتكون من غازات مختلفة. "
+
+
+def test_headings_split_blocks():
+    assert is_heading("2- الإشكالية :") and is_heading("الموضوع : الهواء") and is_heading("أستنتج")
+    assert not is_heading(SENTENCE)
+    blocks = split_blocks("الموضوع : الهواء\nنص أول\n\nنص ثاني\nالهدف : نعرف\nنص ثالث")
+    assert blocks == [("الموضوع : الهواء\nنص أول", True), ("نص ثاني", False), ("الهدف : نعرف\nنص ثالث", True)]
+
+
+def test_long_paragraph_chunks_fit_with_their_overlap():
+    # one paragraph with no sentence ends: every cut is a word cut
+    page = Document(" ".join(["كلمة"] * 900), {"page": 3})
+    chunks = structural_chunks([page], max_tokens=120, overlap_tokens=20, min_tokens=10)
+    assert len(chunks) > 3
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert estimate_tokens(cur.page_content) <= 120
+        head = cur.page_content.split("\n")[0]
+        assert head and prev.page_content.endswith(head)            # the overlap made it in
+    assert {c.metadata["page"] for c in chunks} == {3}
+    assert [c.metadata["chunk"] for c in chunks] == list(range(len(chunks)))
+
+
+def test_chunks_stay_on_their_page_and_keep_the_heading():
+    pages = [Document("الموضوع : الهواء\n" + SENTENCE * 6, {"page": 1}),
+             Document("الهدف : الماء\n" + SENTENCE * 6, {"page": 2})]
+    chunks = structural_chunks(pages, max_tokens=80, overlap_tokens=10, min_tokens=10)
+    assert {c.metadata["page"] for c in chunks} == {1, 2}
+    for c in chunks:
+        assert estimate_tokens(c.page_content) <= 80
+        assert c.metadata["heading"] == ("الموضوع : الهواء" if c.metadata["page"] == 1 else "الهدف : الماء")
+    with pytest.raises(ValueError):
+        split_documents(pages, emb=None, chunker="fixed")
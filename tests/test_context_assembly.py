@@ -0,0 +1,60 @@
+import pytest
+
+from context_assembly import assemble_context, normalize_scores
+
+
+def test_normalize_scores_maps_each_lesson_to_0_1():
+    assert normalize_scores([(8.0, "a"), (2.0, "b"), (5.0, "c")]) == [(1.0, "a"), (0.0, "b"), (0.5, "c")]
+    assert normalize_scores([(0.3, "only")]) == [(1.0, "only")]
+    assert normalize_scores([]) == []
+
+
+def test_duplicate_goes_to_the_lesson_where_it_ranks_best():
+    # lesson A was reranked (cross-encoder logits), lesson B skipped the rerank (relevance 0..1)
+    dup = "الجلد يحمي الجسم من الجراثيم و يحس بالحرارة"
+    per_lesson = {"A": [(9.0, "الماء ضروري للحياة و للنبات"), (3.0, dup)], "B": [(0.5, dup)]}
+    _, stats = assemble_context(per_lesson, budget_tokens=1000)
+    assert stats["dropped_duplicates"] == 1
+    assert stats["per_lesson"]["A"] == "الماء ضروري للحياة و للنبات"
+    assert stats["per_lesson"]["B"] == dup
+
+
+def test_duplicates_keep_one_copy():
+    chunk = "الجلد يحمي الجسم من الجراثيم و يحس بالحرارة"
+    _, stats = assemble_context({"A": [(3.0, chunk)], "B": [(0.5, chunk)]}, budget_tokens=1000)
+    assert stats["dropped_duplicates"] == 1
+    assert stats["chunks"] == 1
+
+
+def test_adaptive_skip_returns_vector_scores_without_the_cross_encoder():
+    pytest.importorskip("crewai")
+    pytest.importorskip("langchain_community")
+    from types import SimpleNamespace
+    from retrieval import ChapterRetrieverTool
+
+    class CrossEncoder:
+        calls = 0
+
+        def score(self, pairs):
+            CrossEncoder.calls += 1
+            return [1.0] * len(pairs)
+
+    docs = [SimpleNamespace(page_content=t) for t in ("الماء", "الهواء", "التربة", "النار")]
+    store = SimpleNamespace(similarity_search_with_relevance_scores=lambda q, k: list(zip(docs, [0.95, 0.2, 0.1, 0.05])))
+    retriever = SimpleNamespace(base_retriever=SimpleNamespace(vectorstore=store, search_kwargs={"k": 4}),
+                                base_compressor=SimpleNamespace(top_n=2, model=CrossEncoder()))
+    hits = ChapterRetrieverTool(retriever, rerank="adaptive").search("شنوة الماء في حياتنا")
+    assert CrossEncoder.calls == 0                       # skipped_margin: no cross-encoder pass
+    assert hits == [(0.95, "الماء"), (0.2, "الهواء")]
+
+
+def test_headers_count_against_the_budget():
+    from context_assembly import estimate_tokens
+    chunks = {f"درس {i}": [(1.0, f"جملة رقم {i} " * 20), (0.5, f"جملة أخرى {i} " * 15)] for i in range(4)}
+    for budget in (10, 50, 100, 150, 250, 400, 1000):
+        text, stats = assemble_context(chunks, budget_tokens=budget)
+        assert stats["tokens"] == estimate_tokens(text) <= budget
+    # a chunk that fits the budget alone does not fit once its header is added
+    chunk = "ا" * 400
+    _, stats = assemble_context({"الهواء": [(1.0, chunk)]}, budget_tokens=estimate_tokens(chunk))
+    assert stats["chunks"] == 0 and stats["dropped_budget"] == 1
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("crewai")
+pytest.importorskip("langchain_community")
+from corpus import CorpusManager, estimate_retriever_mb  # noqa: E402
+
+MB = 2 ** 20
+
+
+class FakeCollection:
+    def __init__(self, n, dim, text_bytes=None, doc="نص"):
+        self.n, self.dim, self.doc = n, dim, doc
+        self.metadata = None if text_bytes is None else {"text_bytes": text_bytes}
+        self.deleted, self.limits = False, []
+
+    def count(self):
+        return self.n
+
+    def get(self, limit=None, include=()):
+        self.limits.append(limit)
+        k = min(limit or self.n, self.n)
+        return {"documents": [self.doc] * k, "embeddings": [[0.0] * self.dim] * k}
+
+
+def fake_retriever(collection):
+    store = SimpleNamespace(_collection=collection)
+    store.delete_collection = lambda: setattr(collection, "deleted", True)
+    return SimpleNamespace(base_retriever=SimpleNamespace(vectorstore=store))
+
+
+def test_estimate_reads_count_and_one_sample_only():
+    coll = FakeCollection(n=10_000, dim=384, text_bytes=3 * MB)
+    assert estimate_retriever_mb(fake_retriever(coll)) == pytest.approx(2 * 10_000 * 384 * 4 / MB + 3)
+    assert coll.limits == [32]
+    # no recorded text size: mean of the sample
+    coll = FakeCollection(n=1000, dim=0, doc="a" * 100)
+    assert estimate_retriever_mb(fake_retriever(coll)) == pytest.approx(1000 * 100 / MB)
+    assert estimate_retriever_mb(fake_retriever(FakeCollection(n=0, dim=384))) == 0.0
+
+
+def make_corpus(budget_mb):
+    built = {}
+
+    def build(pdf, collection_name, **kw):
+        built[collection_name] = FakeCollection(n=1, dim=1, text_bytes=MB)
+        return fake_retriever(built[collection_name])
+    corpus = CorpusManager([{"id": "a", "pdf": "a.pdf"}, {"id": "b", "pdf": "b.pdf", "branches": ["x"]}],
+                           ram_budget_mb=budget_mb, build=build, emb=object(), cross=object())
+    return corpus, built
+
+
+def test_pinned_book_is_evicted_once_its_request_ends():
+    corpus, built = make_corpus(budget_mb=1.5)
+    with corpus.use("a"):
+        corpus.retriever()
+        corpus.retriever("b")                       # over budget, but "a" is in use
+        assert set(corpus.stats()["resident"]) == {"a", "b"}
+        assert not built["book_a"].deleted
+    assert set(corpus.stats()["resident"]) == {"b"}
+    assert built["book_a"].deleted and corpus.evictions == 1
+
+
+def test_evict_waits_for_the_last_request():
+    corpus, built = make_corpus(budget_mb=0)
+    with corpus.use("b"):
+        with corpus.use("b"):
+            corpus.retriever()
+            assert corpus.evict("b")
+        assert "b" in corpus.stats()["resident"]
+    assert corpus.stats()["resident"] == {} and built["book_b"].deleted
@@ -0,0 +1,17 @@
+from intent import IntentRouter, summary_topic
+
+
+def test_summary_lines_route_and_name_their_topic():
+    router = IntentRouter(llm_route=lambda text: "qa")
+    for line in ("ملخص الهواء", "ملخّص الهواء", "لخصلي الهواء", "summary الهواء",
+                 "ملخص محور الهواء", "نحب ملخص على الهواء"):
+        if not line.startswith("نحب"):
+            assert router.route(line) == "summary", line
+        assert summary_topic(line) == "الهواء", line
+
+
+def test_summary_without_topic():
+    assert summary_topic("لخصلي") is None
+    assert summary_topic("ملخص محور") is None
+    assert summary_topic("سؤال: شنوة الهواء؟") is None
+    assert summary_topic("ملخص الأرض") == "الارض"          # normalized like the rules see it
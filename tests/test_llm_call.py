@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("crewai")
+from llm_call import LLMInvoker, LLMBusy, LLMTimeout, LatencyTracker  # noqa: E402
+
+
+class Reply:
+    def __init__(self, raw):
+        self.raw = raw
+
+
+def _invoker(kickoff, workers=2, **kwargs):
+    inv = LLMInvoker({}, default_deadline=0.2, hedge_quantile=0, workers=workers, **kwargs)
+    inv._kickoff = kickoff
+    return inv
+
+
+def test_abandoned_calls_hold_their_slot_and_new_calls_are_rejected():
+    release = threading.Event()
+    inv = _invoker(lambda agent, d, e: release.wait() and Reply("late"), workers=2)
+    for _ in range(2):
+        with pytest.raises(LLMTimeout):
+            inv.invoke(object(), "prompt", use="qa")
+    t0 = time.monotonic()
+    with pytest.raises(LLMBusy):
+        inv.invoke(object(), "prompt", use="qa")
+    assert time.monotonic() - t0 < 0.05              # rejected without waiting for the deadline
+    release.set()
+    time.sleep(0.05)
+    inv._kickoff = lambda agent, d, e: Reply("ok")
+    assert inv.invoke(object(), "prompt", use="qa").raw == "ok"
+    inv.close()
+
+
+def test_latency_tracker_quantile():
+    tracker = LatencyTracker()
+    for s in range(1, 21):
+        tracker.observe("qa", float(s))
+    assert tracker.quantile("qa", 0.5) in (10.0, 11.0)
+    assert tracker.quantile("summary", 0.5) is None
@@ -0,0 +1,51 @@
+from qa_cache import AnswerCache, EmbeddingCache, LastGoodCache, flush_all
+
+
+class CountingEmb:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_lru_evicts_the_least_recently_used(tmp_path):
+    cache = LastGoodCache(str(tmp_path / "last.json"), max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"                  # "b" is now the oldest
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1" and cache.get("c") == "3"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_persist_per_model(tmp_path):
+    path = str(tmp_path / "emb.json")
+    cache = EmbeddingCache(path, max_entries=10, model_name="m1", flush_every=100)
+    cache.put("سؤال: شنوة الهواء؟", [0.5, 0.25])
+    flush_all()                                   # what serve.py workers do before os._exit
+    assert EmbeddingCache(path, 10, model_name="m1").get("شنوة الهواء") == [0.5, 0.25]
+    assert len(EmbeddingCache(path, 10, model_name="m2")) == 0
+
+
+def test_embedding_cache_embeds_each_question_once(tmp_path):
+    cache, emb = EmbeddingCache(str(tmp_path / "emb.json"), 10), CountingEmb()
+    first = cache.embed_query(emb, "سؤال: شنوة الهواء؟")
+    assert cache.embed_query(emb, "شنوة الهواء") == first and emb.calls == 1
+    out = cache.embed_many(emb, ["شنوة الهواء", "وين الماء", "وين الماء"])
+    assert out[0] == first and out[1] == out[2] and emb.calls == 2
+
+
+def test_answer_cache_matches_close_questions_on_the_same_lesson(tmp_path):
+    cache = AnswerCache(str(tmp_path / "ans.json"), 10, threshold=0.9)
+    cache.put("الهواء", "خصائص الهواء", "شنوة الهواء", [1.0, 0.0], "الهواء غاز")
+    assert cache.lookup("الهواء", "خصائص الهواء", [0.99, 0.05]) == "الهواء غاز"
+    assert cache.lookup("الهواء", "خصائص الهواء", [0.5, 0.5]) is None
+    assert cache.lookup("الماء", "خصائص الهواء", [1.0, 0.0]) is None
+    assert cache.invalidate(topic="الهواء") == 1
+    assert cache.lookup("الهواء", "خصائص الهواء", [1.0, 0.0]) is None
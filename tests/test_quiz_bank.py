@@ -0,0 +1,35 @@
+from quiz_bank import QuizBank, validate_question
+from utils_text import parse_quiz_json
+
+# replies of the quiz agent, as returned (fenced, single quotes, key variants)
+IN_SCHEMA = """```json
+{"questions": [
+  {"type": "mc", "q": "شنوة الحواس الخمسة؟", "options": ["البصر و السمع", "الأكل", "النوم", "الجري"], "a": "البصر و السمع"},
+  {"type": "tf", "q": "الهواء عندو وزن", "a": "صح"}
+]}
+```"""
+WITH_VARIANTS = """{'questions': [
+  {'type': 'multiple_choice', 'question': 'وين يعيش الحوت؟', 'choices': ['في البحر', 'في الصحراء', 'في الغابة'], 'answer': 'A'},
+  {'type': 'MCQ', 'question': 'شنوة يشرب النبات؟', 'choices': ['الماء', 'الحليب'], 'correct_answer': 0},
+  {'type': 'true_false', 'statement': 'الشمس تدور حول الأرض', 'answer': 'False'}
+]}"""
+
+
+def test_generated_quizzes_are_banked(tmp_path):
+    bank = QuizBank(tmp_path, generate=lambda *a: None)
+    added = sum(bank.add("الحواس", parse_quiz_json(raw)["questions"]) for raw in (IN_SCHEMA, WITH_VARIANTS))
+    assert added == 5
+    assert bank.counts("الحواس") == {"mc": 3, "tf": 2}
+    data = bank.sample("الحواس", 3, 2, session_id="s1")
+    assert {q["a"] for q in data["questions"]} == {"البصر و السمع", "في البحر", "الماء", "صح", "خطأ"}
+    assert bank.sample("الحواس", 1, 0, session_id="s1") is None      # nothing repeats in a session
+    bank.end_session("s1")
+    assert bank.sample("الحواس", 1, 0, session_id="s1") is not None
+    bank.close()
+
+
+def test_unusable_questions_are_rejected():
+    assert validate_question({"type": "mc", "q": "x", "options": ["a"], "a": "a"}) is None
+    assert validate_question({"type": "mc", "q": "x", "options": ["a", "b"], "a": "c"}) is None
+    assert validate_question({"type": "tf", "q": "x", "a": "ربما"}) is None
+    assert validate_question("not a question") is None
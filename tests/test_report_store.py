@@ -0,0 +1,24 @@
+import time
+
+from report_store import ReportStore
+from shared_state import SharedState
+
+
+def test_reports_stay_in_memory_without_shared_state(tmp_path):
+    store = ReportStore(max_items=2, ttl=60)
+    ids = [store.put(b"%PDF-" + bytes([i]), f"s{i}") for i in range(3)]
+    assert store.get(ids[0]) is None                     # evicted by count
+    assert store.get(ids[2]) == b"%PDF-\x02"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_shared_reports_use_the_report_bounds(tmp_path):
+    shared = SharedState(str(tmp_path / "state.sqlite3"), ttl=86400)
+    store = ReportStore(max_items=1, ttl=30, shared=shared)
+    first = store.put(b"%PDF-1")
+    second = store.put(b"%PDF-2")
+    other_worker = ReportStore(ttl=30, shared=shared)
+    assert other_worker.get(second) == b"%PDF-2"
+    assert other_worker.get(first) is None               # evicted from the shared file as well
+    expires = shared._db().execute("SELECT expires FROM state WHERE key = ?", (second,)).fetchone()[0]
+    assert expires - time.time() <= 30
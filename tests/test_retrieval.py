@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("crewai")
+pytest.importorskip("langchain_community")
+from retrieval import _SearchMemo  # noqa: E402
+
+
+def test_concurrent_identical_searches_run_once():
+    memo, calls, results = _SearchMemo(), [], []
+    started = threading.Event()
+
+    def search():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return [(1.0, "الهواء")]
+
+    def ask():
+        results.append(memo.run(("r", "الهواء"), search))
+
+    first = threading.Thread(target=ask)
+    first.start()
+    started.wait()
+    waiters = [threading.Thread(target=ask) for _ in range(4)]
+    for t in waiters:
+        t.start()
+    for t in [first, *waiters]:
+        t.join()
+    assert len(calls) == 1
+    assert results == [[(1.0, "الهواء")]] * 5
+
+
+def test_waiters_get_the_failure_and_a_later_call_retries():
+    memo, started, release = _SearchMemo(), threading.Event(), threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise RuntimeError("vector store down")
+
+    def ask():
+        try:
+            memo.run(("r", "q"), failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=ask)]
+    threads[0].start()
+    started.wait()
+    threads.append(threading.Thread(target=ask))
+    threads[1].start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert errors == ["vector store down"] * 2
+    assert memo.run(("r", "q"), lambda: [(0.5, "ok")]) == [(0.5, "ok")]
+
+
+PLAN = dict(top_n=3, skip_margin=0.15, shrink_margin=0.05, shrink_to=5, title_max_words=6)
+
+
+def test_rerank_plan():
+    from retrieval import rerank_plan
+    sims = [0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2]
+    assert rerank_plan("الهواء", "درس الهواء و خصائصه", sims, **PLAN) == ("skipped_title", 0)
+    assert rerank_plan("شنوة الهواء", "الماء", [0.9, 0.7] + sims[2:], **PLAN) == ("skipped_margin", 0)
+    assert rerank_plan("شنوة الهواء", "الماء", [0.9, 0.84] + sims[2:], **PLAN) == ("shrunk", 5)
+    assert rerank_plan("شنوة الهواء", "الماء", [0.9, 0.88] + sims[2:], **PLAN) == ("full", 8)
+    # nothing would be cut: the rerank only orders, keep it
+    assert rerank_plan("الهواء", "درس الهواء", [0.9, 0.1, 0.05], **PLAN) == ("full", 3)
+    # a long query found in the chunk is not a title
+    long_q = "كيفاش نعرف الهواء موجود في الغرفة كيف ما قالت المعلمة"
+    assert rerank_plan(long_q, long_q, [0.9, 0.88] + sims[2:], **PLAN) == ("full", 8)
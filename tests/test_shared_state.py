@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+from shared_state import SharedState, SessionStore
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+
+
+def _in_children(n, fn):
+    pids = []
+    for i in range(n):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                fn(i)
+            except BaseException as e:
+                print(e, file=sys.stderr)
+                code = 1
+            os._exit(code)
+        pids.append(pid)
+    return [os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) for pid in pids]
+
+
+def test_update_json_is_atomic_across_processes(tmp_path):
+    shared = SharedState(str(tmp_path / "state.sqlite3"))
+
+    def add(i):
+        for _ in range(25):
+            shared.update_json("counter", "n", lambda v: (v or 0) + 1)
+
+    assert _in_children(4, add) == [0, 0, 0, 0]
+    assert shared.get_json("counter", "n") == 100
+
+
+def test_sessions_are_kept_per_id_and_seen_by_every_process(tmp_path):
+    store = SessionStore(SharedState(str(tmp_path / "state.sqlite3")))
+
+    def ask(i):
+        for j in range(5):
+            store.update("s1", lambda mem: mem.add_qa(f"سؤال {i}-{j}", "جواب قصير."))
+
+    assert _in_children(3, ask) == [0, 0, 0]
+    store.update("s2", lambda mem: mem.log("chapter_summary", {"title": "الماء", "slides": []}))
+    s1, s2 = store.get("s1"), store.get("s2")
+    assert len(s1["qa_history"]) == 15 and s1["qa_digest"].turns == 15
+    assert "qa_history" not in s2 and s2["chapter_summary"]["title"] == "الماء"
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    shared = SharedState(str(tmp_path / "state.sqlite3"))
+    shared.put("report", "old", b"%PDF", ttl=-1)
+    shared.put("report", "new", b"%PDF", ttl=60)
+    assert shared.get("report", "old") is None and shared.get("report", "new") == b"%PDF"
+    assert shared.cleanup() == 1
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, flight_key
+
+
+def test_flight_key_normalizes_text():
+    assert flight_key("summary", "الْهَواء", 3) == flight_key("summary", "الهواء", 3)
+
+
+def test_identical_calls_share_one_run():
+    async def main():
+        flights, runs = SingleFlight(), []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return "ملخص"
+        results = await asyncio.gather(*(flights.do(("summary", "الهواء"), work) for _ in range(5)))
+        return runs, results, len(flights)
+
+    runs, results, inflight = asyncio.run(main())
+    assert len(runs) == 1 and inflight == 0
+    assert [r for r, _ in results] == ["ملخص"] * 5
+    assert [shared for _, shared in results] == [False] + [True] * 4
+
+
+def test_followers_get_the_failure_then_the_key_is_free():
+    async def main():
+        flights = SingleFlight()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("LLM down")
+        results = await asyncio.gather(*(flights.do(("quiz", "x"), boom) for _ in range(3)),
+                                       return_exceptions=True)
+
+        async def ok():
+            return "ok"
+        return results, await flights.do(("quiz", "x"), ok)
+
+    results, retry = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert retry == ("ok", False)
+
+
+def test_a_timed_out_caller_does_not_cancel_the_work():
+    async def main():
+        flights = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            return "done"
+        with pytest.raises(asyncio.TimeoutError):
+            await flights.do("k", slow, timeout=0.01)
+        return await flights.do("k", slow)
+
+    assert asyncio.run(main()) == ("done", True)
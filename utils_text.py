@@ -79,3 +79,17 @@ def _clean_user_question(raw: str) -> str:
     if lowered.startswith(("سؤال:", "qa:")):
         return raw.split(":", 1)[1].strip()
     return raw.strip()
+
+_AR_DIACRITICS = re.compile(r"[\u064B-\u0652\u0670\u0640]")   # tashkeel + tatweel
+_PUNCT = re.compile(r"[؟?!.,،؛:;«»\"'()\-]+")
+
+def normalize_arabic(text: str) -> str:
+    """Drop diacritics/tatweel, unify alef/yaa, drop punctuation, single spaces, lower-case latin."""
+    text = _AR_DIACRITICS.sub("", text)
+    text = re.sub("[\u0622\u0623\u0625\u0671]", "\u0627", text).replace("\u0649", "\u064A")
+    text = _PUNCT.sub(" ", text)
+    return " ".join(text.split()).lower()
+
+def normalize_question(raw: str) -> str:
+    """Canonical form of a child's question (no 'سؤال:' prefix), used as a cache key."""
+    return normalize_arabic(_clean_user_question(raw))